@@ -0,0 +1,112 @@
+"""
+Бенчмарк хранилищ диалогов telegram-бота: стоимость get/append при 100k активных чатов.
+
+Запуск из корня репозитория:
+
+    python benchmarks/bench_conversation_store.py
+    python benchmarks/bench_conversation_store.py --chats 100000 --ops 20000
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "telegram-bot", "project"))
+
+from conversation_store import (  # noqa: E402
+    Conversation,
+    MemoryConversationStore,
+    SQLiteConversationStore,
+)
+
+
+def percentile(samples, q):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+
+async def fill(store, chats: int):
+    for chat_id in range(chats):
+        await store.put(
+            chat_id,
+            Conversation(
+                [
+                    {"role": "system", "content": "Компания: amazone"},
+                    {"role": "user", "content": "Как откалибровать сеялку?"},
+                    {"role": "assistant", "content": "Откройте меню калибровки. " * 20},
+                ],
+                "amazone",
+                "GPT4o",
+            ),
+        )
+
+
+async def measure(store, chats: int, ops: int):
+    rnd = random.Random(0)
+    get_times = []
+    append_times = []
+    for _ in range(ops):
+        chat_id = rnd.randrange(chats)
+        start = time.perf_counter()
+        await store.get(chat_id)
+        get_times.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await store.append(chat_id, {"role": "user", "content": "А норма высева?"})
+        append_times.append(time.perf_counter() - start)
+    return get_times, append_times
+
+
+def report(name, get_times, append_times, extra=""):
+    for op, samples in (("get", get_times), ("append", append_times)):
+        mean = sum(samples) / len(samples)
+        print(
+            f"{name:>7} {op:>6}: среднее {mean * 1e6:8.1f} мкс, "
+            f"p50 {percentile(samples, 0.5) * 1e6:8.1f} мкс, "
+            f"p99 {percentile(samples, 0.99) * 1e6:8.1f} мкс"
+        )
+    if extra:
+        print(f"{name:>7}: {extra}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--chats", type=int, default=100_000)
+    parser.add_argument("--ops", type=int, default=20_000)
+    args = parser.parse_args()
+
+    tracemalloc.start()
+    memory = MemoryConversationStore(max_chats=args.chats)
+    await fill(memory, args.chats)
+    used = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    report(
+        "memory",
+        *await measure(memory, args.chats, args.ops),
+        extra=f"{used / 1024 / 1024:.0f} МБ на {len(memory)} чатов",
+    )
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "conversations.sqlite3")
+        sqlite = SQLiteConversationStore(path)
+        start = time.perf_counter()
+        await fill(sqlite, args.chats)
+        fill_time = time.perf_counter() - start
+        report(
+            "sqlite",
+            *await measure(sqlite, args.chats, args.ops),
+            extra=f"заполнение {fill_time:.1f} с, файл "
+            f"{os.path.getsize(path) / 1024 / 1024:.0f} МБ",
+        )
+        await sqlite.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,99 @@
+"""
+Бенчмарк рендера Markdown стримящегося ответа: прежний simple_markdown_to_html
+(пять регулярок по всему накопленному тексту) против StreamingMarkdownRenderer.
+
+Ответ «в стиле инструкций» подаётся токенами; рендер вызывается на каждом
+предпросмотре. Запуск из корня репозитория:
+
+    python benchmarks/bench_markdown_render.py
+    python benchmarks/bench_markdown_render.py --chars 60000 --every 1
+"""
+
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(__file__), "..", "telegram-bot", "project")
+)
+
+from markdown_render import StreamingMarkdownRenderer  # noqa: E402
+
+
+def legacy_markdown_to_html(md_text: str) -> str:
+    """
+    Копия прежней реализации из telegram-bot/project/app.py.
+    """
+    md_text = re.sub(r"(?m)^#{3}\s+(.*?)$", r"<b>\1</b>\n", md_text)
+    md_text = re.sub(r"(?m)^#{2}\s+(.*?)$", r"<b>\1</b>\n", md_text)
+    md_text = re.sub(r"(?m)^#\s+(.*?)$", r"<b>\1</b>\n", md_text)
+    md_text = re.sub(r"\*\*(.*?)\*\*", r"<b>\1</b>", md_text, flags=re.DOTALL)
+    md_text = re.sub(r"_(.*?)_", r"<i>\1</i>", md_text, flags=re.DOTALL)
+    return md_text
+
+
+def manual_answer(chars: int, seed: int = 0) -> str:
+    rnd = random.Random(seed)
+    lines = []
+    size = 0
+    step = 1
+    while size < chars:
+        if rnd.random() < 0.1:
+            line = f"### Шаг {step}. Калибровка сеялки AMAZONE_UX_5201"
+            step += 1
+        else:
+            line = (
+                f"{step}. Откройте **меню калибровки** на терминале, выберите "
+                f"_норму высева_ и проверьте деталь KV_{rnd.randint(100, 999)}_A. "
+                "Повторите для каждого ряда дозатора."
+            )
+        lines.append(line)
+        size += len(line) + 1
+    return "\n".join(lines)
+
+
+def tokens(text: str):
+    i = 0
+    while i < len(text):
+        n = 3 + (i * 7919) % 6  # токены по 3-8 символов, детерминированно
+        yield text[i : i + n]
+        i += n
+
+
+def run(render_factory, text: str, every: int) -> float:
+    render = render_factory()
+    acc = ""
+    start = time.perf_counter()
+    for i, token in enumerate(tokens(text)):
+        acc += token
+        if i % every == 0:
+            render(acc)
+    render(acc)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--chars", type=int, default=20000)
+    parser.add_argument("--every", type=int, default=5, help="рендер каждые N токенов")
+    args = parser.parse_args()
+
+    text = manual_answer(args.chars)
+    previews = sum(1 for _ in tokens(text)) // args.every + 1
+    print(f"Ответ: {len(text)} символов, {previews} предпросмотров")
+    for name, factory in (
+        ("прежний", lambda: legacy_markdown_to_html),
+        ("потоковый", lambda: StreamingMarkdownRenderer().render),
+    ):
+        elapsed = run(factory, text, args.every)
+        print(
+            f"{name:>10}: {elapsed * 1000:8.1f} мс всего, "
+            f"{elapsed / previews * 1e6:8.1f} мкс на предпросмотр"
+        )
+
+
+if __name__ == "__main__":
+    main()
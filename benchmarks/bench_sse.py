@@ -0,0 +1,224 @@
+"""
+Микробенчмарк разбора SSE-стрима агента: старый построчный цикл против common.sse.
+
+Запуск из корня репозитория:
+
+    python benchmarks/bench_sse.py                 # синтетический стрим ~8 МБ
+    python benchmarks/bench_sse.py --input dump.sse  # записанный ответ бекенда
+
+Записанный стрим можно получить так:
+    curl -N -X POST $API_URL/api/agent -H 'Content-Type: application/json' \\
+        -d '{"chat_history": [{"role": "user", "content": "..."}]}' > dump.sse
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from unittest import mock
+
+import aiohttp
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from common.sse import aiter_sse, iter_sse  # noqa: E402
+
+
+def synth_stream(size_mb: float, seed: int = 0) -> bytes:
+    """
+    Стрим, похожий на ответ /api/agent: короткие токены, изредка metadata, в конце done.
+    """
+    rnd = random.Random(seed)
+    words = ["Калибровка", "сеялки", "AMAZONE", "UX_5201", "норма", "высева", "**шаг**"]
+    parts = []
+    size = 0
+    target = int(size_mb * 1024 * 1024)
+    while size < target:
+        if rnd.random() < 0.001:
+            meta = {
+                "tool_messages": [
+                    {"source": "document", "image": f"amazone/doc/page_{i}.png"}
+                    for i in range(8)
+                ]
+            }
+            chunk = f"event: metadata\ndata: {json.dumps(meta)}\n\n"
+        else:
+            token = {"content": rnd.choice(words) + " "}
+            chunk = f"event: data\ndata: {json.dumps(token, ensure_ascii=False)}\n\n"
+        raw = chunk.encode("utf-8")
+        parts.append(raw)
+        size += len(raw)
+    parts.append(b"event: done\ndata: {}\n\n")
+    return b"".join(parts)
+
+
+def split_chunks(stream: bytes, seed: int = 1):
+    """
+    Режем стрим на куски 1..4096 байт, как их отдаёт сеть.
+    """
+    rnd = random.Random(seed)
+    chunks = []
+    i = 0
+    while i < len(stream):
+        n = rnd.randint(1, 4096)
+        chunks.append(stream[i : i + n])
+        i += n
+    return chunks
+
+
+def make_stream_reader(chunks, loop):
+    """
+    aiohttp.StreamReader, заранее наполненный чанками, как resp.content в боте.
+    """
+    reader = aiohttp.StreamReader(mock.Mock(_reading_paused=False), 2**16, loop=loop)
+    for chunk in chunks:
+        reader.feed_data(chunk)
+    reader.feed_eof()
+    return reader
+
+
+def make_response(chunks):
+    """
+    requests.Response, отдающий чанки так же, как сокет в chat-agent-gradio.
+    """
+    response = requests.Response()
+    response.status_code = 200
+    response.encoding = "utf-8"
+    response.raw = mock.Mock(stream=lambda *args, **kwargs: iter(chunks))
+    return response
+
+
+async def bot_legacy(reader):
+    """
+    Прежний цикл из handle_message: readline, decode, buffer +=, line[6:].
+    """
+    events = 0
+    event_type = None
+    buffer = ""
+    while not reader.at_eof():
+        raw_line = await reader.readline()
+        if not raw_line:
+            break
+        line = raw_line.decode("utf-8").rstrip("\n")
+        if line.strip() == "":
+            if event_type and buffer:
+                try:
+                    json.loads(buffer)
+                except json.JSONDecodeError:
+                    pass
+                else:
+                    events += 1
+            event_type = None
+            buffer = ""
+            continue
+        if line.startswith("event:"):
+            event_type = line.split(":", 1)[1].strip()
+        elif line.startswith("data:"):
+            buffer += line[6:]
+    return events
+
+
+async def bot_new(reader):
+    events = 0
+    async for event in aiter_sse(reader.iter_any()):
+        event.json()
+        events += 1
+    return events
+
+
+def chat_legacy(response):
+    """
+    Прежний цикл из chat_with_llm_streaming на iter_lines(decode_unicode=True).
+    """
+    events = 0
+    event_type = None
+    buffer = ""
+    for line in response.iter_lines(decode_unicode=True):
+        if not line.strip():
+            if event_type and buffer:
+                try:
+                    json.loads(buffer)
+                except json.JSONDecodeError:
+                    pass
+                else:
+                    events += 1
+            event_type = None
+            buffer = ""
+            continue
+        if line.startswith("event:"):
+            event_type = line.split(":", 1)[1].strip()
+        elif line.startswith("data:"):
+            buffer += line[6:]
+    return events
+
+
+def chat_new(response):
+    events = 0
+    for event in iter_sse(response.iter_content(chunk_size=None)):
+        event.json()
+        events += 1
+    return events
+
+
+def bench_async(fn, chunks, repeat):
+    loop = asyncio.new_event_loop()
+    best = float("inf")
+    events = 0
+    try:
+        for _ in range(repeat):
+            reader = make_stream_reader(chunks, loop)
+            start = time.perf_counter()
+            events = loop.run_until_complete(fn(reader))
+            best = min(best, time.perf_counter() - start)
+    finally:
+        loop.close()
+    return best, events
+
+
+def bench_sync(fn, chunks, repeat):
+    best = float("inf")
+    events = 0
+    for _ in range(repeat):
+        response = make_response(chunks)
+        start = time.perf_counter()
+        events = fn(response)
+        best = min(best, time.perf_counter() - start)
+    return best, events
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--input", help="файл с записанным SSE-стримом")
+    parser.add_argument("--size-mb", type=float, default=8.0)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.input:
+        with open(args.input, "rb") as f:
+            stream = f.read()
+    else:
+        stream = synth_stream(args.size_mb)
+    chunks = split_chunks(stream)
+    mb = len(stream) / 1024 / 1024
+
+    print(f"Стрим: {mb:.1f} МБ, {len(chunks)} чанков")
+    cases = (
+        ("бот, прежний", bench_async, bot_legacy),
+        ("бот, common.sse", bench_async, bot_new),
+        ("чат, прежний", bench_sync, chat_legacy),
+        ("чат, common.sse", bench_sync, chat_new),
+    )
+    for name, runner, fn in cases:
+        elapsed, events = runner(fn, chunks, args.repeat)
+        print(
+            f"{name:>16}: {elapsed * 1000:8.1f} мс, {mb / elapsed:7.1f} МБ/с, "
+            f"{elapsed / events * 1e9:6.0f} нс/событие ({events} событий)"
+        )
+
+
+if __name__ == "__main__":
+    main()
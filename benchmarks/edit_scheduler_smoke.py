@@ -0,0 +1,119 @@
+"""
+Смоук-проверка финальной правки стримящегося сообщения на фейковом Telegram.
+
+Планировщик правок бота работает напрямую с FakeTelegram. Проверяется, что:
+
+- если финальный текст короче стримившегося, лишние сообщения-продолжения
+  удаляются, а не остаются с устаревшим текстом;
+- финальная версия, разметку которой Telegram не принял, доходит простым
+  текстом;
+- если не принят и простой текст, ошибку получает вызвавший finish().
+
+Запуск из корня репозитория:
+
+    python benchmarks/edit_scheduler_smoke.py
+"""
+
+import asyncio
+import os
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "telegram-bot", "project"))
+
+from aiogram import Bot  # noqa: E402
+from aiogram.bot.api import TelegramAPIServer  # noqa: E402
+
+from edit_scheduler import TELEGRAM_MESSAGE_LIMIT, EditScheduler  # noqa: E402
+from fake_telegram import FakeTelegram  # noqa: E402
+
+PORT = 18600
+CHAT_ID = 500_000
+TOKEN = "123456:ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghi"
+# Стримящийся текст на три сообщения
+LONG_TEXT = "\n".join(["строка ответа " * 20] * 40)
+SHORT_TEXT = "Короткий ответ."
+MARKDOWN = "**Жирный** ответ"
+
+
+def render(text: str) -> str:
+    return text.replace("**Жирный**", "<b>Жирный</b>")
+
+
+def html_with_bold(params: dict) -> bool:
+    return params.get("parse_mode") == "HTML" and "<b>" in params.get("text", "")
+
+
+def any_final(params: dict) -> bool:
+    return "Жирный" in params.get("text", "")
+
+
+async def stream_and_finish(reject_text, updates, final: str):
+    """
+    Отправляет сообщение, стримит в него updates и завершает final:
+    (фейковый Telegram, сообщение, ошибка finish() или None).
+    """
+    fake = FakeTelegram(reject_text=reject_text)
+    await fake.start(port=PORT)
+    bot = Bot(
+        token=TOKEN, server=TelegramAPIServer.from_base(f"http://127.0.0.1:{PORT}")
+    )
+    scheduler = EditScheduler(bot, chat_rate=100, chat_burst=100)
+    error = None
+    try:
+        first = await scheduler.send_text(CHAT_ID, "⏳")
+        message = scheduler.stream(CHAT_ID, first.message_id, render=render)
+        for text in updates:
+            message.update(text)
+            await asyncio.sleep(0.2)
+        try:
+            await message.finish(final)
+        except Exception as e:
+            error = e
+    finally:
+        await (await bot.get_session()).close()
+        await fake.stop()
+    return fake, message, error
+
+
+async def main() -> int:
+    checks = []
+
+    fake, message, error = await stream_and_finish(None, [LONG_TEXT], SHORT_TEXT)
+    sent = len(fake.calls_of("sendMessage")) - 1
+    deleted = [
+        int(call["params"]["message_id"]) for call in fake.calls_of("deleteMessage")
+    ]
+    checks.append(
+        (
+            f"короткий финал: продолжений {sent}, удалено {len(deleted)}, "
+            f"осталось сообщений {len(message.message_ids)}",
+            len(LONG_TEXT) > 2 * TELEGRAM_MESSAGE_LIMIT
+            and sent == 2
+            and len(deleted) == 2
+            and message.message_ids[0] not in deleted
+            and len(message.message_ids) == 1
+            and error is None,
+        )
+    )
+
+    fake, message, error = await stream_and_finish(html_with_bold, [], MARKDOWN)
+    last = fake.calls_of("editMessageText")[-1]["params"]
+    checks.append(
+        (
+            f"разметка не принята: финал {last.get('text')!r}, ошибка {error}",
+            last.get("text") == MARKDOWN and "parse_mode" not in last and error is None,
+        )
+    )
+
+    fake, message, error = await stream_and_finish(any_final, [], MARKDOWN)
+    checks.append((f"не принято ничего: finish() поднял {error!r}", error is not None))
+
+    for name, ok in checks:
+        print(f"{'OK  ' if ok else 'FAIL'} {name}")
+    return 0 if all(ok for _, ok in checks) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,183 @@
+"""
+Локальная замена RAG-бекенда для нагрузочных тестов и смоук-проверок.
+
+Отдаёт SSE-стримы на /api/agent и /api/agent_gigachat с настраиваемым темпом
+токенов, размером токена и metadata-событием с картинками (в конце ответа
+или до первого токена), а также ответы
+/api/search, /api/retrieve и /api/list_available_models. С search_stream
+есть и потоковый вариант поиска /api/search_stream в том же темпе токенов.
+Один из эндпоинтов агента (degraded_path) может отвечать медленно
+(доля slow_share с задержкой первого токена slow_delay) или ошибкой 500
+(доля fail_share).
+
+    backend = FakeBackend(tokens=100, token_delay=0.02, images=4)
+    await backend.start(port=8200)
+    ...
+    await backend.stop()
+"""
+
+import asyncio
+import json
+import random
+import time
+from collections import Counter
+from typing import List, Optional
+
+from aiohttp import web
+
+MODELS = ["gpt-4o", "GigaChat-MAX"]
+
+
+class FakeBackend:
+    def __init__(
+        self,
+        tokens: int = 50,
+        token_delay: float = 0.02,
+        token_size: int = 8,
+        first_token_delay: float = 0.3,
+        images: int = 0,
+        metadata_first: bool = False,
+        search_stream: bool = False,
+        degraded_path: str = "",
+        slow_share: float = 0.0,
+        slow_delay: float = 5.0,
+        fail_share: float = 0.0,
+        answer: Optional[List[str]] = None,
+        search_delay: float = 0.2,
+        retrieve_delay: float = 0.3,
+        docs: int = 10,
+        doc_size: int = 2000,
+    ):
+        # answer=[] — стрим без единого токена
+        self.answer = (
+            answer
+            if answer is not None
+            else [f"т{i}".ljust(token_size - 1, "x") + " " for i in range(tokens)]
+        )
+        self.token_delay = token_delay
+        self.first_token_delay = first_token_delay
+        self.images = images
+        self.metadata_first = metadata_first
+        self.search_stream = search_stream
+        self.degraded_path = degraded_path
+        self.slow_share = slow_share
+        self.slow_delay = slow_delay
+        self.fail_share = fail_share
+        self.search_delay = search_delay
+        self.retrieve_delay = retrieve_delay
+        self.docs = docs
+        self.doc_size = doc_size
+        self.requests: Counter = Counter()
+        self.disconnects = 0
+        # Одновременные стримы агента сейчас и в пике
+        self.active_streams = 0
+        self.peak_streams = 0
+        self._runner: Optional[web.AppRunner] = None
+
+    @property
+    def answer_text(self) -> str:
+        return "".join(self.answer)
+
+    def image_keys(self) -> List[str]:
+        return [f"docs/Руководство ZA-TS/page_{i + 1}.png" for i in range(self.images)]
+
+    def _metadata_event(self) -> bytes:
+        meta = {
+            "tool_messages": [
+                {"source": "document", "image": key} for key in self.image_keys()
+            ]
+        }
+        data = json.dumps(meta, ensure_ascii=False)
+        return f"event: metadata\ndata: {data}\n\n".encode("utf-8")
+
+    async def _agent(self, request: web.Request) -> web.StreamResponse:
+        self.requests[request.path] += 1
+        await request.read()
+        first_token_delay = self.first_token_delay
+        if request.path == self.degraded_path:
+            if random.random() < self.fail_share:
+                return web.Response(status=500, text="upstream failed")
+            if random.random() < self.slow_share:
+                first_token_delay = self.slow_delay
+        resp = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await resp.prepare(request)
+        self.active_streams += 1
+        self.peak_streams = max(self.peak_streams, self.active_streams)
+        try:
+            await asyncio.sleep(first_token_delay)
+            if self.images and self.metadata_first:
+                await resp.write(self._metadata_event())
+            for i, token in enumerate(self.answer):
+                if i:
+                    await asyncio.sleep(self.token_delay)
+                data = json.dumps({"content": token}, ensure_ascii=False)
+                await resp.write(f"event: data\ndata: {data}\n\n".encode("utf-8"))
+            if self.images and not self.metadata_first:
+                await resp.write(self._metadata_event())
+            await resp.write(b"event: done\ndata: {}\n\n")
+        except (ConnectionResetError, asyncio.CancelledError):
+            # Клиент оборвал стрим — это нормальный сценарий
+            self.disconnects += 1
+        finally:
+            self.active_streams -= 1
+        return resp
+
+    async def _search_stream(self, request: web.Request) -> web.StreamResponse:
+        self.requests[request.path] += 1
+        query = (await request.json()).get("query", "")
+        resp = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await resp.prepare(request)
+        try:
+            await asyncio.sleep(self.first_token_delay)
+            for i, token in enumerate([f"Ответ на «{query}». "] + self.answer):
+                if i:
+                    await asyncio.sleep(self.token_delay)
+                data = json.dumps({"content": token}, ensure_ascii=False)
+                await resp.write(f"event: data\ndata: {data}\n\n".encode("utf-8"))
+            await resp.write(b"event: done\ndata: {}\n\n")
+        except (ConnectionResetError, asyncio.CancelledError):
+            self.disconnects += 1
+        return resp
+
+    def _documents(self, kind: str) -> List[str]:
+        body = "Текст документа. " * (self.doc_size // 17 + 1)
+        return [f"{kind} #{i + 1}: {body[: self.doc_size]}" for i in range(self.docs)]
+
+    async def _search(self, request: web.Request) -> web.Response:
+        self.requests[request.path] += 1
+        query = (await request.json()).get("query", "")
+        await asyncio.sleep(self.search_delay)
+        return web.json_response({"answer": f"Ответ на «{query}». {self.answer_text}"})
+
+    async def _retrieve(self, request: web.Request) -> web.Response:
+        self.requests[request.path] += 1
+        await request.read()
+        await asyncio.sleep(self.retrieve_delay)
+        return web.json_response(
+            {
+                "milvus_retrieved_doc": self._documents("Milvus"),
+                "bm25_retrieved_doc": self._documents("BM25"),
+                "reranked": self._documents("Reranked"),
+            }
+        )
+
+    async def _models(self, request: web.Request) -> web.Response:
+        self.requests[request.path] += 1
+        return web.json_response({"models": MODELS, "generated_at": time.time()})
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8200):
+        app = web.Application()
+        app.router.add_post("/api/agent", self._agent)
+        app.router.add_post("/api/agent_gigachat", self._agent)
+        app.router.add_post("/api/search", self._search)
+        if self.search_stream:
+            app.router.add_post("/api/search_stream", self._search_stream)
+        app.router.add_post("/api/retrieve", self._retrieve)
+        app.router.add_get("/api/list_available_models", self._models)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
@@ -0,0 +1,111 @@
+"""
+Минимальная S3-совместимая заглушка для GetObject (path-style, как boto3
+использует его для INDEXER_S3_ENDPOINT с IP-адресом).
+
+Любой ключ существует: содержимое детерминированно генерируется по ключу,
+ETag — md5 содержимого, If-None-Match отдаёт 304. Подпись не проверяется.
+С pages=True вместо случайных байт отдаются настоящие PNG-страницы формата A4
+(нужен Pillow) — для проверки пережатия картинок.
+
+    s3 = FakeS3(object_size=300_000, latency=0.05)
+    await s3.start(port=9000)
+"""
+
+import asyncio
+import functools
+import hashlib
+from collections import Counter
+from typing import Dict, Iterable, Optional, Tuple
+
+from aiohttp import web
+
+PNG_HEADER = b"\x89PNG\r\n\x1a\n"
+
+
+@functools.lru_cache(maxsize=1)
+def _paper():
+    from PIL import Image
+
+    noise = Image.effect_noise((1654, 2339), 12).point(lambda v: 200 + v // 4)
+    return noise.convert("RGB")
+
+
+def page_png(seed: bytes) -> bytes:
+    """
+    Страница A4 при 200 dpi, похожая на скан: шум бумаги и строки «текста»
+    из серых штрихов, свои для каждого seed.
+    """
+    import io
+    import random
+
+    from PIL import ImageDraw
+
+    rng = random.Random(seed)
+    image = _paper().copy()
+    draw = ImageDraw.Draw(image)
+    for y in range(150, 2200, 36):
+        x = 120
+        while x < 1500:
+            width = rng.randint(20, 120)
+            shade = rng.randint(0, 90)
+            draw.rectangle((x, y, x + width, y + 18), fill=(shade, shade, shade))
+            x += width + rng.randint(10, 25)
+    out = io.BytesIO()
+    image.save(out, "PNG")
+    return out.getvalue()
+
+
+class FakeS3:
+    def __init__(
+        self, object_size: int = 200_000, latency: float = 0.05, pages: bool = False
+    ):
+        self.object_size = object_size
+        self.latency = latency
+        self.pages = pages
+        self.requests: Counter = Counter()
+        self._objects: Dict[str, Tuple[bytes, str]] = {}
+        self._runner: Optional[web.AppRunner] = None
+
+    def _object(self, key: str) -> Tuple[bytes, str]:
+        obj = self._objects.get(key)
+        if obj is None:
+            seed = hashlib.sha256(key.encode("utf-8")).digest()
+            if self.pages:
+                body = page_png(seed)
+            else:
+                body = PNG_HEADER + (seed * (self.object_size // len(seed) + 1))
+                body = body[: self.object_size]
+            obj = self._objects[key] = (body, hashlib.md5(body).hexdigest())
+        return obj
+
+    async def _get(self, request: web.Request) -> web.Response:
+        key = request.match_info["key"]
+        await asyncio.sleep(self.latency)
+        # Генерация PNG-страницы занимает CPU — не держим event loop
+        loop = asyncio.get_event_loop()
+        body, etag = await loop.run_in_executor(None, self._object, key)
+        headers = {"ETag": f'"{etag}"', "Content-Type": "image/png"}
+        if request.headers.get("If-None-Match") == f'"{etag}"':
+            self.requests["not_modified"] += 1
+            return web.Response(status=304, headers=headers)
+        self.requests["get"] += 1
+        return web.Response(body=body, headers=headers)
+
+    async def warm(self, keys: Iterable[str]):
+        """
+        Заранее генерирует объекты, чтобы это не попадало в замер.
+        """
+        loop = asyncio.get_event_loop()
+        for key in keys:
+            await loop.run_in_executor(None, self._object, key)
+
+    async def start(self, host: str = "127.0.0.1", port: int = 9000):
+        app = web.Application()
+        app.router.add_get("/{bucket}/{key:.+}", self._get)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
@@ -0,0 +1,123 @@
+"""
+Минимальная локальная замена Telegram Bot API для проверок бота без сети.
+
+Бот направляется сюда через TELEGRAM_API_URL=http://127.0.0.1:<port>.
+Поддерживаются методы, которые вызывает бот; все вызовы записываются в calls.
+reject_text(params) -> True отклоняет sendMessage/editMessageText так, как
+Telegram отклоняет сломанную разметку.
+
+    fake = FakeTelegram()
+    await fake.start(port=8081)
+    ...
+    await fake.stop()
+"""
+
+import itertools
+import json
+import time
+from typing import Callable, Dict, List, Optional
+
+from aiohttp import web
+
+
+class FakeTelegram:
+    def __init__(self, reject_text: Optional[Callable[[Dict], bool]] = None):
+        self.calls: List[Dict] = []
+        self.reject_text = reject_text
+        self.webhook_url: Optional[str] = None
+        # Сколько байт фото загружено через sendPhoto/sendMediaGroup
+        self.uploaded_bytes = 0
+        self._message_ids = itertools.count(1000)
+        self._file_ids = itertools.count(1)
+        self._runner: Optional[web.AppRunner] = None
+
+    def calls_of(self, method: str) -> List[Dict]:
+        return [call for call in self.calls if call["method"] == method]
+
+    def _message(self, params: Dict, **fields) -> Dict:
+        chat_id = int(params.get("chat_id", 0))
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+        }
+        message.update(fields)
+        return message
+
+    def _photo(self) -> Dict:
+        return {
+            "file_id": f"file-{next(self._file_ids)}",
+            "file_unique_id": "u",
+            "width": 1,
+            "height": 1,
+        }
+
+    def _result(self, method: str, params: Dict):
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "Fake", "username": "fake"}
+        if method in ("sendMessage", "editMessageText"):
+            message = self._message(params, text=params.get("text", ""))
+            if method == "editMessageText":
+                message["message_id"] = int(params.get("message_id", 0))
+            return message
+        if method == "sendPhoto":
+            return self._message(params, photo=[self._photo()])
+        if method == "sendMediaGroup":
+            return [
+                self._message(params, photo=[self._photo()])
+                for _ in json.loads(params.get("media", "[]"))
+            ]
+        if method == "setWebhook":
+            self.webhook_url = params.get("url")
+            return True
+        if method == "deleteWebhook":
+            self.webhook_url = None
+            return True
+        return True
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = dict(await request.post())
+        for name, value in list(params.items()):
+            if isinstance(value, web.FileField):
+                self.uploaded_bytes += len(value.file.read())
+                params[name] = value.filename
+        self.calls.append({"method": method, "params": params, "at": time.time()})
+        # attach:// допустим только внутри media у sendMediaGroup
+        if method == "sendPhoto" and str(params.get("photo", "")).startswith(
+            "attach://"
+        ):
+            return web.json_response(
+                {
+                    "ok": False,
+                    "error_code": 400,
+                    "description": "Bad Request: wrong remote file identifier specified",
+                },
+                status=400,
+            )
+        if (
+            method in ("sendMessage", "editMessageText")
+            and self.reject_text is not None
+            and self.reject_text(params)
+        ):
+            return web.json_response(
+                {
+                    "ok": False,
+                    "error_code": 400,
+                    "description": "Bad Request: can't parse entities",
+                },
+                status=400,
+            )
+        return web.json_response({"ok": True, "result": self._result(method, params)})
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8081):
+        # Медиагруппа из полноразмерных страниц легко больше 1 МБ по умолчанию
+        app = web.Application(client_max_size=100 * 1024 * 1024)
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
@@ -0,0 +1,210 @@
+"""
+Смоук-проверка ответа бота при пустом, упавшем и медленном стриме бекенда
+с хеджированием и без него.
+
+Бот импортируется в этом процессе, как в load_test.py, и отвечает на
+сообщение через фейки Telegram и бекенда. Проверяется последний текст,
+который увидел пользователь:
+
+- без HEDGING стрим 200 без data и metadata даёт «Пустой ответ от
+  ассистента.», а не «Ошибка при обращении к API.»;
+- с HEDGING то же, если пустой стрим отдали оба эндпоинта;
+- с HEDGING ответ 500 или медленный первый токен основного эндпоинта
+  подменяются ответом запасного.
+
+Затем много чатов одновременно пишут медленному бекенду, и проверяется, что
+хеджирование не выводит число стримов к бекенду за MAX_UPSTREAM_STREAMS
+(запасной стрим берёт свободный слот или не запускается), а доля
+подстрахованных запросов не превышает HEDGE_BUDGET.
+
+Запуск из корня репозитория:
+
+    python benchmarks/hedging_smoke.py
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from fake_backend import FakeBackend  # noqa: E402
+from fake_telegram import FakeTelegram  # noqa: E402
+from load_test import load_module  # noqa: E402
+
+PORT = 18300
+EMPTY_ANSWER = "Пустой ответ от ассистента."
+API_ERROR = "Ошибка при обращении к API."
+ANSWER_TOKENS = ["Ответ ", "от ", "бекенда."]
+ANSWER_TEXT = "".join(ANSWER_TOKENS)
+# Медленный бекенд: чатов и предел стримов (свободных слотов на всех
+# запасных не хватит) и чатов для проверки бюджета
+SLOW_CHATS = 6
+SLOW_LIMIT = 8
+BUDGET_CHATS = 12
+
+# Название, HEDGING, параметры FakeBackend, ожидаемый текст
+SCENARIOS = [
+    ("пустой стрим без хеджирования", False, {"answer": []}, EMPTY_ANSWER),
+    ("пустой стрим на обоих эндпоинтах", True, {"answer": []}, EMPTY_ANSWER),
+    ("500 без хеджирования", False, {"fail_share": 1.0}, API_ERROR),
+    ("500 основного эндпоинта", True, {"fail_share": 1.0}, ANSWER_TEXT),
+    (
+        "медленный основной эндпоинт",
+        True,
+        {"slow_share": 1.0, "slow_delay": 5.0},
+        ANSWER_TEXT,
+    ),
+]
+
+
+def last_text(fake_telegram: FakeTelegram, chat_id: int) -> str:
+    texts = [
+        call["params"].get("text", "")
+        for call in fake_telegram.calls
+        if call["method"] in ("sendMessage", "editMessageText")
+        and int(call["params"].get("chat_id", 0)) == chat_id
+    ]
+    return texts[-1] if texts else ""
+
+
+def text_message(chat_id: int, text: str):
+    from aiogram import types
+
+    return types.Message.to_object(
+        {
+            "message_id": 1,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "U"},
+            "text": text,
+        }
+    )
+
+
+def use_hedger(app, hedging: bool, limit: int, budget: float):
+    """
+    Свежие лимитер и хеджер в приложении. Дедлайн короткий, чтобы
+    медленный эндпоинт подстраховывался сразу.
+    """
+    from hedging import HedgeBudget, LatencyTracker, StreamHedger
+    from inflight import StreamLimiter
+
+    app.upstream = StreamLimiter(limit=limit)
+    app.hedger = StreamHedger(
+        enabled=hedging,
+        tracker=LatencyTracker(default=0.5, min_delay=0.1),
+        limiter=app.upstream,
+        budget=HedgeBudget(share=budget),
+    )
+
+
+async def ask(app, chat_ids, backend_options: dict):
+    """
+    Один вопрос из каждого чата одновременно; последние тексты чатов и
+    фейковый бекенд для статистики.
+    """
+    from conversation_store import Conversation
+
+    backend = FakeBackend(
+        answer=backend_options.pop("answer", ANSWER_TOKENS),
+        first_token_delay=0.1,
+        token_delay=0.01,
+        degraded_path="/api/agent",
+        **backend_options,
+    )
+    fake_telegram = FakeTelegram()
+    await backend.start(port=PORT)
+    await fake_telegram.start(port=PORT + 1)
+    try:
+        for chat_id in chat_ids:
+            await app.conversations.put(
+                chat_id, Conversation([], company="amazone", model="GPT4o")
+            )
+        await asyncio.gather(
+            *(
+                app.handle_message(text_message(chat_id, f"Вопрос {chat_id}"))
+                for chat_id in chat_ids
+            )
+        )
+        return [last_text(fake_telegram, chat_id) for chat_id in chat_ids], backend
+    finally:
+        await fake_telegram.stop()
+        await backend.stop()
+
+
+async def run_scenario(app, index: int, hedging: bool, backend_options: dict) -> str:
+    use_hedger(app, hedging, limit=16, budget=1.0)
+    texts, _ = await ask(app, [200_000 + index], backend_options)
+    return texts[0]
+
+
+async def run_slow_backend(app, first_chat: int, chats: int, limit: int, budget: float):
+    """
+    Медленный основной эндпоинт у всех чатов сразу: (стримов в пике,
+    подстраховано запросов, все ли получили ответ).
+    """
+    use_hedger(app, True, limit=limit, budget=budget)
+    chat_ids = range(first_chat, first_chat + chats)
+    texts, backend = await ask(app, chat_ids, {"slow_share": 1.0, "slow_delay": 1.0})
+    hedged = backend.requests["/api/agent_gigachat"]
+    answered = all(text == ANSWER_TEXT for text in texts)
+    return backend.peak_streams, hedged, answered
+
+
+async def main() -> int:
+    from aiogram import Bot, Dispatcher
+
+    os.environ.update(
+        API_URL=f"http://127.0.0.1:{PORT}",
+        TELEGRAM_API_URL=f"http://127.0.0.1:{PORT + 1}",
+        BOT_TOKEN="123456:ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghi",
+        IMAGE_CACHE_DIR=tempfile.mkdtemp(prefix="hedging-smoke-"),
+        CONVERSATION_STORE="memory",
+        METRICS_PORT="0",
+    )
+    app = load_module(
+        "bot_app", os.path.join(ROOT, "telegram-bot", "project", "app.py")
+    )
+    Bot.set_current(app.bot)
+    Dispatcher.set_current(app.dp)
+
+    failures = 0
+    try:
+        for index, (name, hedging, options, expected) in enumerate(SCENARIOS):
+            text = await run_scenario(app, index, hedging, dict(options))
+            ok = text == expected
+            failures += not ok
+            print(f"{'OK  ' if ok else 'FAIL'} {name}: {text!r}")
+
+        peak, hedged, answered = await run_slow_backend(
+            app, 300_000, SLOW_CHATS, SLOW_LIMIT, budget=1.0
+        )
+        ok = peak <= SLOW_LIMIT and hedged > 0 and answered
+        failures += not ok
+        print(
+            f"{'OK  ' if ok else 'FAIL'} медленный бекенд, {SLOW_CHATS} чатов: "
+            f"стримов в пике {peak} при пределе {SLOW_LIMIT}, "
+            f"подстраховано {hedged}"
+        )
+
+        peak, hedged, answered = await run_slow_backend(
+            app, 400_000, BUDGET_CHATS, 2 * BUDGET_CHATS, budget=0.25
+        )
+        ok = 0 < hedged <= BUDGET_CHATS * 0.25 and answered
+        failures += not ok
+        print(
+            f"{'OK  ' if ok else 'FAIL'} бюджет 25%: подстраховано {hedged} "
+            f"из {BUDGET_CHATS}"
+        )
+    finally:
+        await app.on_shutdown(app.dp)
+        await (await app.bot.get_session()).close()
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,396 @@
+"""
+Нагрузочный тест фронтендов на локальных фейках бекенда, Telegram и S3.
+
+Фейки поднимаются в этом же процессе, приложение импортируется с переменными
+окружения, указывающими на них, и его обработчики вызываются напрямую
+N параллельными пользователями:
+
+- bot    — handle_message telegram-бота (стрим, правки, картинки из S3);
+- chat   — асинхронный генератор chat_with_llm_streaming из chat-agent-gradio;
+- search — генератор search_and_retrieve из search-gradio.
+
+Отчёт: p50/p99 полной задержки и времени до первого токена, пропускная
+способность и пиковое потребление памяти процессом.
+
+Запуск из корня репозитория:
+
+    python benchmarks/load_test.py bot --users 50 --requests 4 --images 4
+    python benchmarks/load_test.py chat --users 20 --tokens 200
+    python benchmarks/load_test.py search --users 20
+
+Лимиты Telegram в тесте те же, что в проде (TELEGRAM_GLOBAL_RATE и т.д.),
+поэтому для бота они часто и есть узкое место.
+"""
+
+import argparse
+import asyncio
+import importlib.util
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from fake_backend import FakeBackend  # noqa: E402
+from fake_s3 import FakeS3  # noqa: E402
+from fake_telegram import FakeTelegram  # noqa: E402
+
+
+def percentile(samples, q):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss в Linux — в килобайтах
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def load_module(name: str, path: str):
+    """
+    app.py всех приложений называются одинаково — грузим под разными именами.
+    """
+    project = os.path.dirname(path)
+    if project not in sys.path:
+        sys.path.insert(0, project)
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+async def load_gradio_app(name: str, directory: str):
+    """
+    Импорт в отдельном потоке: Gradio-приложение может синхронно ходить
+    в бекенд при импорте, а фейковый бекенд работает в этом event loop.
+    """
+    loop = asyncio.get_event_loop()
+    path = os.path.join(ROOT, directory, "project", "app.py")
+    return await loop.run_in_executor(None, load_module, name, path)
+
+
+def report(
+    name: str,
+    latencies: List[float],
+    first_tokens: List[float],
+    errors: int,
+    wall: float,
+    rss_before: float,
+):
+    print(f"{name}: {len(latencies)} запросов за {wall:.1f} с, ошибок {errors}")
+    if latencies:
+        print(
+            f"  задержка:       p50 {percentile(latencies, 0.5) * 1000:8.0f} мс, "
+            f"p99 {percentile(latencies, 0.99) * 1000:8.0f} мс"
+        )
+    if first_tokens:
+        print(
+            f"  первый токен:   p50 {percentile(first_tokens, 0.5) * 1000:8.0f} мс, "
+            f"p99 {percentile(first_tokens, 0.99) * 1000:8.0f} мс"
+        )
+    print(f"  пропускная способность: {len(latencies) / wall:.1f} запросов/с")
+    print(f"  пик RSS: {peak_rss_mb():.0f} МБ (до нагрузки {rss_before:.0f} МБ)")
+
+
+async def run_bot(args, fake_telegram: FakeTelegram, backend: FakeBackend):
+    from aiogram import Bot, Dispatcher, types
+
+    app = load_module(
+        "bot_app", os.path.join(ROOT, "telegram-bot", "project", "app.py")
+    )
+    from conversation_store import Conversation
+
+    Bot.set_current(app.bot)
+    Dispatcher.set_current(app.dp)
+
+    latencies, first_tokens = [], []
+    errors = 0
+
+    def first_token_after(chat_id: int, started_at: float) -> Optional[float]:
+        for call in fake_telegram.calls:
+            params = call["params"]
+            if (
+                call["at"] >= started_at
+                and call["method"] == "editMessageText"
+                and int(params.get("chat_id", 0)) == chat_id
+                and not params.get("text", "").startswith("⏳")
+            ):
+                return call["at"] - started_at
+        return None
+
+    async def user(index: int):
+        nonlocal errors
+        chat_id = 100_000 + index
+        await app.conversations.put(
+            chat_id, Conversation([], company="amazone", model=args.model)
+        )
+        for request in range(args.requests):
+            message = types.Message.to_object(
+                {
+                    "message_id": request + 1,
+                    "date": int(time.time()),
+                    "chat": {"id": chat_id, "type": "private"},
+                    "from": {"id": chat_id, "is_bot": False, "first_name": "U"},
+                    "text": (
+                        f"Вопрос {request}"
+                        if args.same_questions
+                        else f"Вопрос {request} от пользователя {index}"
+                    ),
+                }
+            )
+            started_at = time.time()
+            start = time.perf_counter()
+            try:
+                await app.handle_message(message)
+            except Exception as e:
+                errors += 1
+                print(f"Ошибка в чате {chat_id}: {e}")
+                continue
+            latencies.append(time.perf_counter() - start)
+            first_token = first_token_after(chat_id, started_at)
+            if first_token is not None:
+                first_tokens.append(first_token)
+
+    rss_before = peak_rss_mb()
+    start = time.perf_counter()
+    await asyncio.gather(*(user(i) for i in range(args.users)))
+    wall = time.perf_counter() - start
+    report("bot", latencies, first_tokens, errors, wall, rss_before)
+    print(
+        f"  вызовов Bot API: {len(fake_telegram.calls)}, "
+        f"RetryAfter: {app.edits.retry_after_count}, "
+        f"пропущено правок: {app.edits.skipped_count}"
+    )
+    print(f"  кеш картинок: {app.image_cache_stats()}")
+    print(f"  загружено в Telegram: {fake_telegram.uploaded_bytes / 1024:.0f} КБ")
+    print(f"  кеш ответов: {app.answer_cache.stats()}")
+    api_errors = sum(
+        1
+        for call in fake_telegram.calls
+        if call["params"].get("text") == "Ошибка при обращении к API."
+    )
+    print(f"  ответов «Ошибка при обращении к API.»: {api_errors}")
+    print(f"  хеджирование: {app.hedger.tracker.stats()}")
+    print(f"  бюджет хеджирования: {app.hedger.budget.stats()}")
+    print(f"  стримов к бекенду в пике: {backend.peak_streams}")
+    await app.on_shutdown(app.dp)
+    await (await app.bot.get_session()).close()
+
+
+def run_threads(args, work) -> tuple:
+    """
+    Синхронные обработчики Gradio: каждый пользователь — отдельный поток.
+    """
+    latencies, first_tokens = [], []
+    errors = 0
+
+    def user(index: int):
+        nonlocal errors
+        for request in range(args.requests):
+            start = time.perf_counter()
+            try:
+                first_token = work(index, request)
+            except Exception as e:
+                errors += 1
+                print(f"Ошибка у пользователя {index}: {e}")
+                continue
+            latencies.append(time.perf_counter() - start)
+            if first_token is not None:
+                first_tokens.append(first_token - start)
+
+    with ThreadPoolExecutor(max_workers=args.users) as pool:
+        list(pool.map(user, range(args.users)))
+    return latencies, first_tokens, errors
+
+
+async def run_chat(args):
+    app = await load_gradio_app("chat_app", "chat-agent-gradio")
+    latencies, first_tokens = [], []
+    errors = 0
+    # Что Gradio отправил бы в браузер: каждый yield — весь текст ответа
+    updates = sent_bytes = 0
+
+    # Обработчик асинхронный — все пользователи в этом же event loop
+    async def user(index: int):
+        nonlocal errors, updates, sent_bytes
+        for request in range(args.requests):
+            start = time.perf_counter()
+            first_token = None
+            try:
+                async for text in app.chat_with_llm_streaming(f"Вопрос {request}", []):
+                    updates += 1
+                    sent_bytes += len(text.encode("utf-8"))
+                    if first_token is None:
+                        first_token = time.perf_counter() - start
+            except Exception as e:
+                errors += 1
+                print(f"Ошибка у пользователя {index}: {e}")
+                continue
+            latencies.append(time.perf_counter() - start)
+            if first_token is not None:
+                first_tokens.append(first_token)
+
+    rss_before = peak_rss_mb()
+    start = time.perf_counter()
+    await asyncio.gather(*(user(i) for i in range(args.users)))
+    report(
+        "chat", latencies, first_tokens, errors, time.perf_counter() - start, rss_before
+    )
+    answers = max(1, len(latencies))
+    print(
+        f"  обновлений на ответ: {updates / answers:.0f}, "
+        f"байт на ответ: {sent_bytes / answers:.0f}"
+    )
+    print(f"  потоков в процессе: {threading.active_count()}")
+    print(f"  кеш ответов: {app.answer_cache.stats()}")
+    await app.backend.close()
+
+
+async def run_search(args):
+    app = await load_gradio_app("search_app", "search-gradio")
+
+    updates = answers = 0
+
+    def work(index: int, request: int) -> Optional[float]:
+        nonlocal updates, answers
+        # Первый «токен» — первый текст в поле LLM Answer
+        first_text = None
+        if args.distinct_queries:
+            query = f"Вопрос {(index + request) % args.distinct_queries}"
+        else:
+            query = f"Вопрос {request} от {index}"
+        for outputs in app.search_and_retrieve(query, "gpt-4o"):
+            if isinstance(outputs[0], str):
+                updates += 1
+                if first_text is None:
+                    first_text = time.perf_counter()
+        answers += 1
+        return first_text
+
+    rss_before = peak_rss_mb()
+    start = time.perf_counter()
+    loop = asyncio.get_event_loop()
+    result = await loop.run_in_executor(None, run_threads, args, work)
+    report("search", *result, time.perf_counter() - start, rss_before)
+    print(f"  обновлений ответа на запрос: {updates / max(1, answers):.0f}")
+    print(f"  кеш поиска: {app.query_cache.stats()}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("target", choices=["bot", "chat", "search"])
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=3, help="на пользователя")
+    parser.add_argument("--tokens", type=int, default=100)
+    parser.add_argument("--token-delay", type=float, default=0.02)
+    parser.add_argument("--token-size", type=int, default=8)
+    parser.add_argument("--first-token-delay", type=float, default=0.3)
+    parser.add_argument("--images", type=int, default=0, help="картинок в ответе")
+    parser.add_argument(
+        "--metadata-first",
+        action="store_true",
+        help="картинки приходят до первого токена, а не после ответа",
+    )
+    parser.add_argument(
+        "--real-pages",
+        action="store_true",
+        help="S3 отдаёт настоящие PNG-страницы A4 вместо случайных байт",
+    )
+    parser.add_argument("--object-size", type=int, default=200_000)
+    parser.add_argument("--s3-latency", type=float, default=0.05)
+    parser.add_argument("--model", default="GPT4o", choices=["GPT4o", "GigaChat-MAX"])
+    parser.add_argument(
+        "--same-questions",
+        action="store_true",
+        help="bot: все пользователи задают одни и те же вопросы",
+    )
+    parser.add_argument(
+        "--distinct-queries",
+        type=int,
+        default=0,
+        help="search: сколько разных запросов задают пользователи (0 — все разные)",
+    )
+    parser.add_argument(
+        "--search-stream",
+        action="store_true",
+        help="search: бекенд умеет потоковый /api/search_stream",
+    )
+    parser.add_argument(
+        "--slow-share",
+        type=float,
+        default=0.0,
+        help="bot: доля медленных ответов эндпоинта выбранной модели",
+    )
+    parser.add_argument(
+        "--slow-delay", type=float, default=5.0, help="первый токен медленного ответа"
+    )
+    parser.add_argument(
+        "--fail-share",
+        type=float,
+        default=0.0,
+        help="bot: доля ответов 500 от эндпоинта выбранной модели",
+    )
+    parser.add_argument("--port", type=int, default=18200)
+    args = parser.parse_args()
+
+    backend = FakeBackend(
+        tokens=args.tokens,
+        token_delay=args.token_delay,
+        token_size=args.token_size,
+        first_token_delay=args.first_token_delay,
+        images=args.images,
+        metadata_first=args.metadata_first,
+        search_stream=args.search_stream,
+        degraded_path="/api/agent" if args.model == "GPT4o" else "/api/agent_gigachat",
+        slow_share=args.slow_share,
+        slow_delay=args.slow_delay,
+        fail_share=args.fail_share,
+        # Обычный /api/search отвечает, когда модель дописала ответ целиком
+        search_delay=args.first_token_delay + args.tokens * args.token_delay,
+    )
+    fake_telegram = FakeTelegram()
+    s3 = FakeS3(
+        object_size=args.object_size, latency=args.s3_latency, pages=args.real_pages
+    )
+    await backend.start(port=args.port)
+    await fake_telegram.start(port=args.port + 1)
+    await s3.start(port=args.port + 2)
+    if args.real_pages:
+        await s3.warm(backend.image_keys())
+
+    # Приложения читают настройки из окружения при импорте
+    os.environ.update(
+        API_URL=f"http://127.0.0.1:{args.port}",
+        TELEGRAM_API_URL=f"http://127.0.0.1:{args.port + 1}",
+        BOT_TOKEN="123456:ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghi",
+        INDEXER_S3_ENDPOINT=f"http://127.0.0.1:{args.port + 2}",
+        INDEXER_S3_ACCESS_KEY="fake",
+        INDEXER_S3_SECRET_KEY="fake",
+        IMAGE_CACHE_DIR=tempfile.mkdtemp(prefix="load-test-"),
+        CONVERSATION_STORE="memory",
+        METRICS_PORT="0",
+    )
+    try:
+        if args.target == "bot":
+            await run_bot(args, fake_telegram, backend)
+        elif args.target == "chat":
+            await run_chat(args)
+        else:
+            await run_search(args)
+        print(f"  запросов к бекенду: {dict(backend.requests)}")
+        if args.images:
+            print(f"  запросов к S3: {dict(s3.requests)}")
+    finally:
+        await s3.stop()
+        await fake_telegram.stop()
+        await backend.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
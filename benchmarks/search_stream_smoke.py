@@ -0,0 +1,85 @@
+"""
+Смоук-проверка потокового ответа search-gradio при одинаковых запросах.
+
+Поиск импортируется в этом процессе, как в load_test.py, и ходит в фейковый
+бекенд с /api/search_stream. Два одинаковых запроса идут одновременно:
+второй начинается, когда первый уже читает стрим, и присоединяется к нему
+(singleflight). Проверяется, что:
+
+- к бекенду ушёл один стрим;
+- оба запроса получили промежуточный текст ("partial"), а не только готовый
+  ответ;
+- оба получили одинаковый полный ответ.
+
+Запуск из корня репозитория:
+
+    python benchmarks/search_stream_smoke.py
+"""
+
+import asyncio
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from fake_backend import FakeBackend  # noqa: E402
+from load_test import load_gradio_app  # noqa: E402
+
+PORT = 18500
+QUERY = "Как отрегулировать высеивающий аппарат"
+# Через сколько секунд после первого запроса начинается второй
+JOIN_DELAY = 0.5
+
+
+def collect(app, delay: float) -> dict:
+    """
+    Число промежуточных обновлений и ответ одного запроса.
+    """
+    time.sleep(delay)
+    partials = 0
+    answer = None
+    for kind, result in app.search_results(QUERY, "gpt-4o", stream=True):
+        if kind == "partial":
+            partials += 1
+        elif kind == "answer":
+            answer = result
+    return {"partials": partials, "answer": answer}
+
+
+async def main() -> int:
+    backend = FakeBackend(
+        search_stream=True, tokens=40, token_delay=0.05, first_token_delay=0.2
+    )
+    await backend.start(port=PORT)
+    os.environ.update(API_URL=f"http://127.0.0.1:{PORT}", METRICS_PORT="0")
+    try:
+        app = await load_gradio_app("search_app", "search-gradio")
+        loop = asyncio.get_event_loop()
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            first, second = await asyncio.gather(
+                loop.run_in_executor(pool, collect, app, 0.0),
+                loop.run_in_executor(pool, collect, app, JOIN_DELAY),
+            )
+    finally:
+        await backend.stop()
+
+    streams = backend.requests["/api/search_stream"]
+    checks = [
+        (f"один стрим к бекенду: {streams}", streams == 1),
+        (f"первый запрос, обновлений: {first['partials']}", first["partials"] > 0),
+        (f"второй запрос, обновлений: {second['partials']}", second["partials"] > 0),
+        (
+            "одинаковый полный ответ",
+            first["answer"] is not None and first["answer"] == second["answer"],
+        ),
+    ]
+    for name, ok in checks:
+        print(f"{'OK  ' if ok else 'FAIL'} {name}")
+    return 0 if all(ok for _, ok in checks) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,206 @@
+"""
+Смоук-проверка webhook-режима бота на локальных фейках Telegram и бекенда.
+
+Скрипт поднимает FakeTelegram и медленный SSE-бекенд, запускает app.py с
+BOT_MODE=webhook и несколькими воркерами и проверяет:
+
+- setWebhook вызван с секретом, /healthz и /readyz отвечают;
+- запрос с неверным секретом отклоняется;
+- /start из множества чатов обработан ровно один раз для каждого чата;
+- /metrics роутера собирает метрики всех воркеров;
+- SIGTERM во время стрима ответа не обрывает его: финальная правка доходит.
+
+Запуск из корня репозитория:
+
+    python benchmarks/webhook_smoke.py
+    python benchmarks/webhook_smoke.py --workers 4 --chats 200
+"""
+
+import argparse
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+from fake_backend import FakeBackend
+from fake_telegram import FakeTelegram
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+BOT_DIR = os.path.join(ROOT, "telegram-bot", "project")
+
+SECRET = "smoke-secret"
+ANSWER_TOKENS = ["Ответ ", "приходит ", "по ", "частям, ", "токен ", "за токеном."]
+
+
+def message_update(update_id: int, chat_id: int, text: str) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "User"},
+            "text": text,
+            **(
+                {"entities": [{"type": "bot_command", "offset": 0, "length": 6}]}
+                if text == "/start"
+                else {}
+            ),
+        },
+    }
+
+
+def callback_update(update_id: int, chat_id: int, data: str) -> dict:
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": {"id": chat_id, "is_bot": False, "first_name": "User"},
+            "chat_instance": "1",
+            "data": data,
+            "message": {
+                "message_id": 1,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": "...",
+            },
+        },
+    }
+
+
+async def wait_for(predicate, timeout: float, what: str):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError(f"Не дождались: {what}")
+        await asyncio.sleep(0.1)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--chats", type=int, default=50)
+    parser.add_argument("--port", type=int, default=18080)
+    args = parser.parse_args()
+
+    telegram_port, backend_port = args.port + 1, args.port + 2
+    fake = FakeTelegram()
+    await fake.start(port=telegram_port)
+
+    # Медленный стрим: SIGTERM придёт посреди ответа
+    backend = FakeBackend(answer=ANSWER_TOKENS, first_token_delay=0.5, token_delay=0.5)
+    await backend.start(port=backend_port)
+
+    env = dict(
+        os.environ,
+        PYTHONPATH=ROOT,
+        BOT_TOKEN="123456:ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghi",
+        BOT_MODE="webhook",
+        TELEGRAM_API_URL=f"http://127.0.0.1:{telegram_port}",
+        API_URL=f"http://127.0.0.1:{backend_port}",
+        WEBHOOK_HOST=f"http://127.0.0.1:{args.port}",
+        WEBHOOK_SECRET=SECRET,
+        WEBHOOK_LISTEN_HOST="127.0.0.1",
+        WEBHOOK_LISTEN_PORT=str(args.port),
+        WEBHOOK_WORKERS=str(args.workers),
+        WEBHOOK_WORKER_BASE_PORT=str(args.port + 100),
+        WEBHOOK_DRAIN_TIMEOUT="20",
+        CONVERSATION_STORE="memory",
+        IMAGE_CACHE_DIR=tempfile.mkdtemp(prefix="webhook-smoke-"),
+    )
+    process = subprocess.Popen([sys.executable, "app.py"], cwd=BOT_DIR, env=env)
+    base = f"http://127.0.0.1:{args.port}"
+    headers = {"X-Telegram-Bot-Api-Secret-Token": SECRET}
+    try:
+        async with aiohttp.ClientSession() as session:
+
+            async def ready() -> bool:
+                try:
+                    async with session.get(f"{base}/readyz") as resp:
+                        return resp.status == 200
+                except aiohttp.ClientError:
+                    return False
+
+            deadline = time.monotonic() + 30
+            while not await ready():
+                assert time.monotonic() < deadline, "бот не стал готов за 30 с"
+                await asyncio.sleep(0.2)
+            async with session.get(f"{base}/healthz") as resp:
+                assert resp.status == 200
+            assert fake.webhook_url == f"{base}/telegram/webhook", fake.webhook_url
+            assert fake.calls_of("setWebhook")[0]["params"]["secret_token"] == SECRET
+            print(f"Готов, воркеров: {args.workers}")
+
+            url = f"{base}/telegram/webhook"
+            bad = message_update(1, 1, "/start")
+            async with session.post(url, json=bad, headers={}) as resp:
+                assert resp.status == 403, resp.status
+
+            start = time.perf_counter()
+            updates = [
+                message_update(10 + i, 5000 + i, "/start") for i in range(args.chats)
+            ]
+            results = await asyncio.gather(
+                *(session.post(url, json=u, headers=headers) for u in updates)
+            )
+            assert all(r.status == 200 for r in results)
+            await wait_for(
+                lambda: len(fake.calls_of("sendMessage")) >= args.chats,
+                10,
+                "ответов на /start",
+            )
+            answered = sorted(
+                int(c["params"]["chat_id"]) for c in fake.calls_of("sendMessage")
+            )
+            assert answered == [5000 + i for i in range(args.chats)], answered
+            print(f"/start для {args.chats} чатов: {time.perf_counter() - start:.2f} с")
+
+            # Стрим ответа, прерванный SIGTERM, должен дойти до конца
+            chat_id = 7000
+            for update in (
+                callback_update(100, chat_id, "company_amazone"),
+                callback_update(101, chat_id, "model_GPT4o"),
+                message_update(102, chat_id, "Как откалибровать сеялку?"),
+            ):
+                async with session.post(url, json=update, headers=headers) as resp:
+                    assert resp.status == 200
+                await asyncio.sleep(0.3)
+            await asyncio.sleep(1.0)
+
+            # Первый токен уже пришёл, стрим ещё идёт
+            async with session.get(f"{base}/metrics") as resp:
+                metrics = await resp.text()
+            for sample in (
+                'llm_time_to_first_token_seconds_count{worker="0",endpoint="/api/agent"} 1',
+                'llm_active_streams{worker="0",endpoint="/api/agent"} 1',
+                'telegram_api_seconds_count{worker="0",method="edit_message_text"}',
+                'webhook_updates_total{result="forwarded"}',
+            ):
+                assert sample in metrics, sample
+            print("/metrics: метрики роутера и воркеров собраны")
+
+            process.send_signal(signal.SIGTERM)
+
+        code = await asyncio.get_event_loop().run_in_executor(None, process.wait, 30)
+        assert code == 0, f"код завершения {code}"
+        final = [
+            c["params"]["text"]
+            for c in fake.calls_of("editMessageText")
+            if int(c["params"]["chat_id"]) == chat_id
+        ]
+        assert final and final[-1] == "".join(ANSWER_TOKENS), final
+        print("SIGTERM: стрим дописан до конца, процесс завершился штатно")
+    finally:
+        if process.poll() is None:
+            process.terminate()
+        await backend.stop()
+        await fake.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
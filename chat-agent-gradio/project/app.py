@@ -1,11 +1,34 @@
 import os
 import json
-import requests
 import logging
+import uuid
 import gradio as gr
-
-logging.basicConfig(level=logging.INFO)
+from contextlib import AsyncExitStack
+
+from common.answer_cache import AnswerCache
+from common.backend_client import AsyncBackendClient
+from common.context_window import build_context
+from common.log_setup import set_log_context, setup_logging
+from common.metrics import StreamStats, start_metrics_server
+from common.sse import EVENT_DATA, EVENT_DONE, aiter_sse
+from stream_flush import coalesce
+
+# JSON-логи через очередь: вывод не блокирует event loop
+setup_logging()
 API_URL = os.getenv("API_URL", "http://0.0.0.0:8200")
+# Одновременных стримов на процесс: они живут в event loop, а не в потоках
+CHAT_CONCURRENCY_LIMIT = int(os.getenv("CHAT_CONCURRENCY_LIMIT", "256"))
+# Сколько запросов может ждать в очереди Gradio сверх этого
+CHAT_QUEUE_MAX_SIZE = int(os.getenv("CHAT_QUEUE_MAX_SIZE", "1000"))
+
+# Общий пул keep-alive соединений к бекенду для всех сессий чата; сессия
+# aiohttp создаётся в event loop Gradio при первом запросе
+backend = AsyncBackendClient(
+    API_URL, limit=CHAT_CONCURRENCY_LIMIT, limit_per_host=CHAT_CONCURRENCY_LIMIT
+)
+
+# Готовые ответы на частые первые вопросы (включается ANSWER_CACHE=1)
+answer_cache = AnswerCache()
 
 
 def convert_gradio_history_to_api_format(gradio_history):
@@ -23,68 +46,79 @@ def convert_gradio_history_to_api_format(gradio_history):
     return api_history
 
 
-def chat_with_llm_streaming(message, history):
+async def chat_with_llm_streaming(message, history):
     """
     Функция для общения с LLM с поддержкой стриминга, обрабатывает как текстовые данные,
     так и поток ссылок (metadata) с бекенда.
+
+    Асинхронный генератор: ожидание токенов не занимает поток Gradio.
     """
+    set_log_context(request_id=uuid.uuid4().hex[:16])
     if history is None:
         history = []
 
     api_history = convert_gradio_history_to_api_format(history)
     api_history.append({"role": "user", "content": message})
-    logging.info(f"Отправляем историю: {api_history}")
-
-    response = requests.post(
-        f"{API_URL}/api/agent",
-        json={"chat_history": api_history},
-        stream=True,
-        timeout=120,  # Таймаут для запросов
+    # Длинные сессии не раздувают запрос: отправляем только окно контекста
+    context = build_context(api_history)
+    logging.info(f"Отправляем историю: {context.summary()}")
+    logging.info(
+        "История запроса",
+        extra={"category": "payload", "payload": context.messages},
     )
 
-    response.raise_for_status()
-
-    assistant_response = ""
-    event_type = None
-    buffer = ""
-
-    # Обработка Server-Sent Events (SSE)
-    for line in response.iter_lines(decode_unicode=True):
-        if not line.strip():
-            # Конец блока события: обрабатываем накопленные данные
-            if event_type and buffer:
+    # Из кеша отвечаем только на первое сообщение чата Gradio, поэтому ключ
+    # считается по всей истории из интерфейса, а не по окну context.messages
+    cache_key = answer_cache.key(api_history, None, "/api/agent")
+    cached = answer_cache.get(cache_key)
+    async with AsyncExitStack() as stack:
+        if cached is not None:
+            # Кешированный ответ приходит теми же SSE-событиями, и deltas()
+            # ниже его не отличает; метрики стрима не пишем — бекенда не было
+            stats = None
+            events = answer_cache.replay(cached)
+        else:
+            stats = await stack.enter_async_context(StreamStats("/api/agent"))
+            response = await stack.enter_async_context(
+                backend.stream("/api/agent", {"chat_history": context.messages})
+            )
+            response.raise_for_status()
+            events = answer_cache.record(
+                cache_key, aiter_sse(response.content.iter_any())
+            )
+
+        async def deltas():
+            # Обработка Server-Sent Events (SSE)
+            async for event in events:
                 try:
-                    data = json.loads(buffer)
+                    data = event.json()
                 except json.JSONDecodeError:
-                    logging.warning(f"Некорректный JSON: {buffer}")
-                    event_type = None
-                    buffer = ""
+                    logging.warning(f"Некорректный JSON: {event.data}")
                     continue
 
-                if event_type == "data":
-                    content = data.get("content", "")
-                    assistant_response += content
-                    yield assistant_response
+                if event.kind == EVENT_DATA:
+                    if stats is not None:
+                        stats.token()
+                    yield data.get("content", "")
 
-                elif event_type == "done":
+                elif event.kind == EVENT_DONE:
                     break
 
-            # Сброс переменных для следующего события
-            event_type = None
-            buffer = ""
-            continue
+        assistant_response = ""
 
-        # Обработка строки события
-        if line.startswith("event:"):
-            event_type = line.split(":", 1)[1].strip()
-        elif line.startswith("data:"):
-            buffer += line[6:]
+        # В браузер уходит не каждый токен, а укрупнённые обновления
+        async for assistant_response in coalesce(deltas()):
+            yield assistant_response
 
-    logging.info(f"Стрим завершен: {assistant_response}")
+    logging.info(
+        f"Стрим завершен: {len(assistant_response)} символов",
+        extra={"category": "payload", "payload": assistant_response},
+    )
     history.append({"role": "assistant", "content": assistant_response})
 
 
 if __name__ == "__main__":
+    start_metrics_server()
     gr.ChatInterface(
         chat_with_llm_streaming,
         chatbot=gr.Chatbot(height=500),
@@ -98,7 +132,8 @@ if __name__ == "__main__":
         retry_btn="Повторить диалог полностью",
         undo_btn="Удалить предыдущее сообщение",
         clear_btn="Очистить историю чата",
-    ).launch(
+        concurrency_limit=CHAT_CONCURRENCY_LIMIT,
+    ).queue(max_size=CHAT_QUEUE_MAX_SIZE).launch(
         server_name="0.0.0.0",
         server_port=10300,
         debug=True,
@@ -0,0 +1,63 @@
+"""
+Укрупнение обновлений интерфейса при стриминге ответа.
+
+Gradio после каждого yield отправляет в браузер весь накопленный текст и
+перерисовывает сообщение. Если отдавать его на каждый токен, за длинный
+ответ уходит O(n²) байт. coalesce копит токены и отдаёт текст не чаще
+раза в interval секунд или при накоплении max_chars новых символов;
+остаток отдаётся в конце стрима.
+"""
+
+import asyncio
+import os
+from typing import AsyncIterable, AsyncIterator, Optional
+
+CHAT_FLUSH_INTERVAL = float(os.getenv("CHAT_FLUSH_INTERVAL", "0.05"))
+CHAT_FLUSH_CHARS = int(os.getenv("CHAT_FLUSH_CHARS", "200"))
+
+
+async def coalesce(
+    deltas: AsyncIterable[str],
+    interval: float = CHAT_FLUSH_INTERVAL,
+    max_chars: int = CHAT_FLUSH_CHARS,
+) -> AsyncIterator[str]:
+    """
+    По кусочкам текста отдаёт накопленный текст. Таймер срабатывает и
+    без новых токенов: если бекенд задумался, уже пришедшее не застревает.
+    Нули в обоих параметрах — обновление на каждый кусочек.
+    """
+    loop = asyncio.get_event_loop()
+    source = deltas.__aiter__()
+    next_delta: Optional[asyncio.Future] = None
+    text = ""
+    pending = 0
+    flushed_at = loop.time()
+    try:
+        while True:
+            if next_delta is None:
+                next_delta = asyncio.ensure_future(source.__anext__())
+            timeout = None
+            if pending:
+                timeout = max(0.0, flushed_at + interval - loop.time())
+            done, _ = await asyncio.wait({next_delta}, timeout=timeout)
+            if done:
+                try:
+                    delta = next_delta.result()
+                except StopAsyncIteration:
+                    break
+                next_delta = None
+                if not delta:
+                    continue
+                text += delta
+                pending += len(delta)
+                if pending < max_chars and loop.time() - flushed_at < interval:
+                    continue
+            yield text
+            pending = 0
+            flushed_at = loop.time()
+    finally:
+        # Клиент ушёл — не оставляем висеть чтение стрима
+        if next_delta is not None and not next_delta.done():
+            next_delta.cancel()
+    if pending:
+        yield text
@@ -0,0 +1,3 @@
+"""
+Общий код фронтендов Профагро (telegram-bot, chat-agent-gradio, search-gradio).
+"""
@@ -0,0 +1,164 @@
+"""
+Кеш готовых ответов агента на первый вопрос диалога.
+
+Механики часто начинают с одного и того же вопроса («как откалибровать
+сеялку») для той же компании и модели, и каждый раз агент проходит весь путь
+заново. Кеш хранит полный ответ — все SSE-события data и metadata до done —
+по нормализованному вопросу, компании и эндпоинту модели. Повтор идёт через
+тот же цикл обработки событий, что и живой стрим, поэтому пользователь
+получает тот же текст, картинки и ссылки на источники.
+
+Кешируются только однократные диалоги (кроме системных сообщений в истории
+один вопрос): ответ на продолжение разговора зависит от контекста.
+Кеш выключен по умолчанию (ANSWER_CACHE=1 включает), ограничен TTL,
+числом ответов и объёмом. После переиндексации документов кеш сбрасывается
+вызовом invalidate() или изменением файла-метки ANSWER_CACHE_STAMP
+(например, touch из пайплайна индексации): каждый процесс замечает новую
+метку в течение секунды.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from typing import AsyncIterable, AsyncIterator, Dict, List, Optional, Tuple
+
+from common.metrics import Counter
+from common.sse import EVENT_DATA, EVENT_DONE, EVENT_METADATA, SSEEvent
+from common.ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+ANSWER_CACHE = os.getenv("ANSWER_CACHE", "0") == "1"
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", str(24 * 3600)))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000"))
+ANSWER_CACHE_MAX_MB = int(os.getenv("ANSWER_CACHE_MAX_MB", "32"))
+ANSWER_CACHE_STAMP = os.getenv("ANSWER_CACHE_STAMP", "")
+# Как часто проверять файл-метку, с
+STAMP_CHECK_INTERVAL = 1.0
+
+ANSWER_CACHE_REQUESTS = Counter(
+    "answer_cache_requests_total",
+    "Обращения к кешу ответов: hit, miss или bypass (диалог не однократный)",
+    ["result"],
+)
+
+# События, из которых состоит ответ; прочие при повторе не нужны
+REPLAY_EVENTS = frozenset((EVENT_DATA, EVENT_METADATA, EVENT_DONE))
+
+
+def normalize_question(text: str) -> str:
+    return " ".join(text.split()).casefold()
+
+
+class AnswerCache:
+    def __init__(
+        self,
+        enabled: bool = ANSWER_CACHE,
+        ttl: float = ANSWER_CACHE_TTL,
+        max_entries: int = ANSWER_CACHE_MAX_ENTRIES,
+        max_bytes: int = ANSWER_CACHE_MAX_MB * 1024 * 1024,
+        stamp_path: str = ANSWER_CACHE_STAMP,
+    ):
+        self.enabled = enabled
+        self.stamp_path = stamp_path
+        self._answers: TTLCache[Tuple, List[SSEEvent]] = TTLCache(
+            ttl, max_entries, max_bytes
+        )
+        self._stamp: Optional[float] = self._read_stamp()
+        self._stamp_checked_at = time.monotonic()
+        self.hits = 0
+        self.misses = 0
+
+    def key(
+        self, messages: List[Dict[str, str]], company: Optional[str], endpoint: str
+    ) -> Optional[Tuple]:
+        """
+        Ключ для полной истории диалога или None, если ответ кешировать
+        нельзя (кеш выключен или в диалоге уже были реплики). Передавать
+        нужно историю до build_context: окно контекста длинного диалога
+        может выглядеть как первый вопрос.
+        """
+        if not self.enabled:
+            return None
+        turns = [message for message in messages if message.get("role") != "system"]
+        if len(turns) != 1 or turns[0].get("role") != "user":
+            ANSWER_CACHE_REQUESTS.labels("bypass").inc()
+            return None
+        question = normalize_question(turns[0].get("content", ""))
+        return (question, company or "", endpoint)
+
+    def get(self, key: Optional[Tuple]) -> Optional[List[SSEEvent]]:
+        if key is None:
+            return None
+        self._check_stamp()
+        events = self._answers.get(key)
+        if events is None:
+            self.misses += 1
+            ANSWER_CACHE_REQUESTS.labels("miss").inc()
+            return None
+        self.hits += 1
+        ANSWER_CACHE_REQUESTS.labels("hit").inc()
+        return events
+
+    def put(self, key: Optional[Tuple], events: List[SSEEvent]):
+        if key is None:
+            return
+        self._answers.put(key, events, sum(len(event.data) for event in events))
+
+    async def record(
+        self, key: Optional[Tuple], events: AsyncIterable[SSEEvent]
+    ) -> AsyncIterator[SSEEvent]:
+        """
+        Пропускает события живого стрима насквозь и сохраняет ответ, если
+        стрим дошёл до done и в нём был текст. Прерванные стримы не кешируются.
+        """
+        recorded: List[SSEEvent] = []
+        has_text = False
+        async for event in events:
+            if key is not None and event.kind in REPLAY_EVENTS:
+                recorded.append(event)
+                if event.kind == EVENT_DATA and event.data.strip():
+                    has_text = True
+                # Сохраняем до yield: после done потребитель выходит из цикла
+                if event.kind == EVENT_DONE and has_text:
+                    self.put(key, recorded)
+            yield event
+
+    @staticmethod
+    async def replay(events: List[SSEEvent]) -> AsyncIterator[SSEEvent]:
+        for event in events:
+            yield event
+            # Не занимаем event loop на весь ответ сразу
+            await asyncio.sleep(0)
+
+    def invalidate(self):
+        if self._answers:
+            logger.info(f"Кеш ответов сброшен: {len(self._answers)} ответов")
+        self._answers.clear()
+
+    def _read_stamp(self) -> Optional[float]:
+        if not self.stamp_path:
+            return None
+        try:
+            return os.stat(self.stamp_path).st_mtime
+        except OSError:
+            return None
+
+    def _check_stamp(self):
+        now = time.monotonic()
+        if not self.stamp_path or now - self._stamp_checked_at < STAMP_CHECK_INTERVAL:
+            return
+        self._stamp_checked_at = now
+        stamp = self._read_stamp()
+        if stamp != self._stamp:
+            self._stamp = stamp
+            self.invalidate()
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "answers": len(self._answers),
+            "bytes": self._answers.bytes,
+        }
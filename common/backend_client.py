@@ -0,0 +1,243 @@
+"""
+Общий клиент к RAG-бекенду (/api/agent, /api/agent_gigachat, /api/search,
+/api/retrieve, /api/list_available_models).
+
+Клиент держит долгоживущий пул keep-alive соединений, поэтому TCP/TLS-рукопожатие
+не повторяется на каждый запрос. Есть два фасада:
+
+- AsyncBackendClient — на aiohttp, для telegram-бота;
+- BackendClient — на requests, для Gradio-приложений.
+
+Повторы делаются только до получения ответа (соединение не установилось или
+502/503), поэтому уже начавшийся SSE-стрим никогда не перезапускается. Разрыв
+уже установленного соединения не повторяется: POST мог дойти до бекенда.
+"""
+
+import asyncio
+import logging
+import os
+import random
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Dict, Iterator, Optional
+
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from common.metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+API_URL = os.getenv("API_URL", "http://0.0.0.0:8200")
+
+BACKEND_POOL_LIMIT = int(os.getenv("BACKEND_POOL_LIMIT", "100"))
+BACKEND_POOL_LIMIT_PER_HOST = int(os.getenv("BACKEND_POOL_LIMIT_PER_HOST", "32"))
+BACKEND_KEEPALIVE_TIMEOUT = float(os.getenv("BACKEND_KEEPALIVE_TIMEOUT", "60"))
+BACKEND_CONNECT_TIMEOUT = float(os.getenv("BACKEND_CONNECT_TIMEOUT", "5"))
+BACKEND_READ_TIMEOUT = float(os.getenv("BACKEND_READ_TIMEOUT", "120"))
+BACKEND_RETRIES = int(os.getenv("BACKEND_RETRIES", "2"))
+BACKEND_BACKOFF = float(os.getenv("BACKEND_BACKOFF", "0.3"))
+
+# Статусы прокси перед бекендом, после которых запрос повторяется: бекенд
+# недоступен или отказал сразу. 504 не повторяем — бекенд мог уже выполнить
+# запрос (в том числе дорогую генерацию) и просто не успеть ответить.
+RETRY_STATUSES = (502, 503)
+
+BACKEND_REQUEST_SECONDS = Histogram(
+    "backend_request_seconds",
+    "Длительность обычных (не потоковых) запросов к бекенду",
+    ["path"],
+)
+
+
+def backoff_delay(attempt: int, base: float = BACKEND_BACKOFF) -> float:
+    """
+    Экспоненциальная задержка с джиттером перед повтором номер attempt (с нуля).
+    """
+    return base * (2**attempt) * (0.5 + random.random() / 2)
+
+
+class AsyncBackendClient:
+    """
+    Асинхронный клиент с общим aiohttp.ClientSession.
+
+    Сессия создаётся лениво при первом запросе (внутри работающего event loop)
+    и живёт до вызова close().
+    """
+
+    def __init__(
+        self,
+        base_url: str = API_URL,
+        limit: int = BACKEND_POOL_LIMIT,
+        limit_per_host: int = BACKEND_POOL_LIMIT_PER_HOST,
+        connect_timeout: float = BACKEND_CONNECT_TIMEOUT,
+        read_timeout: float = BACKEND_READ_TIMEOUT,
+        retries: int = BACKEND_RETRIES,
+        backoff: float = BACKEND_BACKOFF,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                keepalive_timeout=BACKEND_KEEPALIVE_TIMEOUT,
+                ttl_dns_cache=300,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(
+                    total=None,
+                    sock_connect=self.connect_timeout,
+                    sock_read=self.read_timeout,
+                ),
+            )
+        return self._session
+
+    async def _request(
+        self, method: str, path: str, json: Any = None
+    ) -> aiohttp.ClientResponse:
+        session = self._get_session()
+        url = f"{self.base_url}{path}"
+        attempt = 0
+        while True:
+            try:
+                resp = await session.request(method, url, json=json)
+            except aiohttp.ClientConnectorError as e:
+                if attempt >= self.retries:
+                    raise
+                logger.warning(f"{method} {path}: нет соединения ({e}), повтор")
+            else:
+                if resp.status not in RETRY_STATUSES or attempt >= self.retries:
+                    return resp
+                logger.warning(f"{method} {path}: статус {resp.status}, повтор")
+                resp.release()
+            await asyncio.sleep(backoff_delay(attempt, self.backoff))
+            attempt += 1
+
+    @asynccontextmanager
+    async def stream(
+        self, path: str, payload: Dict[str, Any]
+    ) -> AsyncIterator[aiohttp.ClientResponse]:
+        """
+        POST с потоковым ответом (SSE). Статус ответа проверяет вызывающий код.
+
+        Если чтение прервано (отмена задачи, ошибка), соединение сразу
+        закрывается: бекенд видит разрыв и перестаёт генерировать ответ,
+        а недочитанный стрим не возвращается в пул.
+        """
+        resp = await self._request("POST", path, json=payload)
+        try:
+            yield resp
+        except BaseException:
+            resp.close()
+            raise
+        else:
+            resp.release()
+
+    async def post_json(self, path: str, payload: Dict[str, Any]) -> Any:
+        with BACKEND_REQUEST_SECONDS.labels(path).time():
+            resp = await self._request("POST", path, json=payload)
+            async with resp:
+                resp.raise_for_status()
+                return await resp.json()
+
+    async def get_json(self, path: str) -> Any:
+        with BACKEND_REQUEST_SECONDS.labels(path).time():
+            resp = await self._request("GET", path)
+            async with resp:
+                resp.raise_for_status()
+                return await resp.json()
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+
+class BackendClient:
+    """
+    Синхронный клиент с общим requests.Session и пулом соединений urllib3.
+
+    requests.Session потокобезопасен для запросов через общий пул, поэтому
+    один экземпляр используется всеми воркерами Gradio. Общего предела
+    соединений, как у aiohttp, у urllib3 нет: limit_per_host — сколько
+    соединений с хостом держится в пуле (pool_maxsize).
+    """
+
+    def __init__(
+        self,
+        base_url: str = API_URL,
+        limit_per_host: int = BACKEND_POOL_LIMIT_PER_HOST,
+        connect_timeout: float = BACKEND_CONNECT_TIMEOUT,
+        read_timeout: float = BACKEND_READ_TIMEOUT,
+        retries: int = BACKEND_RETRIES,
+        backoff: float = BACKEND_BACKOFF,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = (connect_timeout, read_timeout)
+
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=0,
+            status=retries,
+            backoff_factor=backoff,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=None,
+            raise_on_status=False,
+        )
+        # pool_connections — число хостов, для которых хранятся пулы, а не
+        # соединений; соединения с одним хостом ограничивает pool_maxsize
+        adapter = HTTPAdapter(pool_maxsize=limit_per_host, max_retries=retry)
+        self._session = requests.Session()
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+
+    @contextmanager
+    def stream(self, path: str, payload: Dict[str, Any]) -> Iterator[requests.Response]:
+        """
+        POST с потоковым ответом (SSE). Если ответ дочитан до конца, при выходе
+        соединение возвращается в пул; если чтение прервано, соединение
+        закрывается, и бекенд перестаёт генерировать ответ.
+        """
+        resp = self._session.post(
+            f"{self.base_url}{path}", json=payload, stream=True, timeout=self.timeout
+        )
+        try:
+            yield resp
+        finally:
+            resp.close()
+
+    def post_json(
+        self, path: str, payload: Dict[str, Any], timeout: Optional[float] = None
+    ) -> Any:
+        """
+        timeout — общий таймаут на соединение и чтение вместо клиентского.
+        """
+        with BACKEND_REQUEST_SECONDS.labels(path).time():
+            resp = self._session.post(
+                f"{self.base_url}{path}", json=payload, timeout=timeout or self.timeout
+            )
+            resp.raise_for_status()
+            return resp.json()
+
+    def get_json(self, path: str, timeout: Optional[float] = None) -> Any:
+        with BACKEND_REQUEST_SECONDS.labels(path).time():
+            resp = self._session.get(
+                f"{self.base_url}{path}", timeout=timeout or self.timeout
+            )
+            resp.raise_for_status()
+            return resp.json()
+
+    def close(self):
+        self._session.close()
@@ -0,0 +1,93 @@
+"""
+Окно контекста для chat_history, которую фронтенды отправляют бекенду.
+
+История диалога растёт без ограничений, а вместе с ней — размер запроса и
+стоимость промпта. Перед отправкой история обрезается до бюджета токенов:
+системные сообщения (выбор компании) остаются всегда, из остальных берутся
+самые свежие, последнее сообщение пользователя — обязательно.
+
+Токены оцениваются по числу символов без токенизатора: оценка грубая, но
+на порядки быстрее и одинакова для GPT-4o и GigaChat.
+"""
+
+import os
+from typing import Dict, List, NamedTuple
+
+from common.metrics import Counter, Histogram
+
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", "8000"))
+# Для русского текста у GPT-4o и GigaChat выходит около 3 символов на токен
+CONTEXT_CHARS_PER_TOKEN = float(os.getenv("CONTEXT_CHARS_PER_TOKEN", "3"))
+# Служебные токены разметки роли на каждое сообщение
+MESSAGE_OVERHEAD_TOKENS = 4
+
+CONTEXT_TOKENS = Histogram(
+    "context_tokens",
+    "Оценка числа токенов в отправленной истории",
+    buckets=(250, 500, 1000, 2000, 4000, 8000, 16000, 32000),
+)
+CONTEXT_TRIMMED_MESSAGES = Counter(
+    "context_trimmed_messages_total", "Сообщения, не попавшие в окно контекста"
+)
+
+
+def estimate_tokens(text: str) -> int:
+    return int(len(text) / CONTEXT_CHARS_PER_TOKEN) + 1
+
+
+def message_tokens(message: Dict[str, str]) -> int:
+    return estimate_tokens(message.get("content", "")) + MESSAGE_OVERHEAD_TOKENS
+
+
+class ContextWindow(NamedTuple):
+    messages: List[Dict[str, str]]
+    tokens: int
+    dropped: int
+    dropped_tokens: int
+
+    def summary(self) -> str:
+        text = f"{len(self.messages)} сообщений, ~{self.tokens} токенов"
+        if self.dropped:
+            text += f", отброшено {self.dropped} (~{self.dropped_tokens} токенов)"
+        return text
+
+
+def build_context(
+    history: List[Dict[str, str]], max_tokens: int = CONTEXT_MAX_TOKENS
+) -> ContextWindow:
+    """
+    Системные сообщения и последнее сообщение попадают в окно всегда,
+    остальные — от новых к старым, пока хватает бюджета. Порядок сообщений
+    сохраняется; окно не начинается с ответа ассистента без его вопроса.
+    """
+    if not history:
+        return ContextWindow([], 0, 0, 0)
+    sizes = [message_tokens(message) for message in history]
+    last = len(history) - 1
+    keep = [
+        i == last or message.get("role") == "system"
+        for i, message in enumerate(history)
+    ]
+    used = sum(size for size, kept in zip(sizes, keep) if kept)
+
+    first_kept = last
+    for i in range(last - 1, -1, -1):
+        if keep[i]:
+            continue
+        if used + sizes[i] > max_tokens:
+            break
+        keep[i] = True
+        used += sizes[i]
+        first_kept = i
+    # Ответ без вопроса только сбивает модель — отдаём его бюджет
+    if first_kept < last and history[first_kept].get("role") == "assistant":
+        keep[first_kept] = False
+        used -= sizes[first_kept]
+
+    messages = [message for message, kept in zip(history, keep) if kept]
+    dropped = len(history) - len(messages)
+    dropped_tokens = sum(sizes) - used
+    CONTEXT_TOKENS.observe(used)
+    if dropped:
+        CONTEXT_TRIMMED_MESSAGES.inc(dropped)
+    return ContextWindow(messages, used, dropped, dropped_tokens)
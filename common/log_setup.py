@@ -0,0 +1,224 @@
+"""
+Общая настройка логов для telegram-бота и Gradio-приложений.
+
+- Запись не блокирует event loop: обработчик кладёт запись в ограниченную
+  очередь, а форматирование и вывод делает отдельный поток (QueueListener).
+  Если очередь переполнена, запись отбрасывается и учитывается в метрике.
+- Формат — JSON по строке на запись (LOG_FORMAT=text — человекочитаемый).
+  В запись попадают request_id и chat_id текущего запроса (set_log_context).
+- Объёмные данные (история, ответ, метаданные инструментов) логируются с
+  категорией и отдельным полем payload:
+
+      logger.info("Стрим завершён", extra={"category": "payload", "payload": text})
+
+  Для категорий задаётся доля записей, которые пишутся (LOG_SAMPLING), а
+  payload обрезается до LOG_MAX_FIELD_CHARS символов. Отброшенная запись
+  не форматируется вовсе.
+- Уровень и доли можно поменять без передеплоя: файл LOG_CONFIG_PATH вида
+  {"level": "DEBUG", "sampling": {"payload": 1}} перечитывается при
+  изменении (проверка не чаще раза в LOG_CONFIG_CHECK_INTERVAL секунд).
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+from common.metrics import Counter
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_MAX_FIELD_CHARS = int(os.getenv("LOG_MAX_FIELD_CHARS", "2000"))
+# Доли записей по категориям: "payload=0.01,tool_messages=0"
+LOG_SAMPLING = os.getenv("LOG_SAMPLING", "payload=0.01,tool_messages=0.01")
+LOG_CONFIG_PATH = os.getenv("LOG_CONFIG_PATH", "")
+LOG_CONFIG_CHECK_INTERVAL = float(os.getenv("LOG_CONFIG_CHECK_INTERVAL", "5"))
+
+LOG_RECORDS_DROPPED = Counter(
+    "log_records_dropped_total",
+    "Записи лога, отброшенные из-за переполненной очереди",
+)
+
+request_id_var: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+chat_id_var: ContextVar[Optional[int]] = ContextVar("chat_id", default=None)
+
+
+def set_log_context(request_id: Optional[str] = None, chat_id: Optional[int] = None):
+    """
+    Привязывает id к текущей задаче asyncio (и порождённым ею задачам).
+    """
+    request_id_var.set(request_id)
+    chat_id_var.set(chat_id)
+
+
+def parse_sampling(text: str) -> Dict[str, float]:
+    sampling = {}
+    for item in text.split(","):
+        category, _, rate = item.partition("=")
+        if category.strip() and rate.strip():
+            sampling[category.strip()] = float(rate)
+    return sampling
+
+
+def truncate(text: str, limit: int = LOG_MAX_FIELD_CHARS) -> str:
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}… (+{len(text) - limit} символов)"
+
+
+class LiveConfig:
+    """
+    Доли по категориям и уровень логов; перечитываются из файла при его
+    изменении.
+    """
+
+    def __init__(self, sampling: Dict[str, float], path: str = LOG_CONFIG_PATH):
+        self.defaults = dict(sampling)
+        self.sampling = dict(sampling)
+        self.path = path
+        self._mtime: Optional[float] = None
+        self._checked_at = 0.0
+
+    def rate(self, category: str) -> float:
+        now = time.monotonic()
+        if self.path and now - self._checked_at >= LOG_CONFIG_CHECK_INTERVAL:
+            self._checked_at = now
+            self.reload()
+        return self.sampling.get(category, 1.0)
+
+    def reload(self):
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            mtime = None
+        if mtime == self._mtime:
+            return
+        self._mtime = mtime
+        config = {}
+        if mtime is not None:
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    config = json.load(f)
+            except (OSError, ValueError) as e:
+                logging.getLogger(__name__).warning(
+                    f"Не удалось прочитать {self.path}: {e}"
+                )
+                return
+        self.sampling = {**self.defaults, **config.get("sampling", {})}
+        logging.getLogger().setLevel(config.get("level", LOG_LEVEL).upper())
+
+
+class ContextFilter(logging.Filter):
+    """
+    Сэмплирует записи с категорией и добавляет id запроса и чата.
+    Работает в вызывающем потоке, до постановки в очередь.
+    """
+
+    def __init__(self, config: LiveConfig):
+        super().__init__()
+        self.config = config
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        category = getattr(record, "category", None)
+        if category is not None:
+            rate = self.config.rate(category)
+            if rate <= 0 or (rate < 1 and random.random() >= rate):
+                return False
+        record.request_id = request_id_var.get()
+        record.chat_id = chat_id_var.get()
+        return True
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Форматирование — в потоке слушателя, здесь только копим аргументы
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc()
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": truncate(record.getMessage()),
+        }
+        for field in ("request_id", "chat_id", "category"):
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        payload = getattr(record, "payload", None)
+        if payload is not None:
+            if not isinstance(payload, str):
+                payload = json.dumps(payload, ensure_ascii=False, default=str)
+            entry["payload"] = truncate(payload)
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        ids = [
+            f"{field}={getattr(record, field)}"
+            for field in ("request_id", "chat_id")
+            if getattr(record, field, None) is not None
+        ]
+        if ids:
+            text += f" [{' '.join(ids)}]"
+        payload = getattr(record, "payload", None)
+        if payload is not None:
+            text += f"\n{truncate(str(payload))}"
+        return text
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def setup_logging(
+    level: str = LOG_LEVEL, fmt: str = LOG_FORMAT, sampling: str = LOG_SAMPLING
+):
+    """
+    Заменяет обработчики корневого логгера на очередь с выводом в stderr.
+    Повторный вызов ничего не делает.
+    """
+    global _listener
+    if _listener is not None:
+        return
+    output = logging.StreamHandler(sys.stderr)
+    output.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+    records: queue.Queue = queue.Queue(LOG_QUEUE_SIZE)
+    handler = _DroppingQueueHandler(records)
+    config = LiveConfig(parse_sampling(sampling))
+    handler.addFilter(ContextFilter(config))
+
+    root = logging.getLogger()
+    for old in root.handlers[:]:
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(level)
+    if config.path:
+        config.reload()
+
+    _listener = logging.handlers.QueueListener(records, output)
+    _listener.start()
+    # Дописываем очередь при штатном выходе
+    atexit.register(_listener.stop)
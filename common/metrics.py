@@ -0,0 +1,382 @@
+"""
+Лёгкие метрики в формате Prometheus для всех фронтендов.
+
+Счётчики, гейджи и гистограммы с фиксированными бакетами: запись — это поиск
+бакета bisect'ом и пара сложений под блокировкой, поэтому метрики можно
+держать включёнными в проде. Без внешних зависимостей.
+
+    REQUESTS = Counter("requests_total", "Запросы", ["path"])
+    REQUESTS.labels("/api/search").inc()
+
+    with LATENCY.labels("/api/search").time():
+        ...
+
+    start_metrics_server()  # GET /metrics на METRICS_PORT в фоновом потоке
+"""
+
+import bisect
+import logging
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 0 — не поднимать отдельный HTTP-сервер метрик
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9464"))
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Задержки от миллисекунд до долгих стримов LLM
+LATENCY_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    120.0,
+)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+SIZE_BUCKETS = (1e4, 5e4, 1e5, 2.5e5, 5e5, 1e6, 2.5e6, 5e6, 1e7)
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(pairs: Sequence[Tuple[str, str]]) -> str:
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(str(v))}"' for k, v in pairs) + "}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List["_Metric"] = []
+        self._lock = threading.Lock()
+        # Метки, добавляемые ко всем метрикам процесса (например, номер воркера)
+        self.const_labels: Dict[str, str] = {}
+
+    def register(self, metric: "_Metric"):
+        with self._lock:
+            self._metrics.append(metric)
+
+    def render(self) -> str:
+        const = tuple(self.const_labels.items())
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics)
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples(const))
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class _Metric(ABC):
+    kind = ""
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: Sequence[str] = (),
+        registry: Registry = REGISTRY,
+    ):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    @abstractmethod
+    def _new_child(self):
+        pass
+
+    def labels(self, *values: str):
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.label_names):
+                raise ValueError(f"{self.name}: ожидались метки {self.label_names}")
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _default(self):
+        return self.labels()
+
+    def _label_pairs(self, values, const) -> Tuple[Tuple[str, str], ...]:
+        return const + tuple(zip(self.label_names, values))
+
+    def samples(self, const) -> Iterator[str]:
+        for values, child in list(self._children.items()):
+            labels = _format_labels(self._label_pairs(values, const))
+            yield f"{self.name}{labels} {_format_value(child.get())}"
+
+
+class _Value:
+    __slots__ = ("value", "lock", "function")
+
+    def __init__(self):
+        self.value = 0.0
+        self.lock = threading.Lock()
+        self.function: Optional[Callable[[], float]] = None
+
+    def inc(self, amount: float = 1.0):
+        with self.lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        with self.lock:
+            self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+    def set_function(self, function: Callable[[], float]):
+        """
+        Значение вычисляется при каждом сборе метрик (например, длина очереди).
+        """
+        self.function = function
+
+    def get(self) -> float:
+        if self.function is not None:
+            return self.function()
+        return self.value
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self) -> _Value:
+        return _Value()
+
+    def inc(self, amount: float = 1.0):
+        self._default().inc(amount)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self) -> _Value:
+        return _Value()
+
+    def inc(self, amount: float = 1.0):
+        self._default().inc(amount)
+
+    def dec(self, amount: float = 1.0):
+        self._default().dec(amount)
+
+    def set(self, value: float):
+        self._default().set(value)
+
+    def set_function(self, function: Callable[[], float]):
+        self._default().set_function(function)
+
+
+class _HistogramValue:
+    __slots__ = ("bounds", "counts", "sum", "lock")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.bounds, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+        registry: Registry = REGISTRY,
+    ):
+        self.bounds = tuple(sorted(buckets))
+        super().__init__(name, help, labels, registry)
+
+    def _new_child(self) -> _HistogramValue:
+        return _HistogramValue(self.bounds)
+
+    def observe(self, value: float):
+        self._default().observe(value)
+
+    def time(self):
+        return self._default().time()
+
+    def samples(self, const) -> Iterator[str]:
+        for values, child in list(self._children.items()):
+            pairs = self._label_pairs(values, const)
+            with child.lock:
+                counts = list(child.counts)
+                total = child.sum
+            cumulative = 0
+            for bound, count in zip(self.bounds + (float("inf"),), counts):
+                cumulative += count
+                labels = _format_labels(pairs + (("le", _format_value(bound)),))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(pairs)
+            yield f"{self.name}_sum{labels} {_format_value(total)}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+# Метрики стримов LLM — общие для бота и чата
+LLM_TIME_TO_FIRST_TOKEN = Histogram(
+    "llm_time_to_first_token_seconds",
+    "Время от запроса до первого токена ответа",
+    ["endpoint"],
+)
+LLM_STREAM_DURATION = Histogram(
+    "llm_stream_duration_seconds", "Полная длительность стрима ответа", ["endpoint"]
+)
+LLM_TOKENS_PER_SECOND = Histogram(
+    "llm_tokens_per_second",
+    "Скорость генерации: токенов в секунду после первого токена",
+    ["endpoint"],
+    buckets=RATE_BUCKETS,
+)
+LLM_TOKENS = Counter("llm_tokens_total", "Получено токенов ответа", ["endpoint"])
+LLM_ACTIVE_STREAMS = Gauge(
+    "llm_active_streams", "Открытые стримы к бекенду", ["endpoint"]
+)
+
+
+class StreamStats:
+    """
+    Замер одного стрима ответа: token() на каждый data-event. Итоги пишутся
+    при выходе из блока, в том числе при ошибке или отмене.
+
+        with StreamStats("/api/agent") as stats:
+            for event in ...:
+                stats.token()
+    """
+
+    __slots__ = ("endpoint", "started_at", "first_token_at", "tokens")
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.started_at = time.perf_counter()
+        self.first_token_at: Optional[float] = None
+        self.tokens = 0
+
+    def token(self):
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+            LLM_TIME_TO_FIRST_TOKEN.labels(self.endpoint).observe(
+                self.first_token_at - self.started_at
+            )
+        self.tokens += 1
+
+    def __enter__(self) -> "StreamStats":
+        self.started_at = time.perf_counter()
+        LLM_ACTIVE_STREAMS.labels(self.endpoint).inc()
+        return self
+
+    def __exit__(self, *exc_info):
+        now = time.perf_counter()
+        LLM_ACTIVE_STREAMS.labels(self.endpoint).dec()
+        LLM_STREAM_DURATION.labels(self.endpoint).observe(now - self.started_at)
+        LLM_TOKENS.labels(self.endpoint).inc(self.tokens)
+        if self.first_token_at is not None and now > self.first_token_at:
+            LLM_TOKENS_PER_SECOND.labels(self.endpoint).observe(
+                (self.tokens - 1) / (now - self.first_token_at)
+            )
+
+    async def __aenter__(self) -> "StreamStats":
+        return self.__enter__()
+
+    async def __aexit__(self, *exc_info):
+        self.__exit__(*exc_info)
+
+
+def merge_exposition(texts: Sequence[str]) -> str:
+    """
+    Склеивает выдачу нескольких процессов (воркеров webhook-режима) в одну:
+    сэмплы одной метрики должны идти одной группой под одним HELP/TYPE.
+    """
+    families: Dict[str, List[str]] = {}
+    current: List[str] = []
+    for text in texts:
+        for line in text.splitlines():
+            if line.startswith("# HELP ") or line.startswith("# TYPE "):
+                name = line.split(" ", 3)[2]
+                current = families.setdefault(name, [])
+                if line not in current[:2]:
+                    current.append(line)
+            elif line:
+                current.append(line)
+    return "\n".join(line for lines in families.values() for line in lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port: int = METRICS_PORT) -> Optional[ThreadingHTTPServer]:
+    """
+    Поднимает GET /metrics в фоновом потоке. port=0 — метрики не отдаются.
+    """
+    if not port:
+        return None
+    try:
+        server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+    except OSError as e:
+        logger.warning(f"Не удалось открыть порт метрик {port}: {e}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logger.info(f"Метрики доступны на :{port}/metrics")
+    return server
@@ -0,0 +1,181 @@
+"""
+Инкрементальный парсер Server-Sent Events поверх сырых байтовых чанков.
+
+Парсер следует спецификации WHATWG (многострочный data, комментарии, поля
+id/retry, переводы строк CRLF/LF/CR, необязательный пробел после двоеточия)
+и не декодирует строки по одной.
+
+Использование:
+
+    async for event in aiter_sse(resp.content.iter_any()):  # aiohttp
+        ...
+
+    for event in iter_sse(response.iter_content(chunk_size=None)):  # requests
+        ...
+"""
+
+import json
+from typing import (
+    Any,
+    AsyncIterable,
+    AsyncIterator,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+)
+
+# Типы событий, которые шлёт бекенд агента
+EVENT_DATA = "data"
+EVENT_METADATA = "metadata"
+EVENT_DONE = "done"
+EVENT_UNKNOWN = "unknown"
+
+KNOWN_EVENTS = frozenset((EVENT_DATA, EVENT_METADATA, EVENT_DONE))
+
+
+class SSEEvent(NamedTuple):
+    event: str
+    data: str
+    id: str = ""
+    retry: Optional[int] = None
+
+    @property
+    def kind(self) -> str:
+        """
+        Тип события: data, metadata, done или unknown для всего остального.
+        """
+        return self.event if self.event in KNOWN_EVENTS else EVENT_UNKNOWN
+
+    def json(self) -> Any:
+        return json.loads(self.data)
+
+
+# Создание события без Python-уровня NamedTuple.__new__ (горячий путь парсера)
+_new_event = tuple.__new__
+
+
+class SSEParser:
+    """
+    Потоковый парсер: feed() принимает произвольные куски байтов
+    и возвращает список полностью собранных событий.
+
+    Разбор идёт целыми блоками (событие заканчивается пустой строкой): байты
+    копятся до ближайшего разделителя, все завершённые блоки декодируются одним
+    вызовом, а типичный блок "event: X / data: {...}" разбирается без цикла
+    по строкам.
+    """
+
+    def __init__(self):
+        self._tail: List[bytes] = []
+        self._skip_lf = False
+        self._data: List[str] = []
+        self._event = ""
+        self.last_event_id = ""
+        self.retry: Optional[int] = None
+
+    def feed(self, chunk: bytes) -> List[SSEEvent]:
+        if self._skip_lf:
+            # Предыдущий чанк закончился на \r, а этот начинается с \n (CRLF)
+            self._skip_lf = False
+            if chunk[:1] == b"\n":
+                chunk = chunk[1:]
+        if not chunk:
+            return []
+        if b"\r" in chunk:
+            self._skip_lf = chunk[-1:] == b"\r"
+            chunk = chunk.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+
+        tail = self._tail
+        if b"\n\n" not in chunk and not (
+            tail and chunk[:1] == b"\n" and tail[-1][-1:] == b"\n"
+        ):
+            # Событие ещё не закончилось: копим куски без повторных склеек
+            tail.append(chunk)
+            return []
+        if tail:
+            tail.append(chunk)
+            chunk = b"".join(tail)
+        cut = chunk.rfind(b"\n\n") + 2
+        self._tail = [chunk[cut:]] if cut < len(chunk) else []
+
+        # Разделитель — ASCII-байт, поэтому завершённые блоки декодируются
+        # одним вызовом без риска разрезать многобайтовый символ
+        blocks = chunk[: cut - 2].decode("utf-8", "replace").split("\n\n")
+
+        events = []
+        new_event = _new_event
+        for block in blocks:
+            if block.startswith("event: "):
+                name, _, rest = block.partition("\n")
+                if rest.startswith("data: ") and "\n" not in rest:
+                    events.append(
+                        new_event(
+                            SSEEvent,
+                            (name[7:], rest[6:], self.last_event_id, self.retry),
+                        )
+                    )
+                    continue
+            self._parse_block(block, events)
+        return events
+
+    def _parse_block(self, block: str, events: List[SSEEvent]):
+        """
+        Общий путь по спецификации для нетипичных блоков.
+        """
+        for line in block.split("\n"):
+            if not line:
+                self._dispatch(events)
+            elif line[0] != ":":  # строки, начинающиеся с ':', — комментарии
+                self._process_field(line)
+        self._dispatch(events)
+
+    def _process_field(self, line: str):
+        field, _, value = line.partition(":")
+        if value[:1] == " ":
+            value = value[1:]
+        if field == "data":
+            self._data.append(value)
+        elif field == "event":
+            self._event = value
+        elif field == "id":
+            if "\0" not in value:
+                self.last_event_id = value
+        elif field == "retry":
+            if value.isdigit():
+                self.retry = int(value)
+        # Неизвестные поля по спецификации игнорируются
+
+    def _dispatch(self, events: List[SSEEvent]):
+        if self._data:
+            events.append(
+                SSEEvent(
+                    self._event or "message",
+                    "\n".join(self._data),
+                    self.last_event_id,
+                    self.retry,
+                )
+            )
+            self._data = []
+        self._event = ""
+
+
+def iter_sse(chunks: Iterable[bytes]) -> Iterator[SSEEvent]:
+    """
+    Синхронная обёртка, например над requests.Response.iter_content(None).
+    Незавершённое событие в конце потока отбрасывается, как того требует спецификация.
+    """
+    parser = SSEParser()
+    for chunk in chunks:
+        yield from parser.feed(chunk)
+
+
+async def aiter_sse(chunks: AsyncIterable[bytes]) -> AsyncIterator[SSEEvent]:
+    """
+    Асинхронная обёртка, например над aiohttp StreamReader.iter_any().
+    """
+    parser = SSEParser()
+    async for chunk in chunks:
+        for event in parser.feed(chunk):
+            yield event
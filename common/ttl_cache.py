@@ -0,0 +1,123 @@
+"""
+Ограниченный кеш в памяти: LRU + TTL с лимитами на число записей и объём.
+
+Общая основа кеша ответов, кеша поиска, хранилища документов и диалогов в
+памяти. Размер записи считает вызывающий код (в байтах или символах — лишь
+бы одинаково для всех записей). TTL отсчитывается от записи, а со sliding —
+от последнего обращения.
+
+Кеш не потокобезопасен: вызывающий код сам держит блокировку, если к нему
+обращаются из нескольких потоков.
+"""
+
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Generic, Hashable, Optional, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class _Entry:
+    __slots__ = ("value", "size", "stamp")
+
+    def __init__(self, value: Any, size: int, stamp: float):
+        self.value = value
+        self.size = size
+        self.stamp = stamp
+
+
+class TTLCache(Generic[K, V]):
+    def __init__(
+        self, ttl: float, max_entries: int, max_bytes: int, sliding: bool = False
+    ):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sliding = sliding
+        self._entries: "OrderedDict[K, _Entry]" = OrderedDict()
+        self._bytes = 0
+
+    def get(self, key: K) -> Optional[V]:
+        """
+        Значение или None, если записи нет или она истекла. Запись
+        становится самой свежей в LRU.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        now = time.monotonic()
+        if now - entry.stamp > self.ttl:
+            self._drop(key)
+            return None
+        if self.sliding:
+            entry.stamp = now
+        self._entries.move_to_end(key)
+        return entry.value
+
+    def put(self, key: K, value: V, size: int) -> bool:
+        """
+        Сохраняет значение; False, если оно одно больше всего кеша.
+        """
+        if key in self._entries:
+            self._drop(key)
+        if size > self.max_bytes:
+            return False
+        now = time.monotonic()
+        self._entries[key] = _Entry(value, size, now)
+        self._bytes += size
+        self._evict(now)
+        return True
+
+    def size(self, key: K) -> int:
+        entry = self._entries.get(key)
+        return entry.size if entry is not None else 0
+
+    def resize(self, key: K, size: int):
+        """
+        Новый размер записи, значение которой изменили на месте.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return
+        self._bytes += size - entry.size
+        entry.size = size
+        self._evict(time.monotonic())
+
+    def pop(self, key: K):
+        if key in self._entries:
+            self._drop(key)
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+
+    def _drop(self, key: K):
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+
+    def _evict(self, now: float):
+        # В начале OrderedDict самые давние записи: сначала истёкшие,
+        # затем — сверх лимитов по числу записей и объёму
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if (
+                now - entry.stamp <= self.ttl
+                and len(self._entries) <= self.max_entries
+                and self._bytes <= self.max_bytes
+            ):
+                break
+            self._drop(key)
+
+    @property
+    def bytes(self) -> int:
+        return self._bytes
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: K) -> bool:
+        return key in self._entries
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self._entries), "bytes": self._bytes}
@@ -0,0 +1,124 @@
+"""
+Потоковый ответ LLM для search-gradio.
+
+/api/search отдаёт ответ целиком, и поле LLM Answer пустует, пока модель
+не допишет его до конца. Если бекенд умеет SSE-вариант поиска
+(SEARCH_STREAM_PATH, те же события data/done, что у /api/agent), ответ
+читается токенами и показывается по мере генерации.
+
+Если потокового эндпоинта нет (404/405/501), он не запрашивается
+SEARCH_STREAM_RECHECK секунд, а ответ берётся обычным /api/search. Если
+стрим упал до первого токена, запрос тоже повторяется обычным вызовом. Если
+часть ответа уже показана, повтора нет — пользователь увидел бы другой
+ответ, а модель сгенерировала бы его заново, — и поднимается
+StreamInterrupted с показанным текстом.
+"""
+
+import json
+import logging
+import os
+import time
+from typing import Any, Callable, Dict
+
+import requests
+
+from common.backend_client import BackendClient
+from common.metrics import StreamStats
+from common.sse import EVENT_DATA, EVENT_DONE, iter_sse
+
+logger = logging.getLogger(__name__)
+
+# Пустое значение выключает стриминг
+SEARCH_STREAM_PATH = os.getenv("SEARCH_STREAM_PATH", "/api/search_stream")
+SEARCH_STREAM_RECHECK = float(os.getenv("SEARCH_STREAM_RECHECK", "300"))
+# Как часто обновлять поле ответа во время стрима, с
+SEARCH_FLUSH_INTERVAL = float(os.getenv("SEARCH_FLUSH_INTERVAL", "0.05"))
+
+# Статусы, которыми бекенд отвечает на неизвестный эндпоинт
+UNSUPPORTED_STATUSES = (404, 405, 501)
+
+
+class StreamUnsupported(Exception):
+    pass
+
+
+class StreamInterrupted(Exception):
+    """
+    Стрим оборвался после начала ответа; text — уже показанная часть.
+    """
+
+    def __init__(self, text: str, reason: str):
+        super().__init__(f"стрим прерван после {len(text)} символов ответа: {reason}")
+        self.text = text
+
+
+class AnswerStreamer:
+    def __init__(
+        self,
+        backend: BackendClient,
+        path: str = SEARCH_STREAM_PATH,
+        recheck: float = SEARCH_STREAM_RECHECK,
+    ):
+        self.backend = backend
+        self.path = path
+        self.recheck = recheck
+        self._unsupported_until = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path) and time.monotonic() >= self._unsupported_until
+
+    def answer(
+        self, payload: Dict[str, Any], on_text: Callable[[str], None]
+    ) -> Dict[str, Any]:
+        """
+        Ответ в формате /api/search. Пока идёт стрим, on_text получает
+        накопленный текст после каждого токена. StreamInterrupted — стрим
+        оборвался, когда on_text уже получил текст.
+        """
+        if self.enabled:
+            try:
+                return self._stream(payload, on_text)
+            except StreamUnsupported:
+                self._unsupported_until = time.monotonic() + self.recheck
+                logger.info(
+                    f"{self.path} недоступен, ответ через /api/search "
+                    f"следующие {self.recheck:.0f} с"
+                )
+            except StreamInterrupted as e:
+                logger.warning(f"{self.path}: {e}")
+                raise
+            except (requests.RequestException, ValueError) as e:
+                logger.warning(f"Стрим {self.path} прерван ({e}), повтор /api/search")
+        return self.backend.post_json("/api/search", payload)
+
+    def _stream(
+        self, payload: Dict[str, Any], on_text: Callable[[str], None]
+    ) -> Dict[str, Any]:
+        text = ""
+        with StreamStats(self.path) as stats, self.backend.stream(
+            self.path, payload
+        ) as response:
+            if response.status_code in UNSUPPORTED_STATUSES:
+                raise StreamUnsupported()
+            response.raise_for_status()
+            try:
+                for event in iter_sse(response.iter_content(chunk_size=None)):
+                    if event.kind == EVENT_DATA:
+                        try:
+                            delta = event.json().get("content", "")
+                        except json.JSONDecodeError:
+                            logger.warning(f"Некорректный JSON: {event.data}")
+                            continue
+                        if delta:
+                            stats.token()
+                            text += delta
+                            on_text(text)
+                    elif event.kind == EVENT_DONE:
+                        return {"answer": text}
+                # Оборванный стрим не отдаём за полный ответ
+                raise ValueError("стрим закончился без done")
+            except (requests.RequestException, ValueError) as e:
+                if text:
+                    raise StreamInterrupted(text, str(e)) from e
+                raise
@@ -1,37 +1,171 @@
 import gradio as gr
-import requests
 import os
+import queue
+import sys
+import time
 
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional
 from fastapi import Request, HTTPException, status
 
+from common.backend_client import BackendClient
+from common.log_setup import setup_logging
+from common.metrics import start_metrics_server
+import batch_runner
+from answer_stream import SEARCH_FLUSH_INTERVAL, AnswerStreamer, StreamInterrupted
+from document_store import DocumentStore
+from model_catalog import MODELS_REFRESH_INTERVAL, ModelCatalog
+from query_cache import QueryCache
+
 API_URL = os.getenv("API_URL", "http://0.0.0.0:8200")
+SEARCH_POOL_SIZE = int(os.getenv("SEARCH_POOL_SIZE", "8"))
+
+# JSON-логи через очередь: вывод не блокирует обработчики
+setup_logging()
+
+backend = BackendClient(API_URL)
+
+
+# Пул для параллельных /api/search и /api/retrieve; BackendClient потокобезопасен
+search_pool = ThreadPoolExecutor(
+    max_workers=SEARCH_POOL_SIZE, thread_name_prefix="search"
+)
+
+# Одинаковые запросы к одной модели отдаются из кеша или ждут уже идущий
+query_cache = QueryCache()
+
+
+def cached_post(path, query, model):
+    payload = {"query": query, "model": model}
+    key = query_cache.key(path, query, model)
+    return query_cache.submit(search_pool, key, backend.post_json, path, payload)
+
+
+# Ответ LLM токенами, если бекенд умеет потоковый поиск
+streamer = AnswerStreamer(backend)
+
+# Пакетные прогоны не занимают пул интерактивного поиска
+batch_pool = ThreadPoolExecutor(
+    max_workers=2 * batch_runner.BATCH_MAX_CONCURRENCY,
+    thread_name_prefix="batch-search",
+)
+
+
+# Найденные документы живут на сервере, в сессии — только id результата
+documents = DocumentStore()
+
+# Дописывается к показанной части ответа, если стрим оборвался
+ANSWER_INTERRUPTED = "\n\n[The answer was interrupted. Please search again.]"
+
+# Вид документов в навигаторе -> поле ответа /api/retrieve
+DOCUMENT_KINDS = {
+    "milvus": "milvus_retrieved_doc",
+    "bm25": "bm25_retrieved_doc",
+    "reranked": "reranked",
+}
+
+
+def search_results(query, model, cached=True, stream=False):
+    """
+    Запускает поиск ответа и /api/retrieve одновременно и отдаёт их
+    результаты по мере готовности: ("answer", текст) и
+    ("documents", {вид: список документов}). Со stream ответ читается
+    токенами, и до готового ответа отдаётся ("partial", текст) — не чаще
+    раза в SEARCH_FLUSH_INTERVAL секунд. Без cached запросы идут в бекенд
+    мимо кеша, через пул пакетных прогонов. Если стрим оборвался после
+    начала ответа, ответом становится показанная часть с пометкой.
+    """
+    payload = {"query": query, "model": model}
+    # Накопленный текст ответа из потока стрима и завершённые Future
+    updates = queue.Queue()
+    if stream:
+        answer = (streamer.answer, payload)
+    else:
+        answer = (backend.post_json, "/api/search", payload)
+    if cached:
+        # Потоковый и обычный ответ кешируются под одним ключом; текст стрима
+        # получают все, кто ждёт этот же запрос
+        key = query_cache.key("/api/search", query, model)
+        search = query_cache.submit(
+            search_pool,
+            key,
+            *answer,
+            on_progress=updates.put if stream else None,
+        )
+        retrieve = cached_post("/api/retrieve", query, model)
+    else:
+        if stream:
+            answer += (updates.put,)
+        search = batch_pool.submit(*answer)
+        retrieve = batch_pool.submit(backend.post_json, "/api/retrieve", payload)
+    for future in (search, retrieve):
+        future.add_done_callback(updates.put)
+
+    remaining = 2
+    text = None
+    flushed_at = 0.0
+    while remaining:
+        timeout = None
+        if text is not None:
+            timeout = flushed_at + SEARCH_FLUSH_INTERVAL - time.monotonic()
+            if timeout <= 0:
+                yield "partial", text
+                text = None
+                flushed_at = time.monotonic()
+                timeout = None
+        try:
+            update = updates.get(timeout=timeout)
+        except queue.Empty:
+            continue
+        if isinstance(update, str):
+            text = update
+            continue
+        remaining -= 1
+        if update is search:
+            text = None
+            try:
+                answer_text = update.result()["answer"]
+            except StreamInterrupted as e:
+                answer_text = e.text + ANSWER_INTERRUPTED
+            yield "answer", answer_text
+        else:
+            result = update.result()
+            yield "documents", {
+                kind: result[field] for kind, field in DOCUMENT_KINDS.items()
+            }
 
 
 def search_and_retrieve(query, model):
-    # Call the /search endpoint
-    search_response = requests.post(
-        f"{API_URL}/api/search", json={"query": query, "model": model}
-    )
-    search_result = search_response.json()
+    """
+    Отдаёт результаты поиска в интерфейс по мере готовности: документы
+    обычно приходят задолго до ответа LLM. Выходы: ответ, id результата
+    в хранилище документов и первые документы навигаторов с их номерами;
+    ещё не готовые части не меняются. Ответ LLM, если бекенд его стримит,
+    дописывается в поле по мере генерации.
+    """
+    for kind, result in search_results(query, model, stream=True):
+        outputs = [gr.update()] * 8
+        if kind in ("partial", "answer"):
+            outputs[0] = result
+        else:
+            result_id = documents.put(result)
+            outputs[1] = result_id
+            for i, kind in enumerate(DOCUMENT_KINDS):
+                outputs[2 + 2 * i : 4 + 2 * i] = show_document(result_id, kind, 1)
+        yield tuple(outputs)
 
-    # Call the /retrieve endpoint
-    retrieve_response = requests.post(
-        f"{API_URL}/api/retrieve", json={"query": query, "model": model}
-    )
-    retrieve_result = retrieve_response.json()
 
-    return (
-        search_result["answer"],
-        retrieve_result["milvus_retrieved_doc"],
-        retrieve_result["bm25_retrieved_doc"],
-        retrieve_result["reranked"],
-    )
+# Список моделей из снимка на диске; бекенд опрашивается в фоне
+catalog = ModelCatalog(backend)
+available_models = catalog.load()
 
 
-def get_available_models():
-    response = requests.get(f"{API_URL}/api/list_available_models")
-    return response.json()["models"]
+def refresh_model_dropdown(current):
+    """
+    Подтягивает в выпадающий список обновлённый каталог, сохраняя выбор.
+    """
+    models = catalog.models
+    return gr.update(choices=models, value=current if current in models else models[0])
 
 
 def create_document_navigator(name):
@@ -45,85 +179,186 @@ def create_document_navigator(name):
     return doc_text, prev_button, doc_number, next_button
 
 
-def update_document(docs, direction, current):
-    current += direction
-    if current < 1:
-        current = len(docs)
-    elif current > len(docs):
-        current = 1
-    return docs[current - 1], current
+def show_document(result_id, kind, number):
+    """
+    Текст документа и номер с числом документов в подписи: с сервера
+    в браузер уходит только один документ.
+    """
+    page = documents.page(result_id, kind, number)
+    if page is None:
+        return "Results expired, please search again", gr.update(
+            value=1, label="Document Number"
+        )
+    text, number, total = page
+    return text, gr.update(value=number, label=f"Document Number (of {total})")
+
+
+def update_document(result_id, kind, direction, current):
+    return show_document(result_id, kind, int(current) + int(direction))
+
+
+def batch_search(query, model):
+    # Эталонные прогоны после переиндексации — всегда свежие результаты
+    return search_results(query, model, cached=False)
+
+
+async def run_batch(queries_file, model, concurrency):
+    """
+    Пакетный прогон загруженного файла запросов: строки таблицы и сводка
+    обновляются по мере готовности запросов. Повторный запуск того же
+    файла продолжает прерванный прогон.
+    """
+    if queries_file is None:
+        raise gr.Error("Upload a CSV or JSONL file with queries")
+    try:
+        queries = batch_runner.load_queries(queries_file, model)
+    except (OSError, ValueError) as e:
+        raise gr.Error(f"Cannot read queries: {e}")
+    output_path = batch_runner.output_path_for(queries_file)
+    run = batch_runner.BatchRun(batch_search, queries, output_path, concurrency)
+    rows = [batch_runner.table_row(row) for row in run.previous.values()]
+    yield rows, run.summary(), output_path
+    async for row in run.aresults():
+        rows.append(batch_runner.table_row(row))
+        yield rows, run.summary(), gr.update()
+    yield rows, run.summary(), output_path
 
 
 with gr.Blocks() as demo:
     gr.Markdown("# RAG Search Demo")
 
-    with gr.Row():
-        with gr.Column(scale=1):
-            query_input = gr.Textbox(
-                label="Search Query", placeholder="Enter your search query here..."
-            )
-            model_dropdown = gr.Dropdown(
-                label="Select Model",
-                choices=get_available_models(),
-                value=get_available_models()[0],
-            )
-            search_button = gr.Button("Search")
-
-        with gr.Column(scale=1):
-            llm_answer = gr.Textbox(label="LLM Answer", interactive=False)
-
-    milvus_doc, milvus_prev, milvus_num, milvus_next = create_document_navigator(
-        "Milvus"
-    )
-    bm25_doc, bm25_prev, bm25_num, bm25_next = create_document_navigator(
-        "OpenSearch (BM25)"
-    )
-    reranked_doc, reranked_prev, reranked_num, reranked_next = (
-        create_document_navigator("Reranked")
-    )
+    with gr.Tab("Search"):
+        with gr.Row():
+            with gr.Column(scale=1):
+                query_input = gr.Textbox(
+                    label="Search Query", placeholder="Enter your search query here..."
+                )
+                model_dropdown = gr.Dropdown(
+                    label="Select Model",
+                    choices=available_models,
+                    value=available_models[0],
+                )
+                search_button = gr.Button("Search")
 
-    milvus_docs = gr.State([])
-    bm25_docs = gr.State([])
-    reranked_docs = gr.State([])
-
-    search_button.click(
-        search_and_retrieve,
-        inputs=[query_input, model_dropdown],
-        outputs=[llm_answer, milvus_docs, bm25_docs, reranked_docs],
-    ).then(
-        lambda docs: (docs[0] if docs else "", 1),
-        inputs=[milvus_docs],
-        outputs=[milvus_doc, milvus_num],
-    ).then(
-        lambda docs: (docs[0] if docs else "", 1),
-        inputs=[bm25_docs],
-        outputs=[bm25_doc, bm25_num],
-    ).then(
-        lambda docs: (docs[0] if docs else "", 1),
-        inputs=[reranked_docs],
-        outputs=[reranked_doc, reranked_num],
-    )
+            with gr.Column(scale=1):
+                llm_answer = gr.Textbox(label="LLM Answer", interactive=False)
 
-    for docs, doc, prev, num, next in [
-        (milvus_docs, milvus_doc, milvus_prev, milvus_num, milvus_next),
-        (bm25_docs, bm25_doc, bm25_prev, bm25_num, bm25_next),
-        (reranked_docs, reranked_doc, reranked_prev, reranked_num, reranked_next),
+        milvus_doc, milvus_prev, milvus_num, milvus_next = create_document_navigator(
+            "Milvus"
+        )
+        bm25_doc, bm25_prev, bm25_num, bm25_next = create_document_navigator(
+            "OpenSearch (BM25)"
+        )
+        reranked_doc, reranked_prev, reranked_num, reranked_next = (
+            create_document_navigator("Reranked")
+        )
+
+        result_state = gr.State("")
+
+        search_button.click(
+            search_and_retrieve,
+            inputs=[query_input, model_dropdown],
+            outputs=[
+                llm_answer,
+                result_state,
+                milvus_doc,
+                milvus_num,
+                bm25_doc,
+                bm25_num,
+                reranked_doc,
+                reranked_num,
+            ],
+        )
+
+    with gr.Tab("Batch"):
+        with gr.Row():
+            with gr.Column(scale=1):
+                batch_file = gr.File(
+                    label="Queries (CSV or JSONL: query, model, id)",
+                    file_types=[".csv", ".jsonl"],
+                    type="filepath",
+                )
+                batch_model = gr.Dropdown(
+                    label="Model for queries without one",
+                    choices=available_models,
+                    value=available_models[0],
+                )
+                batch_concurrency = gr.Slider(
+                    label="Concurrency",
+                    minimum=1,
+                    maximum=batch_runner.BATCH_MAX_CONCURRENCY,
+                    step=1,
+                    value=batch_runner.BATCH_CONCURRENCY,
+                )
+                with gr.Row():
+                    batch_button = gr.Button("Run")
+                    batch_stop = gr.Button("Stop")
+
+            with gr.Column(scale=2):
+                batch_summary = gr.Markdown()
+                batch_output = gr.File(label="Results (JSONL)")
+
+        batch_table = gr.Dataframe(
+            headers=batch_runner.TABLE_HEADERS, interactive=False, wrap=True
+        )
+
+        # Один прогон за раз: параллельность ограничивает слайдер
+        batch_event = batch_button.click(
+            run_batch,
+            inputs=[batch_file, batch_model, batch_concurrency],
+            outputs=[batch_table, batch_summary, batch_output],
+            concurrency_limit=1,
+        )
+        # Остановленный прогон продолжится при следующем запуске того же файла
+        batch_stop.click(None, cancels=[batch_event])
+
+    # Открытые страницы подхватывают обновлённый каталог без перезагрузки
+    for dropdown in (model_dropdown, batch_model):
+        demo.load(
+            refresh_model_dropdown,
+            inputs=[dropdown],
+            outputs=[dropdown],
+            every=MODELS_REFRESH_INTERVAL,
+        )
+
+    for kind, doc, prev, num, next in [
+        ("milvus", milvus_doc, milvus_prev, milvus_num, milvus_next),
+        ("bm25", bm25_doc, bm25_prev, bm25_num, bm25_next),
+        ("reranked", reranked_doc, reranked_prev, reranked_num, reranked_next),
     ]:
         prev.click(
             update_document,
-            inputs=[docs, gr.Number(value=-1, visible=False), num],
+            inputs=[
+                result_state,
+                gr.State(kind),
+                gr.Number(value=-1, visible=False),
+                num,
+            ],
             outputs=[doc, num],
         )
         next.click(
             update_document,
-            inputs=[docs, gr.Number(value=1, visible=False), num],
+            inputs=[
+                result_state,
+                gr.State(kind),
+                gr.Number(value=1, visible=False),
+                num,
+            ],
             outputs=[doc, num],
         )
 
-demo.launch(
-    server_name="0.0.0.0",
-    server_port=10200,
-    debug=True,
-    max_threads=2,
-    auth=("admin", "pass1234"),
-)
+if __name__ == "__main__":
+    # python app.py batch queries.csv -o results.jsonl — прогон без интерфейса
+    if sys.argv[1:2] == ["batch"]:
+        sys.exit(batch_runner.main(batch_search, available_models[0], sys.argv[2:]))
+
+    # Задержки /api/search и /api/retrieve пишет BackendClient
+    start_metrics_server()
+    catalog.start_background_refresh()
+    demo.launch(
+        server_name="0.0.0.0",
+        server_port=10200,
+        debug=True,
+        max_threads=2,
+        auth=("admin", "pass1234"),
+    )
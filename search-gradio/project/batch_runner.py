@@ -0,0 +1,288 @@
+"""
+Пакетный прогон эталонных запросов через поиск — для оценки выдачи после
+переиндексации.
+
+Вход — CSV с заголовком или JSONL с полями query и (необязательно) model и
+id. Запросы идут через тот же search_results, что и кнопка Search, но мимо
+кеша: после переиндексации нужны свежие результаты. Одновременно выполняется
+не больше concurrency запросов; каждый готовый результат сразу дописывается
+строкой JSON в выходной файл.
+
+Прогон возобновляемый: при повторном запуске с тем же выходным файлом
+запросы, уже успешно выполненные (по паре id и модель), пропускаются, а
+завершившиеся ошибкой — повторяются. Если у запроса нет id, им служит хеш
+текста запроса.
+"""
+
+import argparse
+import asyncio
+import csv
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from typing import (
+    AsyncIterator,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+)
+
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "16"))
+BATCH_OUTPUT_DIR = os.getenv("BATCH_OUTPUT_DIR", "batch_results")
+
+# Колонки таблицы результатов в интерфейсе
+TABLE_HEADERS = ["id", "query", "model", "seconds", "answer", "documents", "error"]
+# Сколько символов ответа показывать в таблице; в файл пишется целиком
+TABLE_ANSWER_CHARS = 200
+
+# search(query, model) -> ("answer", текст) и ("documents", {вид: список})
+SearchFunction = Callable[[str, str], Iterable[Tuple[str, object]]]
+
+
+class BatchQuery(NamedTuple):
+    id: str
+    query: str
+    model: str
+
+
+def query_id(query: str) -> str:
+    return hashlib.sha1(query.encode("utf-8")).hexdigest()[:12]
+
+
+def load_queries(path: str, default_model: str) -> List[BatchQuery]:
+    """
+    Читает запросы из .csv или .jsonl; пустые запросы и повторы
+    (тот же id и модель) пропускаются.
+    """
+    with open(path, "r", encoding="utf-8-sig") as f:
+        if path.endswith(".jsonl"):
+            records = [json.loads(line) for line in f if line.strip()]
+        else:
+            reader = csv.DictReader(f)
+            if "query" not in (reader.fieldnames or []):
+                raise ValueError(f"В {path} нет колонки query")
+            records = list(reader)
+
+    queries = []
+    seen = set()
+    for record in records:
+        query = str(record.get("query") or "").strip()
+        if not query:
+            continue
+        model = str(record.get("model") or "").strip() or default_model
+        item = BatchQuery(str(record.get("id") or query_id(query)), query, model)
+        if (item.id, item.model) not in seen:
+            seen.add((item.id, item.model))
+            queries.append(item)
+    return queries
+
+
+def load_results(path: str) -> Dict[Tuple[str, str], dict]:
+    """
+    Успешные результаты из выходного файла прошлых прогонов. Оборванная
+    при прерывании последняя строка пропускается.
+    """
+    results = {}
+    if not os.path.exists(path):
+        return results
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+            except ValueError:
+                continue
+            if not row.get("error"):
+                results[(row["id"], row["model"])] = row
+    return results
+
+
+def run_query(search: SearchFunction, item: BatchQuery) -> dict:
+    """
+    Выполняется в потоке пула; ошибка попадает в строку результата.
+    """
+    row = {
+        "id": item.id,
+        "query": item.query,
+        "model": item.model,
+        "answer": None,
+        "documents": None,
+        "error": None,
+    }
+    started_at = time.perf_counter()
+    try:
+        for kind, value in search(item.query, item.model):
+            # Задержки частей: документы обычно готовы раньше ответа
+            row[f"{kind}_seconds"] = round(time.perf_counter() - started_at, 3)
+            row[kind] = value
+    except Exception as e:
+        row["error"] = f"{type(e).__name__}: {e}"
+    row["seconds"] = round(time.perf_counter() - started_at, 3)
+    return row
+
+
+def table_row(row: dict) -> list:
+    answer = row.get("answer") or ""
+    if len(answer) > TABLE_ANSWER_CHARS:
+        answer = answer[:TABLE_ANSWER_CHARS] + "…"
+    documents = row.get("documents") or {}
+    return [
+        row["id"],
+        row["query"],
+        row["model"],
+        row.get("seconds"),
+        answer,
+        "/".join(str(len(docs)) for docs in documents.values()),
+        row.get("error") or "",
+    ]
+
+
+def percentile(samples: List[float], q: float) -> float:
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+
+class BatchRun:
+    """
+    Один прогон: запросы, которых ещё нет в выходном файле, выполняются в
+    собственном пуле из concurrency потоков. Результаты можно забирать
+    синхронно (results, для CLI) или из event loop (aresults, для Gradio).
+    """
+
+    def __init__(
+        self,
+        search: SearchFunction,
+        queries: List[BatchQuery],
+        output_path: str,
+        concurrency: int = BATCH_CONCURRENCY,
+    ):
+        self.search = search
+        self.output_path = output_path
+        self.concurrency = max(1, min(int(concurrency), BATCH_MAX_CONCURRENCY))
+        self.previous = load_results(output_path)
+        self.pending = [
+            item for item in queries if (item.id, item.model) not in self.previous
+        ]
+        self.total = len(queries)
+        self.completed = 0
+        self.errors = 0
+        self.latencies: List[float] = []
+        self.started_at: Optional[float] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def _start(self) -> List[Future]:
+        self.started_at = time.perf_counter()
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.concurrency, thread_name_prefix="batch"
+        )
+        return [
+            self._executor.submit(run_query, self.search, item) for item in self.pending
+        ]
+
+    def _stop(self):
+        # Прерванный прогон: невыполненные запросы останутся на следующий раз
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _record(self, output, row: dict) -> dict:
+        output.write(json.dumps(row, ensure_ascii=False) + "\n")
+        output.flush()
+        self.completed += 1
+        if row["error"]:
+            self.errors += 1
+        else:
+            self.latencies.append(row["seconds"])
+        return row
+
+    def _open_output(self):
+        directory = os.path.dirname(self.output_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Прошлый прогон мог оборваться посреди строки
+        broken = False
+        if os.path.exists(self.output_path) and os.path.getsize(self.output_path):
+            with open(self.output_path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                broken = f.read(1) != b"\n"
+        output = open(self.output_path, "a", encoding="utf-8")
+        if broken:
+            output.write("\n")
+        return output
+
+    def results(self) -> Iterator[dict]:
+        with self._open_output() as output:
+            try:
+                for future in as_completed(self._start()):
+                    yield self._record(output, future.result())
+            finally:
+                self._stop()
+
+    async def aresults(self) -> AsyncIterator[dict]:
+        with self._open_output() as output:
+            try:
+                futures = [asyncio.wrap_future(future) for future in self._start()]
+                for next_row in asyncio.as_completed(futures):
+                    yield self._record(output, await next_row)
+            finally:
+                self._stop()
+
+    def summary(self) -> str:
+        elapsed = time.perf_counter() - self.started_at if self.started_at else 0.0
+        done = len(self.previous) + self.completed
+        text = f"{done}/{self.total} queries"
+        if self.previous:
+            text += f" ({len(self.previous)} from previous runs)"
+        text += f", {self.errors} errors, {elapsed:.1f} s"
+        if self.completed and elapsed > 0:
+            text += f", {self.completed / elapsed:.2f} queries/s"
+        if self.latencies:
+            text += (
+                f", latency p50 {percentile(self.latencies, 0.5):.2f} s"
+                f" / p95 {percentile(self.latencies, 0.95):.2f} s"
+            )
+        return text
+
+
+def output_path_for(path: str) -> str:
+    """
+    Выходной файл для загруженного в интерфейс файла: тот же файл запросов
+    попадает в тот же результат и продолжает прерванный прогон.
+    """
+    with open(path, "rb") as f:
+        digest = hashlib.sha1(f.read()).hexdigest()[:12]
+    return os.path.join(BATCH_OUTPUT_DIR, f"{digest}.jsonl")
+
+
+def main(search: SearchFunction, default_model: str, argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(
+        prog="app.py batch", description="Пакетный прогон запросов через поиск"
+    )
+    parser.add_argument("queries", help="CSV или JSONL с полями query, model, id")
+    parser.add_argument(
+        "-o", "--output", required=True, help="JSONL с результатами; дописывается"
+    )
+    parser.add_argument("-c", "--concurrency", type=int, default=BATCH_CONCURRENCY)
+    parser.add_argument("-m", "--model", default=default_model)
+    args = parser.parse_args(argv)
+
+    run = BatchRun(
+        search, load_queries(args.queries, args.model), args.output, args.concurrency
+    )
+    print(f"Запросов: {run.total}, выполнено ранее: {len(run.previous)}")
+    try:
+        for row in run.results():
+            status = row["error"] or f"{row['seconds']:.2f} s"
+            print(
+                f"[{len(run.previous) + run.completed}/{run.total}] {row['id']}: {status}"
+            )
+    except KeyboardInterrupt:
+        print("Прервано, продолжить можно той же командой")
+    print(run.summary())
+    return 1 if run.errors else 0
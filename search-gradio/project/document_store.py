@@ -0,0 +1,66 @@
+"""
+Серверное хранилище найденных документов для навигаторов search-gradio.
+
+Списки Milvus, BM25 и реранкера лежат здесь под идентификатором результата,
+а сессия интерфейса хранит только этот идентификатор. Листание отдаёт один
+документ и число документов. Хранилище ограничено по числу результатов,
+объёму и времени простоя (LRU + TTL); вытесненный результат нужно
+запросить поиском заново.
+"""
+
+import os
+import threading
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+from common.ttl_cache import TTLCache
+
+DOCUMENT_STORE_TTL = float(os.getenv("DOCUMENT_STORE_TTL", "3600"))
+DOCUMENT_STORE_MAX_RESULTS = int(os.getenv("DOCUMENT_STORE_MAX_RESULTS", "1000"))
+DOCUMENT_STORE_MAX_MB = int(os.getenv("DOCUMENT_STORE_MAX_MB", "128"))
+
+
+class DocumentStore:
+    def __init__(
+        self,
+        ttl: float = DOCUMENT_STORE_TTL,
+        max_results: int = DOCUMENT_STORE_MAX_RESULTS,
+        max_bytes: int = DOCUMENT_STORE_MAX_MB * 1024 * 1024,
+    ):
+        # TTL считается от последнего просмотра
+        self._results: TTLCache[str, Dict[str, List[str]]] = TTLCache(
+            ttl, max_results, max_bytes, sliding=True
+        )
+        self._lock = threading.Lock()
+
+    def put(self, documents: Dict[str, List[str]]) -> str:
+        """
+        Сохраняет списки документов (по видам) и возвращает id результата.
+        Списки не копируются: их можно делить с кешем запросов.
+        """
+        result_id = uuid.uuid4().hex
+        size = sum(len(doc) for docs in documents.values() for doc in docs)
+        with self._lock:
+            self._results.put(result_id, documents, size)
+        return result_id
+
+    def page(
+        self, result_id: str, kind: str, number: int
+    ) -> Optional[Tuple[str, int, int]]:
+        """
+        Документ номер number (с единицы, по кругу) вида kind: текст,
+        фактический номер и число документов. None, если результат
+        неизвестен или уже вытеснен.
+        """
+        with self._lock:
+            documents = self._results.get(result_id)
+        if documents is None:
+            return None
+        docs = documents.get(kind, [])
+        if not docs:
+            return "", 1, 0
+        number = (number - 1) % len(docs) + 1
+        return docs[number - 1], number, len(docs)
+
+    def stats(self) -> Dict[str, float]:
+        return {"results": len(self._results), "bytes": self._results.bytes}
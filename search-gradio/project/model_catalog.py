@@ -0,0 +1,127 @@
+"""
+Каталог моделей для выпадающего списка search-gradio.
+
+Раньше интерфейс при построении дважды синхронно запрашивал
+/api/list_available_models и не поднимался, пока бекенд недоступен.
+Теперь список берётся из снимка на диске (мгновенный холодный старт),
+запрашивается у бекенда не больше одного раза с коротким таймаутом и
+обновляется в фоновом потоке.
+"""
+
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from typing import List, Optional
+
+from common.backend_client import BackendClient
+
+logger = logging.getLogger(__name__)
+
+MODELS_CACHE_PATH = os.getenv(
+    "MODELS_CACHE_PATH", os.path.join(tempfile.gettempdir(), "profagro-models.json")
+)
+MODELS_CACHE_TTL = float(os.getenv("MODELS_CACHE_TTL", "3600"))
+MODELS_REFRESH_INTERVAL = float(os.getenv("MODELS_REFRESH_INTERVAL", "300"))
+MODELS_FETCH_TIMEOUT = float(os.getenv("MODELS_FETCH_TIMEOUT", "3"))
+# Список на случай, если нет ни снимка, ни ответа бекенда
+DEFAULT_MODELS = [
+    model.strip()
+    for model in os.getenv("DEFAULT_MODELS", "gpt-4o").split(",")
+    if model.strip()
+]
+
+
+class ModelCatalog:
+    def __init__(
+        self,
+        backend: BackendClient,
+        path: str = MODELS_CACHE_PATH,
+        ttl: float = MODELS_CACHE_TTL,
+        timeout: float = MODELS_FETCH_TIMEOUT,
+    ):
+        self.backend = backend
+        self.path = path
+        self.ttl = ttl
+        self.timeout = timeout
+        self.models: List[str] = list(DEFAULT_MODELS)
+        self.fetched_at = 0.0
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def _read_snapshot(self) -> bool:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                snapshot = json.load(f)
+            models = [str(model) for model in snapshot["models"]]
+            fetched_at = float(snapshot["fetched_at"])
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Не удалось прочитать снимок моделей {self.path}: {e}")
+            return False
+        if not models:
+            return False
+        self.models, self.fetched_at = models, fetched_at
+        return True
+
+    def _write_snapshot(self):
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"models": self.models, "fetched_at": self.fetched_at}, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Не удалось сохранить снимок моделей {self.path}: {e}")
+
+    def load(self) -> List[str]:
+        """
+        Список для построения интерфейса: свежий снимок с диска без запросов,
+        иначе один запрос к бекенду, при его неудаче — устаревший снимок
+        или DEFAULT_MODELS.
+        """
+        if self._read_snapshot() and time.time() - self.fetched_at < self.ttl:
+            logger.info(f"Модели из снимка: {self.models}")
+            return self.models
+        self.refresh()
+        return self.models
+
+    def refresh(self) -> bool:
+        """
+        Запрашивает список у бекенда. True, если список изменился.
+        """
+        try:
+            response = self.backend.get_json(
+                "/api/list_available_models", timeout=self.timeout
+            )
+            models = [str(model) for model in response["models"]]
+        except Exception as e:
+            logger.warning(f"Не удалось получить список моделей: {e}")
+            return False
+        if not models:
+            return False
+
+        with self._lock:
+            changed = models != self.models
+            self.models = models
+            self.fetched_at = time.time()
+            self._write_snapshot()
+        if changed:
+            logger.info(f"Список моделей обновлён: {models}")
+        return changed
+
+    def start_background_refresh(self, interval: float = MODELS_REFRESH_INTERVAL):
+        def run():
+            # Первый запрос — когда устареет список, с которым стартовали
+            time.sleep(max(0.0, self.fetched_at + interval - time.time()))
+            while True:
+                self.refresh()
+                time.sleep(interval)
+
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=run, name="model-catalog", daemon=True
+            )
+            self._thread.start()
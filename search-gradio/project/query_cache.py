@@ -0,0 +1,149 @@
+"""
+Кеш результатов /api/search и /api/retrieve для search-gradio.
+
+Одинаковые запросы (после нормализации текста) к одной модели отдаются
+из памяти: LRU + TTL с ограничениями на число записей и объём. Одновременные
+одинаковые запросы, которых ещё нет в кеше, разделяют один вызов бекенда
+(singleflight): всплеск одного и того же запроса стоит одного похода.
+Промежуточные результаты такого вызова (текст стримящегося ответа)
+получают все, кто его ждёт, а не только первый.
+"""
+
+import json
+import logging
+import os
+import threading
+from concurrent.futures import Executor, Future
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from common.metrics import Counter
+from common.ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", "600"))
+SEARCH_CACHE_MAX_ENTRIES = int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", "1000"))
+SEARCH_CACHE_MAX_MB = int(os.getenv("SEARCH_CACHE_MAX_MB", "64"))
+
+SEARCH_CACHE_REQUESTS = Counter(
+    "search_cache_requests_total",
+    "Запросы к кешу поиска: hit, miss или coalesced (ждали уже идущий запрос)",
+    ["path", "result"],
+)
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.split()).casefold()
+
+
+class _Flight:
+    """
+    Идущий запрос: общий future, подписчики на промежуточные результаты
+    и последний из них — его сразу получает подписавшийся позже.
+    """
+
+    __slots__ = ("future", "subscribers", "progress")
+
+    def __init__(self):
+        self.future: Optional[Future] = None
+        self.subscribers: List[Callable[[Any], None]] = []
+        self.progress: Any = None
+
+
+class QueryCache:
+    def __init__(
+        self,
+        ttl: float = SEARCH_CACHE_TTL,
+        max_entries: int = SEARCH_CACHE_MAX_ENTRIES,
+        max_bytes: int = SEARCH_CACHE_MAX_MB * 1024 * 1024,
+    ):
+        self.ttl = ttl
+        self._results: TTLCache[Tuple, Any] = TTLCache(ttl, max_entries, max_bytes)
+        self._inflight: Dict[Tuple, _Flight] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    @staticmethod
+    def key(path: str, query: str, model: str) -> Tuple[str, str, str]:
+        return (path, normalize_query(query), model)
+
+    def submit(
+        self,
+        pool: Executor,
+        key: Tuple,
+        fn: Callable[..., Any],
+        *args,
+        on_progress: Optional[Callable[[Any], None]] = None,
+    ) -> Future:
+        """
+        Future с результатом fn(*args) для key: готовый из кеша, уже идущий
+        запрос или новый запрос в pool. Future общий для всех ждущих, поэтому
+        вызывающий код не должен его отменять.
+
+        С on_progress новый запрос вызывается как fn(*args, publish):
+        publish(value) передаёт промежуточный результат в on_progress всех
+        ждущих этот key. on_progress вызывается под блокировкой кеша и должен
+        быть быстрым (например, queue.put).
+        """
+        path = key[0]
+        with self._lock:
+            value = self._results.get(key)
+            if value is not None:
+                self.hits += 1
+                SEARCH_CACHE_REQUESTS.labels(path, "hit").inc()
+                future: Future = Future()
+                future.set_result(value)
+                return future
+            flight = self._inflight.get(key)
+            if flight is not None:
+                self.coalesced += 1
+                SEARCH_CACHE_REQUESTS.labels(path, "coalesced").inc()
+                if on_progress is not None:
+                    flight.subscribers.append(on_progress)
+                    if flight.progress is not None:
+                        on_progress(flight.progress)
+                return flight.future
+            self.misses += 1
+            SEARCH_CACHE_REQUESTS.labels(path, "miss").inc()
+            flight = _Flight()
+            if on_progress is not None:
+                flight.subscribers.append(on_progress)
+                args += (lambda value: self._publish(flight, value),)
+            future = flight.future = pool.submit(fn, *args)
+            self._inflight[key] = flight
+        # Колбэк вне блокировки: у уже завершённого future он вызывается сразу
+        future.add_done_callback(lambda done: self._on_done(key, done))
+        return future
+
+    def _publish(self, flight: _Flight, value: Any):
+        with self._lock:
+            flight.progress = value
+            for subscriber in flight.subscribers:
+                subscriber(value)
+
+    def _on_done(self, key: Tuple, future: Future):
+        with self._lock:
+            flight = self._inflight.get(key)
+            if flight is not None and flight.future is future:
+                del self._inflight[key]
+            # Ошибки не кешируем: следующий такой запрос снова пойдёт в бекенд
+            if future.cancelled() or future.exception() is not None:
+                return
+            if self.ttl <= 0:
+                return
+            value = future.result()
+            size = len(json.dumps(value, ensure_ascii=False))
+            self._results.put(key, value, size)
+
+    def stats(self) -> Dict[str, float]:
+        requests = self.hits + self.misses + self.coalesced
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_rate": (self.hits + self.coalesced) / requests if requests else 0.0,
+            "entries": len(self._results),
+            "bytes": self._results.bytes,
+        }
@@ -1,14 +1,16 @@
+import io
 import os
+import sys
 import json
 import logging
 import asyncio
-import aiohttp
 import boto3
 import tempfile
-import time
 import urllib.parse
-import re
+from contextlib import AsyncExitStack
+from typing import List
 from aiogram import Bot, Dispatcher, executor, types
+from aiogram.bot.api import TELEGRAM_PRODUCTION, TelegramAPIServer
 from aiogram.types import (
     InputMediaPhoto,
     InputFile,
@@ -16,31 +18,127 @@ from aiogram.types import (
     KeyboardButton,
 )
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from botocore.config import Config
+
+from common.answer_cache import AnswerCache
+from common.backend_client import AsyncBackendClient
+from common.context_window import build_context
+from common.log_setup import set_log_context, setup_logging
+from common.metrics import Counter, Gauge, start_metrics_server
+from common.sse import EVENT_DATA, EVENT_DONE, EVENT_METADATA
+from conversation_store import create_conversation_store
+from edit_scheduler import TELEGRAM_GLOBAL_BURST, TELEGRAM_GLOBAL_RATE, EditScheduler
+from hedging import StreamHedger, UpstreamError
+from image_cache import FileIdCache, S3ImageCache
+from image_fetch import ImageFetcher
+from image_resize import ImageResizer
+from inflight import ChatTurns, QueueFull, StreamLimiter, Superseded
+from markdown_render import StreamingMarkdownRenderer
+from webhook import BOT_MODE, is_router, run_router, start_worker, total_workers
 
 API_URL = os.getenv("API_URL", "http://0.0.0.0:8200")
 BOT_TOKEN = os.getenv("BOT_TOKEN")
+# Альтернативный адрес Bot API (локальный Bot API server или фейк для проверок)
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
 
 S3_BUCKET = os.getenv("INDEXER_S3_BUCKET", "profagro-docs")
 S3_ACCESS_KEY = os.getenv("INDEXER_S3_ACCESS_KEY")
 S3_SECRET_KEY = os.getenv("INDEXER_S3_SECRET_KEY")
 S3_ENDPOINT = os.getenv("INDEXER_S3_ENDPOINT")
 
-logging.basicConfig(level=logging.INFO)
+IMAGE_CACHE_DIR = os.getenv(
+    "IMAGE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "profagro-images")
+)
+IMAGE_CACHE_MAX_MB = int(os.getenv("IMAGE_CACHE_MAX_MB", "512"))
+IMAGE_CACHE_TTL = int(os.getenv("IMAGE_CACHE_TTL", str(24 * 3600)))
+FILE_ID_CACHE_TTL = int(os.getenv("FILE_ID_CACHE_TTL", str(30 * 24 * 3600)))
+FILE_ID_SAVE_DELAY = float(os.getenv("FILE_ID_SAVE_DELAY", "5"))
+IMAGE_FETCH_CONCURRENCY = int(os.getenv("IMAGE_FETCH_CONCURRENCY", "8"))
+# Сколько неотправленных медиагрупп и списков источников ответа может ждать
+MEDIA_QUEUE_SIZE = 8
+# Предел Telegram на число фото в одной медиагруппе
+MEDIA_GROUP_LIMIT = 10
+
+# JSON-логи через очередь: вывод не блокирует event loop
+setup_logging()
 logger = logging.getLogger(__name__)
 
+bot = Bot(
+    token=BOT_TOKEN,
+    server=(
+        TelegramAPIServer.from_base(TELEGRAM_API_URL)
+        if TELEGRAM_API_URL
+        else TELEGRAM_PRODUCTION
+    ),
+)
+
+if __name__ == "__main__" and is_router():
+    # Роутеру webhook-режима нужен только бот для setWebhook: история, кеши
+    # картинок и пулы процессов есть у каждого воркера, а роутер их не создаёт
+    run_router(bot)
+    sys.exit()
+
 s3_client = boto3.client(
     "s3",
     aws_access_key_id=S3_ACCESS_KEY,
     aws_secret_access_key=S3_SECRET_KEY,
     endpoint_url=S3_ENDPOINT,
     region_name="ru-central-1",
+    # Пул соединений boto3 не меньше числа параллельных загрузок
+    config=Config(max_pool_connections=max(10, IMAGE_FETCH_CONCURRENCY)),
 )
 
-bot = Bot(token=BOT_TOKEN)
+# Страницы документации повторяются из ответа в ответ: держим их на диске,
+# а уже загруженные в Telegram отправляем по file_id
+image_cache = S3ImageCache(
+    s3_client,
+    S3_BUCKET,
+    IMAGE_CACHE_DIR,
+    max_bytes=IMAGE_CACHE_MAX_MB * 1024 * 1024,
+    ttl=IMAGE_CACHE_TTL,
+)
+file_id_cache = FileIdCache(
+    os.path.join(IMAGE_CACHE_DIR, "file_ids.json"),
+    ttl=FILE_ID_CACHE_TTL,
+    save_delay=FILE_ID_SAVE_DELAY,
+)
+image_fetcher = ImageFetcher(image_cache, concurrency=IMAGE_FETCH_CONCURRENCY)
+# Страницы уходят пользователю уменьшенными JPEG/WebP (см. IMAGE_FORMAT)
+image_resizer = ImageResizer()
+
+# Общий пул соединений к бекенду на всё время жизни бота
+backend = AsyncBackendClient(API_URL, read_timeout=300)
+
+# Готовые ответы на частые первые вопросы (включается ANSWER_CACHE=1)
+answer_cache = AnswerCache()
+
 dp = Dispatcher(bot)
 
-# Храним историю диалогов
-conversations = {}
+# Все правки и сообщения стримов идут через общий планировщик с лимитами Telegram.
+# В webhook-режиме глобальный лимит бота делится поровну между воркерами
+edits = EditScheduler(
+    bot,
+    global_rate=TELEGRAM_GLOBAL_RATE / total_workers(),
+    global_burst=max(1.0, TELEGRAM_GLOBAL_BURST / total_workers()),
+)
+
+# Храним историю диалогов (в памяти или в SQLite, см. CONVERSATION_STORE)
+conversations = create_conversation_store()
+
+# Не больше одного ответа на чат и ограниченное число стримов к бекенду
+turns = ChatTurns()
+upstream = StreamLimiter()
+
+# Медленный или упавший эндпоинт модели подстраховывается другим (HEDGING=1);
+# запасной стрим занимает свободный слот upstream или не запускается
+hedger = StreamHedger(limiter=upstream)
+
+Gauge(
+    "bot_upstream_queue_depth", "Запросы, ожидающие свободного стрима к бекенду"
+).set_function(lambda: upstream.queue_depth)
+UPSTREAM_REJECTED = Counter(
+    "bot_upstream_rejected_total", "Запросы, отклонённые из-за переполнения очереди"
+)
 
 # Создаём кнопочную клавиатуру
 start_keyboard = ReplyKeyboardMarkup(resize_keyboard=True)
@@ -64,43 +162,92 @@ def normalize_key(key: str) -> str:
     return urllib.parse.quote(key, safe="/")
 
 
-async def download_image_from_s3(s3_key: str) -> str:
-    loop = asyncio.get_event_loop()
-    local_fd, local_path = tempfile.mkstemp()
-    os.close(local_fd)
+def image_cache_stats() -> dict:
+    return {**image_cache.stats(), **file_id_cache.stats(), **image_resizer.stats()}
 
-    logger.info(f"Using raw key: {s3_key}")
 
-    def download():
+async def send_page_images(chat_id: int, image_keys: List[str]):
+    """
+    Отправляет страницы документации медиагруппами (Telegram принимает не
+    больше 10 фото в группе). Уже загруженные в Telegram идут по file_id,
+    остальные скачиваются параллельно прямо в память и пережимаются.
+    Недоступные картинки пропускаются.
+    """
+    file_ids = {key: file_id_cache.get(key) for key in image_keys}
+    images = await image_fetcher.fetch_all(
+        key for key in image_keys if not file_ids[key]
+    )
+    prepared = {
+        key: (filename, data)
+        for key, filename, data in await image_resizer.prepare_all(images)
+    }
+
+    # Фото (file_id или InputFile) рядом с его InputMediaPhoto: у загружаемого
+    # файла .media — только ссылка attach:// на вложение медиагруппы
+    photos = []
+    media_files = []
+    uploaded_keys = []
+    for key in image_keys:
+        if file_ids[key]:
+            photo = file_ids[key]
+            uploaded_keys.append(None)
+        elif key in prepared:
+            filename, data = prepared[key]
+            photo = InputFile(io.BytesIO(data), filename=filename)
+            uploaded_keys.append(key)
+        else:
+            continue
+        photos.append(photo)
+        media_files.append(InputMediaPhoto(photo))
+
+    for start in range(0, len(media_files), MEDIA_GROUP_LIMIT):
+        batch = media_files[start : start + MEDIA_GROUP_LIMIT]
+        if len(batch) == 1:
+            # Медиагруппа из одного фото Telegram не принимает
+            sent_messages = [
+                await edits.call(chat_id, bot.send_photo, chat_id, photos[start])
+            ]
+        else:
+            sent_messages = await edits.call(
+                chat_id, bot.send_media_group, chat_id, batch
+            )
+        keys = uploaded_keys[start : start + MEDIA_GROUP_LIMIT]
+        for key, sent in zip(keys, sent_messages):
+            if key and sent.photo:
+                file_id_cache.set(key, sent.photo[-1].file_id)
+    if media_files:
+        logger.info(f"Кеш картинок: {image_cache_stats()}")
+
+
+async def send_media(chat_id: int, queue: asyncio.Queue):
+    """
+    Отправляет картинки и источники ответа из очереди, пока не придёт None.
+
+    Работает отдельной задачей: пока скачиваются картинки и идут вызовы
+    Telegram, чтение стрима не останавливается и токены не задерживаются.
+    Ошибка отправки не обрывает ответ.
+    """
+    while True:
+        item = await queue.get()
+        if item is None:
+            return
+        kind, value = item
         try:
-            s3_client.head_object(Bucket=S3_BUCKET, Key=s3_key)
-            s3_client.download_file(S3_BUCKET, s3_key, local_path)
-            return local_path
+            if kind == "images":
+                await send_page_images(chat_id, value)
+            else:
+                await edits.send_text(chat_id, value)
         except Exception as e:
-            logger.error(f"Ошибка скачивания {s3_key}: {e}")
-            return None
-
-    local_file = await loop.run_in_executor(None, download)
-    return local_file
+            logger.error(f"Не удалось отправить {kind} в чат {chat_id}: {e}")
 
 
 def simple_markdown_to_html(md_text: str) -> str:
     """
     Упрощённое преобразование Markdown-разметки в HTML.
-    Telegram не поддерживает <br> в parse_mode=HTML, поэтому заменяем на \n.
+    Telegram не поддерживает <br> в parse_mode=HTML, поэтому переносы остаются \n.
+    Для стримящегося ответа используйте StreamingMarkdownRenderer напрямую.
     """
-    # Заменяем заголовки на <b>…</b> + перенос строки
-    md_text = re.sub(r"(?m)^#{3}\s+(.*?)$", r"<b>\1</b>\n", md_text)
-    md_text = re.sub(r"(?m)^#{2}\s+(.*?)$", r"<b>\1</b>\n", md_text)
-    md_text = re.sub(r"(?m)^#\s+(.*?)$", r"<b>\1</b>\n", md_text)
-
-    # Жирный текст
-    md_text = re.sub(r"\*\*(.*?)\*\*", r"<b>\1</b>", md_text, flags=re.DOTALL)
-
-    # Курсив
-    md_text = re.sub(r"_(.*?)_", r"<i>\1</i>", md_text, flags=re.DOTALL)
-
-    return md_text
+    return StreamingMarkdownRenderer().render(md_text)
 
 
 def format_date_yyyymmdd(date_str: str) -> str:
@@ -130,7 +277,7 @@ def format_duration_secs(secs: int) -> str:
 
 @dp.message_handler(commands=["start"])
 async def start_cmd(message: types.Message):
-    conversations[message.chat.id] = []
+    await conversations.reset(message.chat.id)
     await message.answer(
         "Добро пожаловать! Выберите нужный пункт меню:", reply_markup=start_keyboard
     )
@@ -138,7 +285,7 @@ async def start_cmd(message: types.Message):
 
 @dp.message_handler(lambda message: message.text == "Начать новый диалог")
 async def new_dialog_handler(message: types.Message):
-    conversations[message.chat.id] = {"history": [], "company": None}
+    await conversations.reset(message.chat.id)
 
     await message.answer(
         "Новый диалог начат. Выберите пожалуйста компанию, по чьей технической документации вы хотите поговорить:",
@@ -153,10 +300,13 @@ async def handle_company_choice(callback_query: types.CallbackQuery):
         1
     ]  # Получаем выбор компании (amazone или kverneland)
 
-    conversations[chat_id]["company"] = company.lower()
-    conversations[chat_id]["history"].append(
-        {"role": "system", "content": f"Компания: {company}"}
-    )
+    async with conversations.lock(chat_id):
+        conversation = await conversations.get(chat_id)
+        conversation.company = company.lower()
+        conversation.history.append(
+            {"role": "system", "content": f"Компания: {company}"}
+        )
+        await conversations.put(chat_id, conversation)
 
     # Отправляем сообщение с предложением выбрать модель
     await bot.edit_message_text(
@@ -176,10 +326,13 @@ async def handle_model_choice(callback_query: types.CallbackQuery):
     model = callback_query.data.split("_")[1]  # Получаем модель (gpt4o или gigachat)
 
     # Сохраняем выбранную модель в историю
-    conversations[chat_id]["model"] = model
+    async with conversations.lock(chat_id):
+        conversation = await conversations.get(chat_id)
+        conversation.model = model
+        await conversations.put(chat_id, conversation)
 
     await bot.edit_message_text(
-        f"Вы выбрали модель {model} и техническую документацию компании {conversations[chat_id]['company'].upper()}. Можете писать ваш запрос.",
+        f"Вы выбрали модель {model} и техническую документацию компании {(conversation.company or '').upper()}. Можете писать ваш запрос.",
         chat_id,
         callback_query.message.message_id,
         reply_markup=None,  # Убираем inline-кнопки
@@ -191,267 +344,284 @@ async def handle_model_choice(callback_query: types.CallbackQuery):
 
 @dp.message_handler(content_types=types.ContentTypes.TEXT)
 async def handle_message(message: types.Message):
-    chat_id = message.chat.id
-    user_text = message.text
-
-    if chat_id not in conversations:
-        conversations[chat_id] = {"history": [], "company": None, "model": None}
-
-    history = conversations[chat_id]["history"]
-    company = conversations[chat_id]["company"]
-    model = conversations[chat_id]["model"]
+    set_log_context(
+        request_id=f"{message.chat.id}:{message.message_id}", chat_id=message.chat.id
+    )
+    try:
+        async with turns.turn(message.chat.id):
+            await answer_message(message)
+    except Superseded:
+        logger.info(f"Сообщение в чате {message.chat.id} вытеснено более новым")
 
-    # Проверяем, была ли выбрана компания
-    if not company:
-        await message.answer("Компания не выбрана, пожалуйста, выберите компанию.")
-        return
 
-    if not model:
-        await message.answer("Модель не выбрана, пожалуйста, выберите модель.")
-        return
+async def answer_message(message: types.Message):
+    chat_id = message.chat.id
+    user_text = message.text
 
-    history.append({"role": "user", "content": user_text})
+    async with conversations.lock(chat_id):
+        conversation = await conversations.get(chat_id)
+        company = conversation.company
+        model = conversation.model
+
+        # Проверяем, была ли выбрана компания
+        if not company:
+            await message.answer("Компания не выбрана, пожалуйста, выберите компанию.")
+            return
+
+        if not model:
+            await message.answer("Модель не выбрана, пожалуйста, выберите модель.")
+            return
+
+        user_message = {"role": "user", "content": user_text}
+        await conversations.append(chat_id, user_message)
+    # В бекенд уходит только окно контекста, полная история остаётся в хранилище
+    history = conversation.history + [user_message]
+    context = build_context(history)
+    if context.dropped:
+        logger.info(
+            f"История обрезана: {context.summary()}", extra={"category": "context"}
+        )
 
     bot_message = await message.answer("⏳ Обработка вашего запроса...")
     bot_message_id = bot_message.message_id
+    # Рендерер помнит уже обработанную часть ответа и рендерит только новый хвост
+    answer = edits.stream(
+        chat_id, bot_message_id, render=StreamingMarkdownRenderer().render
+    )
 
     assistant_response = ""
 
+    def show_queue_position(position: int):
+        answer.update(f"⏳ Много запросов, вы {position}-й в очереди...")
+
+    # Чтение стрима, правки и медиа — три независимых потребителя: правки
+    # копит и отправляет планировщик (answer.update не ждёт Telegram),
+    # картинки и источники отправляет задача send_media
+    media = asyncio.Queue(maxsize=MEDIA_QUEUE_SIZE)
+    media_task = asyncio.create_task(send_media(chat_id, media))
+    streamed = False
+
     try:
-        async with aiohttp.ClientSession() as session:
-            payload = {
-                "chat_history": history,
-                "company": company,  # Добавляем компанию в запрос
-            }
-            if model == "GPT4o":
-                api_url = f"{API_URL}/api/agent"
-            elif model == "GigaChat-MAX":
-                api_url = f"{API_URL}/api/agent_gigachat"
+        payload = {
+            "chat_history": context.messages,
+            "company": company,  # Добавляем компанию в запрос
+        }
+        if model == "GPT4o":
+            api_path = "/api/agent"
+        elif model == "GigaChat-MAX":
+            api_path = "/api/agent_gigachat"
+        else:
+            await edits.edit_text(
+                chat_id, bot_message_id, "Ошибка: неверно выбрана модель."
+            )
+            return
+        # Однократность диалога решает полная история, а не обрезанное окно
+        cache_key = answer_cache.key(history, company, api_path)
+        cached = answer_cache.get(cache_key)
+        async with AsyncExitStack() as stack:
+            if cached is not None:
+                # Повтор готового ответа идёт тем же путём, что и живой стрим
+                stats = None
+                events = answer_cache.replay(cached)
             else:
-                await bot.edit_message_text(
-                    "Ошибка: неверно выбрана модель.",
-                    chat_id,
-                    bot_message_id,
-                    parse_mode="HTML",
-                )
-                return
-            async with session.post(api_url, json=payload, timeout=300) as resp:
-                if resp.status != 200:
-                    await bot.edit_message_text(
-                        "Ошибка при обращении к API.",
-                        chat_id,
-                        bot_message_id,
-                        parse_mode="HTML",
+                await stack.enter_async_context(upstream.slot(show_queue_position))
+                try:
+                    stream = await stack.enter_async_context(
+                        hedger.stream(backend, api_path, payload)
+                    )
+                except UpstreamError as e:
+                    logger.error(f"Бекенд не ответил: {e}")
+                    await edits.edit_text(
+                        chat_id, bot_message_id, "Ошибка при обращении к API."
                     )
                     return
-
-                event_type = None
-                buffer = ""
-                last_edit_time = time.time()
-
-                while not resp.content.at_eof():
-                    raw_line = await resp.content.readline()
-                    if not raw_line:
-                        break
-                    line = raw_line.decode("utf-8").rstrip("\n")
-
-                    # Обработка блочного разделителя SSE
-                    if line.strip() == "":
-                        if event_type and buffer:
-                            try:
-                                data = json.loads(buffer)
-                            except json.JSONDecodeError:
-                                logger.warning(f"Некорректный JSON: {buffer}")
-                                event_type = None
-                                buffer = ""
-                                continue
-
-                            if event_type == "data":
-                                content = data.get("content", "")
-                                assistant_response += content
-
-                                # Периодически подправляем отображение
-                                if time.time() - last_edit_time > 1.0:
-                                    html_preview = simple_markdown_to_html(
-                                        assistant_response
-                                    )
-                                    await bot.edit_message_text(
-                                        html_preview,
-                                        chat_id,
-                                        bot_message_id,
-                                        parse_mode="HTML",
+                stats = stream.stats
+                if stream.endpoint != api_path:
+                    # Ответ другой модели кешируется под её эндпоинтом
+                    cache_key = answer_cache.key(history, company, stream.endpoint)
+                events = answer_cache.record(cache_key, stream.events)
+
+            async for event in events:
+                try:
+                    data = event.json()
+                except json.JSONDecodeError:
+                    logger.warning(f"Некорректный JSON: {event.data}")
+                    continue
+
+                if event.kind == EVENT_DATA:
+                    if stats is not None:
+                        stats.token()
+                    content = data.get("content", "")
+                    assistant_response += content
+
+                    # Планировщик сам решает, когда отправить правку, и шлёт
+                    # только последнюю версию текста
+                    answer.update(assistant_response)
+
+                elif event.kind == EVENT_METADATA:
+                    image_list = []
+                    doc_sources = {}
+                    youtube_refs = []
+
+                    for meta in data.get("tool_messages", []):
+                        logger.info(
+                            "Метаданные инструмента",
+                            extra={"category": "tool_messages", "payload": meta},
+                        )
+                        source = meta.get("source", "")
+                        image_info = meta.get("image", "")
+                        video_name = meta.get("video_name", "")
+                        video_date = meta.get("video_date", "")
+                        video_len = meta.get("video_len", "")
+
+                        # Список картинок, которые будем скачивать
+                        if image_info:
+                            image_list.append(image_info)
+
+                        # Определяем, что это за источник
+                        if "youtube" in source:
+                            # Добавляем в youtube_refs, если хотя бы есть название
+                            # или сама ссылка. Можно расширить при необходимости.
+                            if video_name:
+                                ref_str = f"«{video_name}»"
+                                # Преобразуем дату
+                                if video_date:
+                                    ref_str += (
+                                        f", дата: {format_date_yyyymmdd(video_date)}"
                                     )
-                                    last_edit_time = time.time()
-
-                            elif event_type == "metadata":
-                                image_list = []
-                                doc_sources = {}
-                                youtube_refs = []
-
-                                for meta in data.get("tool_messages", []):
-                                    logger.info(f"Глобальная проверка: {meta}")
-                                    source = meta.get("source", "")
-                                    image_info = meta.get("image", "")
-                                    video_name = meta.get("video_name", "")
-                                    video_date = meta.get("video_date", "")
-                                    video_len = meta.get("video_len", "")
-
-                                    # Список картинок, которые будем скачивать
-                                    if image_info:
-                                        image_list.append(image_info)
-
-                                    # Определяем, что это за источник
-                                    if "youtube" in source:
-                                        # Добавляем в youtube_refs, если хотя бы есть название
-                                        # или сама ссылка. Можно расширить при необходимости.
-                                        if video_name:
-                                            ref_str = f"«{video_name}»"
-                                            # Преобразуем дату
-                                            if video_date:
-                                                ref_str += f", дата: {format_date_yyyymmdd(video_date)}"
-                                            # Преобразуем длительность
-                                            if video_len.isdigit():
-                                                duration_str = format_duration_secs(
-                                                    int(video_len)
-                                                )
-                                                ref_str += (
-                                                    f", длительность: {duration_str}"
-                                                )
-                                            youtube_refs.append(ref_str)
-
-                                    elif source == "document":
-                                        # Если пришли отдельные метаданные для документа.
-                                        # Или используем поведение "иначе" (depends on your agent logic)
-                                        pass
-
-                                    else:
-                                        # Предполагаем, что это документ, если есть image_info
-                                        if image_info:
-                                            parts = image_info.split("/")
-                                            if len(parts) >= 2:
-                                                doc_name = parts[-2].strip()
-                                                page_part = parts[-1].strip()
-                                                page_number = (
-                                                    page_part.replace("page_", "")
-                                                    .replace(".png", "")
-                                                    .strip()
-                                                )
-                                                # Пропускаем пустые названия или страницы
-                                                if doc_name and page_number:
-                                                    if doc_name not in doc_sources:
-                                                        doc_sources[doc_name] = set()
-                                                    doc_sources[doc_name].add(
-                                                        page_number
-                                                    )
-
-                                # Скачиваем и отправляем картинки (если есть)
-                                media_files = []
-                                local_files = []
-                                for image_key in image_list:
-                                    local_file = await download_image_from_s3(image_key)
-                                    if local_file:
-                                        local_files.append(local_file)
-                                        media_files.append(
-                                            InputMediaPhoto(InputFile(local_file))
-                                        )
-
-                                if media_files:
-                                    await bot.send_media_group(chat_id, media_files)
-
-                                # Удаляем временные файлы
-                                for local_path in local_files:
-                                    try:
-                                        os.remove(local_path)
-                                    except Exception as e:
-                                        logger.warning(
-                                            f"Не удалось удалить файл {local_path}: {e}"
-                                        )
-
-                                # Проверяем, действительно ли есть источники
-                                has_docs = bool(doc_sources)
-                                has_videos = bool(youtube_refs)
-
-                                # Если ни документации, ни YouTube-ссылок нет — пропускаем отправку
-                                if has_docs or has_videos:
-                                    ref_text_lines = []
-                                    ref_text_lines.append(
-                                        "<b>Информация взята из:</b>\n"
+                                # Преобразуем длительность
+                                if video_len.isdigit():
+                                    duration_str = format_duration_secs(int(video_len))
+                                    ref_str += f", длительность: {duration_str}"
+                                youtube_refs.append(ref_str)
+
+                        elif source == "document":
+                            # Если пришли отдельные метаданные для документа.
+                            # Или используем поведение "иначе" (depends on your agent logic)
+                            pass
+
+                        else:
+                            # Предполагаем, что это документ, если есть image_info
+                            if image_info:
+                                parts = image_info.split("/")
+                                if len(parts) >= 2:
+                                    doc_name = parts[-2].strip()
+                                    page_part = parts[-1].strip()
+                                    page_number = (
+                                        page_part.replace("page_", "")
+                                        .replace(".png", "")
+                                        .strip()
                                     )
-
-                                    # Документация
-                                    if has_docs:
-                                        ref_text_lines.append("<b>- Документация</b>")
-                                        for doc_name, pages_set in doc_sources.items():
-                                            # Если всё же что-то не распарсилось, doc_name может быть пустым
-                                            if not doc_name:
-                                                continue
-                                            # Сортируем страницы (если это цифры, иначе строка)
-                                            sorted_pages = sorted(
-                                                pages_set,
-                                                key=lambda p: (
-                                                    int(p) if p.isdigit() else p
-                                                ),
-                                            )
-                                            pages_str = ", ".join(sorted_pages)
-                                            ref_text_lines.append(
-                                                f"-> «{doc_name}», стр. {pages_str}"
-                                            )
-                                        ref_text_lines.append("")
-
-                                    # YouTube
-                                    if has_videos:
-                                        ref_text_lines.append("<b>- YouTube</b>")
-                                        for ref in youtube_refs:
-                                            ref_text_lines.append(f"-> {ref}")
-                                        ref_text_lines.append("")
-
-                                    final_ref_text = "\n".join(ref_text_lines).strip()
-                                    # Убедимся, что финальный текст не пуст (если, допустим,
-                                    # doc_name оказался пустым и ничего не вышло)
-                                    # Если что-то осталось — отправляем
-                                    if (
-                                        final_ref_text
-                                        and final_ref_text
-                                        != "<b>Информация взята из:</b>"
-                                    ):
-                                        await bot.send_message(
-                                            chat_id, final_ref_text, parse_mode="HTML"
-                                        )
-
-                            elif event_type == "done":
-                                break
-
-                        event_type = None
-                        buffer = ""
-                        continue
-
-                    # Стандартная обработка SSE-заголовков
-                    if line.startswith("event:"):
-                        event_type = line.split(":", 1)[1].strip()
-                    elif line.startswith("data:"):
-                        buffer += line[6:]
+                                    # Пропускаем пустые названия или страницы
+                                    if doc_name and page_number:
+                                        if doc_name not in doc_sources:
+                                            doc_sources[doc_name] = set()
+                                        doc_sources[doc_name].add(page_number)
+
+                    # Отправляем картинки (если есть)
+                    if image_list:
+                        await media.put(("images", image_list))
+
+                    # Проверяем, действительно ли есть источники
+                    has_docs = bool(doc_sources)
+                    has_videos = bool(youtube_refs)
+
+                    # Если ни документации, ни YouTube-ссылок нет — пропускаем отправку
+                    if has_docs or has_videos:
+                        ref_text_lines = []
+                        ref_text_lines.append("<b>Информация взята из:</b>\n")
+
+                        # Документация
+                        if has_docs:
+                            ref_text_lines.append("<b>- Документация</b>")
+                            for doc_name, pages_set in doc_sources.items():
+                                # Если всё же что-то не распарсилось, doc_name может быть пустым
+                                if not doc_name:
+                                    continue
+                                # Сортируем страницы (если это цифры, иначе строка)
+                                sorted_pages = sorted(
+                                    pages_set,
+                                    key=lambda p: (int(p) if p.isdigit() else p),
+                                )
+                                pages_str = ", ".join(sorted_pages)
+                                ref_text_lines.append(
+                                    f"-> «{doc_name}», стр. {pages_str}"
+                                )
+                            ref_text_lines.append("")
+
+                        # YouTube
+                        if has_videos:
+                            ref_text_lines.append("<b>- YouTube</b>")
+                            for ref in youtube_refs:
+                                ref_text_lines.append(f"-> {ref}")
+                            ref_text_lines.append("")
+
+                        final_ref_text = "\n".join(ref_text_lines).strip()
+                        # Убедимся, что финальный текст не пуст (если, допустим,
+                        # doc_name оказался пустым и ничего не вышло)
+                        # Если что-то осталось — отправляем
+                        if (
+                            final_ref_text
+                            and final_ref_text != "<b>Информация взята из:</b>"
+                        ):
+                            await media.put(("sources", final_ref_text))
+
+                elif event.kind == EVENT_DONE:
+                    break
+        # Ответ дочитан: после оставшихся картинок и источников send_media выйдет
+        await media.put(None)
+        streamed = True
+    except QueueFull:
+        UPSTREAM_REJECTED.inc()
+        await answer.finish(
+            "Сейчас слишком много запросов, попробуйте через минуту.", render=False
+        )
+        return
+    except asyncio.CancelledError:
+        # Ответ прерван новым сообщением пользователя или остановкой бота:
+        # показываем и сохраняем то, что успело прийти
+        await answer.finish(f"{assistant_response}\n\n_Ответ прерван_")
+        await conversations.append(
+            chat_id, {"role": "assistant", "content": assistant_response}
+        )
+        raise
     except Exception as e:
         logger.error(f"Ошибка при обработке запроса: {e}")
-        await bot.edit_message_text(
-            "Произошла ошибка при обработке запроса.",
-            chat_id,
-            bot_message_id,
-            parse_mode="HTML",
-        )
+        await answer.finish("Произошла ошибка при обработке запроса.", render=False)
         return
+    finally:
+        # Ответ прерван или не получен — неотправленные медиа уже не нужны
+        if not streamed:
+            media_task.cancel()
 
-    if assistant_response.strip():
-        html_final = simple_markdown_to_html(assistant_response)
-        await bot.edit_message_text(
-            html_final, chat_id, bot_message_id, parse_mode="HTML"
-        )
-    else:
-        await bot.edit_message_text(
-            "Пустой ответ от ассистента.", chat_id, bot_message_id, parse_mode="HTML"
-        )
+    try:
+        if assistant_response.strip():
+            await answer.finish(assistant_response)
+        else:
+            await answer.finish("Пустой ответ от ассистента.", render=False)
+    except Exception as e:
+        # Пользователь ответа не увидел — в историю его не сохраняем
+        logger.error(f"Не удалось отправить ответ в чат {chat_id}: {e}")
+        media_task.cancel()
+        return
 
-    history.append({"role": "assistant", "content": assistant_response})
+    await conversations.append(
+        chat_id, {"role": "assistant", "content": assistant_response}
+    )
+    await media_task
+
+
+async def on_shutdown(dispatcher: Dispatcher):
+    await backend.close()
+    await conversations.close()
+    await file_id_cache.close()
+    image_fetcher.shutdown()
+    image_resizer.shutdown()
 
 
 if __name__ == "__main__":
-    executor.start_polling(dp, skip_updates=True)
+    if BOT_MODE == "webhook":
+        start_worker(dp, on_shutdown=on_shutdown)
+    else:
+        start_metrics_server()
+        executor.start_polling(dp, skip_updates=True, on_shutdown=on_shutdown)
@@ -0,0 +1,332 @@
+"""
+Хранилище диалогов telegram-бота.
+
+У каждого чата одна и та же форма данных — Conversation (история, компания,
+модель). Бекенды:
+
+- MemoryConversationStore — в памяти процесса, LRU + TTL и ограничения
+  на число чатов, длину истории и суммарный объём текста;
+- SQLiteConversationStore — в файле SQLite: переживает рестарт и разделяется
+  несколькими процессами бота на одном хосте.
+
+История только дополняется (append), поэтому параллельные сообщения одного
+чата не затирают друг друга. Для операций «прочитать-изменить-записать»
+есть поканальная блокировка lock(chat_id).
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+import weakref
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from common.ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+CONVERSATION_STORE = os.getenv("CONVERSATION_STORE", "memory")
+CONVERSATION_DB_PATH = os.getenv("CONVERSATION_DB_PATH", "conversations.sqlite3")
+CONVERSATION_TTL = int(os.getenv("CONVERSATION_TTL", str(7 * 24 * 3600)))
+CONVERSATION_MAX_CHATS = int(os.getenv("CONVERSATION_MAX_CHATS", "100000"))
+CONVERSATION_MAX_MESSAGES = int(os.getenv("CONVERSATION_MAX_MESSAGES", "200"))
+CONVERSATION_MAX_MB = int(os.getenv("CONVERSATION_MAX_MB", "256"))
+
+
+@dataclass
+class Conversation:
+    history: List[Dict[str, str]] = field(default_factory=list)
+    company: Optional[str] = None
+    model: Optional[str] = None
+
+
+def _message_size(message: Dict[str, str]) -> int:
+    return len(message.get("content", ""))
+
+
+def _trim_history(history: List[Dict[str, str]], max_messages: int):
+    """
+    Оставляем системные сообщения (компания) и последние реплики.
+    """
+    excess = len(history) - max_messages
+    if excess <= 0:
+        return
+    kept = []
+    for message in history:
+        if excess > 0 and message.get("role") != "system":
+            excess -= 1
+            continue
+        kept.append(message)
+    history[:] = kept
+
+
+class ConversationStore(ABC):
+    """
+    Общий интерфейс бекендов. Все методы асинхронные, get() возвращает копию,
+    которую можно свободно менять до put().
+    """
+
+    def __init__(self):
+        self._locks: "weakref.WeakValueDictionary[int, asyncio.Lock]" = (
+            weakref.WeakValueDictionary()
+        )
+
+    def lock(self, chat_id: int) -> asyncio.Lock:
+        lock = self._locks.get(chat_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[chat_id] = lock
+        return lock
+
+    @abstractmethod
+    async def get(self, chat_id: int) -> Conversation:
+        pass
+
+    @abstractmethod
+    async def put(self, chat_id: int, conversation: Conversation):
+        pass
+
+    @abstractmethod
+    async def append(self, chat_id: int, *messages: Dict[str, str]):
+        pass
+
+    async def reset(self, chat_id: int):
+        await self.put(chat_id, Conversation())
+
+    async def close(self):
+        pass
+
+
+class MemoryConversationStore(ConversationStore):
+    def __init__(
+        self,
+        ttl: float = CONVERSATION_TTL,
+        max_chats: int = CONVERSATION_MAX_CHATS,
+        max_messages: int = CONVERSATION_MAX_MESSAGES,
+        max_bytes: int = CONVERSATION_MAX_MB * 1024 * 1024,
+    ):
+        super().__init__()
+        self.max_messages = max_messages
+        # TTL считается от последнего сообщения чата
+        self._conversations: TTLCache[int, Conversation] = TTLCache(
+            ttl, max_chats, max_bytes, sliding=True
+        )
+
+    async def get(self, chat_id: int) -> Conversation:
+        conversation = self._conversations.get(chat_id)
+        if conversation is None:
+            return Conversation()
+        return Conversation(
+            list(conversation.history), conversation.company, conversation.model
+        )
+
+    async def put(self, chat_id: int, conversation: Conversation):
+        conversation = Conversation(
+            list(conversation.history), conversation.company, conversation.model
+        )
+        _trim_history(conversation.history, self.max_messages)
+        self._conversations.put(
+            chat_id, conversation, sum(map(_message_size, conversation.history))
+        )
+
+    async def append(self, chat_id: int, *messages: Dict[str, str]):
+        conversation = self._conversations.get(chat_id)
+        if conversation is None:
+            await self.put(chat_id, Conversation(list(messages)))
+            return
+        history = conversation.history
+        history.extend(messages)
+        if len(history) > self.max_messages:
+            _trim_history(history, self.max_messages)
+            size = sum(map(_message_size, history))
+        else:
+            size = self._conversations.size(chat_id) + sum(map(_message_size, messages))
+        self._conversations.resize(chat_id, size)
+
+    def __len__(self) -> int:
+        return len(self._conversations)
+
+
+class SQLiteConversationStore(ConversationStore):
+    """
+    Диалоги в SQLite (WAL). Все обращения к базе идут через один выделенный
+    поток, чтобы не блокировать event loop. Сообщения лежат отдельными
+    строками, поэтому append — это INSERT без чтения истории и безопасен
+    даже для нескольких процессов.
+    """
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS conversations (
+            chat_id INTEGER PRIMARY KEY,
+            company TEXT,
+            model TEXT,
+            updated_at REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL,
+            message TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS messages_chat_id ON messages (chat_id, id);
+        CREATE INDEX IF NOT EXISTS conversations_updated_at
+            ON conversations (updated_at);
+    """
+
+    # Как часто (в операциях записи) чистить истёкшие диалоги
+    _CLEANUP_EVERY = 1000
+
+    def __init__(
+        self,
+        path: str = CONVERSATION_DB_PATH,
+        ttl: float = CONVERSATION_TTL,
+        max_messages: int = CONVERSATION_MAX_MESSAGES,
+    ):
+        super().__init__()
+        self.path = path
+        self.ttl = ttl
+        self.max_messages = max_messages
+        self._writes = 0
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="conversations"
+        )
+        self._conn: Optional[sqlite3.Connection] = None
+        self._executor.submit(self._connect).result()
+
+    def _connect(self):
+        self._conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self._SCHEMA)
+
+    async def _run(self, fn, *args):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    def _load_history(self, chat_id: int) -> List[Dict[str, str]]:
+        return [
+            json.loads(message)
+            for (message,) in self._conn.execute(
+                "SELECT message FROM messages WHERE chat_id = ? ORDER BY id",
+                (chat_id,),
+            )
+        ]
+
+    def _insert_messages(self, chat_id: int, messages):
+        self._conn.executemany(
+            "INSERT INTO messages (chat_id, message) VALUES (?, ?)",
+            [(chat_id, json.dumps(m, ensure_ascii=False)) for m in messages],
+        )
+
+    def _get(self, chat_id: int) -> Conversation:
+        row = self._conn.execute(
+            "SELECT company, model, updated_at FROM conversations WHERE chat_id = ?",
+            (chat_id,),
+        ).fetchone()
+        if row is None or time.time() - row[2] > self.ttl:
+            return Conversation()
+        return Conversation(self._load_history(chat_id), row[0], row[1])
+
+    def _put(self, chat_id: int, conversation: Conversation):
+        history = list(conversation.history)
+        _trim_history(history, self.max_messages)
+        with self._transaction():
+            self._conn.execute(
+                "INSERT OR REPLACE INTO conversations VALUES (?, ?, ?, ?)",
+                (chat_id, conversation.company, conversation.model, time.time()),
+            )
+            self._conn.execute("DELETE FROM messages WHERE chat_id = ?", (chat_id,))
+            self._insert_messages(chat_id, history)
+        self._after_write()
+
+    def _append(self, chat_id: int, messages):
+        now = time.time()
+        with self._transaction():
+            row = self._conn.execute(
+                "SELECT updated_at FROM conversations WHERE chat_id = ?", (chat_id,)
+            ).fetchone()
+            if row is None or now - row[0] > self.ttl:
+                # Истёкший диалог начинаем с чистого листа
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO conversations VALUES (?, NULL, NULL, ?)",
+                    (chat_id, now),
+                )
+                self._conn.execute("DELETE FROM messages WHERE chat_id = ?", (chat_id,))
+            else:
+                self._conn.execute(
+                    "UPDATE conversations SET updated_at = ? WHERE chat_id = ?",
+                    (now, chat_id),
+                )
+            self._insert_messages(chat_id, messages)
+
+            # Обрезаем историю только когда она действительно переросла лимит
+            count = self._conn.execute(
+                "SELECT COUNT(*) FROM messages WHERE chat_id = ?", (chat_id,)
+            ).fetchone()[0]
+            if count > self.max_messages:
+                history = self._load_history(chat_id)
+                _trim_history(history, self.max_messages)
+                self._conn.execute("DELETE FROM messages WHERE chat_id = ?", (chat_id,))
+                self._insert_messages(chat_id, history)
+        self._after_write()
+
+    def _transaction(self):
+        return _Transaction(self._conn)
+
+    def _after_write(self):
+        self._writes += 1
+        if self._writes % self._CLEANUP_EVERY:
+            return
+        deadline = time.time() - self.ttl
+        with self._transaction():
+            self._conn.execute(
+                "DELETE FROM messages WHERE chat_id IN "
+                "(SELECT chat_id FROM conversations WHERE updated_at < ?)",
+                (deadline,),
+            )
+            self._conn.execute(
+                "DELETE FROM conversations WHERE updated_at < ?", (deadline,)
+            )
+
+    async def get(self, chat_id: int) -> Conversation:
+        return await self._run(self._get, chat_id)
+
+    async def put(self, chat_id: int, conversation: Conversation):
+        await self._run(self._put, chat_id, conversation)
+
+    async def append(self, chat_id: int, *messages: Dict[str, str]):
+        await self._run(self._append, chat_id, messages)
+
+    async def close(self):
+        await self._run(self._conn.close)
+        self._executor.shutdown(wait=False)
+
+
+class _Transaction:
+    """
+    BEGIN IMMEDIATE сразу берёт блокировку записи, поэтому конкурирующие
+    процессы ждут (до timeout соединения), а не падают посреди транзакции.
+    """
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+
+
+def create_conversation_store(kind: str = CONVERSATION_STORE) -> ConversationStore:
+    if kind == "sqlite":
+        logger.info(f"Диалоги хранятся в SQLite: {CONVERSATION_DB_PATH}")
+        return SQLiteConversationStore()
+    if kind != "memory":
+        raise ValueError(f"Неизвестное хранилище диалогов: {kind}")
+    return MemoryConversationStore()
@@ -0,0 +1,342 @@
+"""
+Центральный планировщик исходящих правок сообщений в Telegram.
+
+- token bucket на чат и глобальный token bucket на весь бот;
+- слияние правок: пока правка ждёт своей очереди, новые версии текста
+  просто заменяют ожидающую, и уходит только последняя;
+- правки без изменений текста не отправляются;
+- RetryAfter (429) выдерживается и правка повторяется;
+- ответ длиннее лимита Telegram разбивается на сообщения-продолжения,
+  лишние продолжения удаляются, если финальный текст стал короче;
+- финальная версия, которую Telegram не принял, повторяется без разметки.
+"""
+
+import asyncio
+import logging
+import os
+import re
+import time
+from typing import Callable, Dict, List, Optional
+
+from aiogram import Bot
+from aiogram.utils.exceptions import MessageNotModified, RetryAfter
+
+from common.metrics import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+TELEGRAM_API_SECONDS = Histogram(
+    "telegram_api_seconds", "Длительность вызовов Bot API", ["method"]
+)
+TELEGRAM_RETRY_AFTER = Counter(
+    "telegram_retry_after_total", "Ответы 429 (RetryAfter) от Bot API", ["method"]
+)
+TELEGRAM_EDITS_SKIPPED = Counter(
+    "telegram_edits_skipped_total", "Правки, не отправленные из-за совпадения текста"
+)
+
+# Telegram допускает ~30 сообщений в секунду на бота и ~1 в секунду на чат
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "25"))
+TELEGRAM_GLOBAL_BURST = float(os.getenv("TELEGRAM_GLOBAL_BURST", "30"))
+TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", "1"))
+TELEGRAM_CHAT_BURST = float(os.getenv("TELEGRAM_CHAT_BURST", "3"))
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+_TAG_RE = re.compile(r"<(/?)([a-zA-Z]+)[^>]*>")
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated_at) * self.rate
+        )
+        self.updated_at = now
+
+    def delay(self) -> float:
+        """
+        Сколько ждать до появления токена (0 — можно прямо сейчас).
+        """
+        now = time.monotonic()
+        self._refill(now)
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def block(self, seconds: float):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+
+def split_html(
+    text: str, limit: int = TELEGRAM_MESSAGE_LIMIT, html: bool = True
+) -> List[str]:
+    """
+    Режет HTML-текст на части не длиннее limit: по возможности по переводу
+    строки, не внутри тега или HTML-сущности. Незакрытые на границе теги
+    закрываются в конце части и открываются заново в начале следующей.
+    С html=False текст режется только по переводам строк и длине.
+    """
+    parts = []
+    reopen = ""
+    while True:
+        text = reopen + text
+        if len(text) <= limit:
+            parts.append(text)
+            return parts
+
+        # Запас под закрывающие теги
+        cut_limit = limit - 64
+        cut = text.rfind("\n", 0, cut_limit)
+        if cut < cut_limit // 2:
+            cut = cut_limit
+        if cut == cut_limit and html:
+            # Не режем посреди тега или сущности
+            lt, gt = text.rfind("<", 0, cut), text.rfind(">", 0, cut)
+            if lt > gt:
+                cut = lt
+            amp, semi = text.rfind("&", 0, cut), text.rfind(";", 0, cut)
+            if amp > semi and cut - amp < 10:
+                cut = amp
+        head, text = text[:cut], text[cut:].lstrip("\n")
+        if not html:
+            parts.append(head)
+            continue
+
+        stack = []
+        for match in _TAG_RE.finditer(head):
+            closing, name = match.group(1), match.group(2).lower()
+            if not closing:
+                stack.append((name, match.group(0)))
+            elif stack and stack[-1][0] == name:
+                stack.pop()
+        parts.append(head + "".join(f"</{name}>" for name, _ in reversed(stack)))
+        reopen = "".join(tag for _, tag in stack)
+
+
+class EditScheduler:
+    def __init__(
+        self,
+        bot: Bot,
+        global_rate: float = TELEGRAM_GLOBAL_RATE,
+        global_burst: float = TELEGRAM_GLOBAL_BURST,
+        chat_rate: float = TELEGRAM_CHAT_RATE,
+        chat_burst: float = TELEGRAM_CHAT_BURST,
+    ):
+        self.bot = bot
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self._global = TokenBucket(global_rate, global_burst)
+        self._chats: Dict[int, TokenBucket] = {}
+        self.retry_after_count = 0
+        self.skipped_count = 0
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 10000:
+                # Давно молчавшие чаты уже накопили полный bucket — их можно забыть
+                now = time.monotonic()
+                self._chats = {
+                    cid: b
+                    for cid, b in self._chats.items()
+                    if now - b.updated_at < self.chat_burst / self.chat_rate
+                }
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    async def _acquire(self, chat_id: int):
+        chat_bucket = self._chat_bucket(chat_id)
+        while True:
+            delay = max(chat_bucket.delay(), self._global.delay())
+            if delay <= 0:
+                chat_bucket.take()
+                self._global.take()
+                return
+            await asyncio.sleep(delay)
+
+    async def call(self, chat_id: int, method: Callable, *args, **kwargs):
+        """
+        Вызов метода Bot API с учётом лимитов и RetryAfter. MessageNotModified
+        считается успехом (возвращается None).
+        """
+        name = getattr(method, "__name__", "unknown")
+        while True:
+            await self._acquire(chat_id)
+            started_at = time.perf_counter()
+            try:
+                return await method(*args, **kwargs)
+            except RetryAfter as e:
+                self.retry_after_count += 1
+                TELEGRAM_RETRY_AFTER.labels(name).inc()
+                logger.warning(f"Telegram RetryAfter {e.timeout} с для чата {chat_id}")
+                self._chat_bucket(chat_id).block(e.timeout)
+            except MessageNotModified:
+                return None
+            finally:
+                TELEGRAM_API_SECONDS.labels(name).observe(
+                    time.perf_counter() - started_at
+                )
+
+    async def edit_text(
+        self,
+        chat_id: int,
+        message_id: int,
+        text: str,
+        parse_mode: Optional[str] = "HTML",
+        **kwargs,
+    ):
+        return await self.call(
+            chat_id,
+            self.bot.edit_message_text,
+            text,
+            chat_id,
+            message_id,
+            parse_mode=parse_mode,
+            **kwargs,
+        )
+
+    async def send_text(
+        self, chat_id: int, text: str, parse_mode: Optional[str] = "HTML", **kwargs
+    ):
+        return await self.call(
+            chat_id,
+            self.bot.send_message,
+            chat_id,
+            text,
+            parse_mode=parse_mode,
+            **kwargs,
+        )
+
+    async def delete(self, chat_id: int, message_id: int):
+        return await self.call(chat_id, self.bot.delete_message, chat_id, message_id)
+
+    def stream(
+        self,
+        chat_id: int,
+        message_id: int,
+        render: Callable[[str], str] = lambda text: text,
+    ) -> "StreamedMessage":
+        return StreamedMessage(self, chat_id, message_id, render)
+
+
+class StreamedMessage:
+    """
+    Сообщение, которое дописывается по мере стрима ответа.
+
+    update() не ждёт сети: он лишь запоминает последний сырой текст. Фоновая
+    задача рендерит и отправляет его, когда позволяют лимиты, поэтому рендер
+    выполняется только для реально уходящих версий.
+    """
+
+    def __init__(
+        self,
+        scheduler: EditScheduler,
+        chat_id: int,
+        message_id: int,
+        render: Callable[[str], str],
+    ):
+        self.scheduler = scheduler
+        self.chat_id = chat_id
+        self.render = render
+        self.message_ids = [message_id]
+        self._sent: List[str] = []
+        self._pending: Optional[str] = None
+        self._pending_render = True
+        self._dirty = asyncio.Event()
+        self._closed = False
+        self._task: Optional[asyncio.Task] = None
+
+    def update(self, text: str):
+        self._pending = text
+        self._pending_render = True
+        self._dirty.set()
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def finish(self, text: str, render: bool = True):
+        """
+        Отправляет финальную версию и дожидается доставки всех правок.
+        Если финальную версию не удалось доставить даже без разметки,
+        поднимает ошибку Bot API.
+        """
+        self._pending = text
+        self._pending_render = render
+        self._closed = True
+        self._dirty.set()
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+        await self._task
+
+    def cancel(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _run(self):
+        while True:
+            await self._dirty.wait()
+            self._dirty.clear()
+            text = self._pending
+            if self._pending_render:
+                text = self.render(text)
+            try:
+                await self._deliver(text)
+            except Exception as e:
+                if not self._closed or self._dirty.is_set():
+                    # Неудачная промежуточная правка не должна обрывать стрим
+                    logger.warning(
+                        f"Не удалось обновить сообщение в чате {self.chat_id}: {e}"
+                    )
+                    continue
+                # Финальная версия должна дойти: чаще всего Telegram не принял
+                # её разметку, поэтому повторяем исходный текст без неё. Ошибку
+                # повтора получит вызвавший finish()
+                logger.warning(
+                    f"Не удалось отправить ответ в чат {self.chat_id}: {e}, "
+                    f"повтор без разметки"
+                )
+                await self._deliver(self._pending, html=False)
+                return
+            if self._closed and not self._dirty.is_set():
+                return
+
+    async def _deliver(self, text: str, html: bool = True):
+        parse_mode = "HTML" if html else None
+        parts = split_html(text, html=html)
+        for i, part in enumerate(parts):
+            if i < len(self._sent) and self._sent[i] == part:
+                self.scheduler.skipped_count += 1
+                TELEGRAM_EDITS_SKIPPED.inc()
+                continue
+            if i < len(self.message_ids):
+                await self.scheduler.edit_text(
+                    self.chat_id, self.message_ids[i], part, parse_mode=parse_mode
+                )
+            else:
+                message = await self.scheduler.send_text(
+                    self.chat_id, part, parse_mode=parse_mode
+                )
+                self.message_ids.append(message.message_id)
+            if i < len(self._sent):
+                self._sent[i] = part
+            else:
+                self._sent.append(part)
+            # Пока ждали лимитов, могла прийти более свежая версия — отправим её
+            if self._dirty.is_set() and not self._closed:
+                return
+        # Текст стал короче: продолжения, которым не осталось частей, удаляем
+        while len(self.message_ids) > len(parts):
+            await self.scheduler.delete(self.chat_id, self.message_ids[-1])
+            self.message_ids.pop()
+            del self._sent[len(self.message_ids) :]
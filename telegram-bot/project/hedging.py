@@ -0,0 +1,367 @@
+"""
+Хеджирование стрима ответа между /api/agent и /api/agent_gigachat.
+
+Пользователю в поле важнее быстро получить ответ, чем ответ именно от
+выбранной модели. С HEDGING=1 запрос сначала уходит в эндпоинт выбранной
+модели; если за дедлайн от него не пришло ни одного события ответа (data или
+metadata), параллельно запускается второй эндпоинт. Если выбранный эндпоинт
+ответил ошибкой, второй запускается сразу. Остаётся стрим, первым начавший
+ответ, второй закрывается — бекенд видит разрыв и перестаёт генерировать.
+Стрим, закончившийся без ответа, тоже запускает второй эндпоинт, но
+проигрывает любому ответу; если ответа нет нигде, отдаётся он — и бот, как
+без хеджирования, пишет «Пустой ответ от ассистента.».
+
+Дедлайн — квантиль HEDGE_QUANTILE времени до первого события по последним
+HEDGE_WINDOW ответам этого эндпоинта, в пределах [HEDGE_MIN_DELAY,
+HEDGE_MAX_DELAY]; пока замеров меньше HEDGE_MIN_SAMPLES, берётся
+HEDGE_DEFAULT_DELAY. Если стрим проиграл запасному, в статистику идёт время,
+которое он успел прождать: без этого медленные ответы из неё выпадали бы, и
+дедлайн сползал бы вниз.
+
+Запасной стрим занимает собственный слот StreamLimiter и только если тот
+свободен сразу: иначе при медленном бекенде хеджировался бы почти каждый
+запрос, и стримов к бекенду стало бы вдвое больше MAX_UPSTREAM_STREAMS как
+раз тогда, когда ему и так тяжело. Кроме того, подстраховать можно не больше
+доли HEDGE_BUDGET запросов за последние HEDGE_BUDGET_WINDOW секунд.
+
+Без HEDGING стрим один, как раньше.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from contextlib import AsyncExitStack, asynccontextmanager
+from typing import AsyncIterator, Callable, Deque, Dict, List, NamedTuple, Optional
+
+import aiohttp
+
+from common.backend_client import AsyncBackendClient
+from common.metrics import Counter, Gauge, StreamStats
+from common.sse import EVENT_DATA, EVENT_METADATA, SSEEvent, aiter_sse
+from inflight import StreamLimiter
+
+logger = logging.getLogger(__name__)
+
+HEDGING = os.getenv("HEDGING", "0") == "1"
+HEDGE_QUANTILE = float(os.getenv("HEDGE_QUANTILE", "0.95"))
+HEDGE_WINDOW = int(os.getenv("HEDGE_WINDOW", "200"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_DEFAULT_DELAY = float(os.getenv("HEDGE_DEFAULT_DELAY", "8"))
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "2"))
+HEDGE_MAX_DELAY = float(os.getenv("HEDGE_MAX_DELAY", "20"))
+HEDGE_BUDGET = float(os.getenv("HEDGE_BUDGET", "0.1"))
+HEDGE_BUDGET_WINDOW = float(os.getenv("HEDGE_BUDGET_WINDOW", "60"))
+
+# Запасной эндпоинт для каждого основного
+ALTERNATE_ENDPOINTS = {
+    "/api/agent": "/api/agent_gigachat",
+    "/api/agent_gigachat": "/api/agent",
+}
+
+# События, с которых начинается ответ модели
+ANSWER_EVENTS = frozenset((EVENT_DATA, EVENT_METADATA))
+
+HEDGED_STREAMS = Counter(
+    "llm_hedged_streams_total",
+    "Запуски запасного эндпоинта по основному endpoint, причине (slow, error) "
+    "и победителю (primary, alternate, none)",
+    ["endpoint", "reason", "winner"],
+)
+HEDGES_SKIPPED = Counter(
+    "llm_hedges_skipped_total",
+    "Запасной эндпоинт не запущен: нет свободного стрима (no_slot) "
+    "или исчерпан бюджет (budget)",
+    ["endpoint", "reason"],
+)
+HEDGE_DEADLINE = Gauge(
+    "llm_hedge_deadline_seconds",
+    "Текущий дедлайн до запуска запасного эндпоинта",
+    ["endpoint"],
+)
+
+
+class UpstreamError(Exception):
+    """
+    Ни один эндпоинт не начал ответ.
+    """
+
+
+class LatencyTracker:
+    """
+    Скользящее окно времени до первого события ответа по эндпоинтам.
+    """
+
+    def __init__(
+        self,
+        window: int = HEDGE_WINDOW,
+        quantile: float = HEDGE_QUANTILE,
+        min_samples: int = HEDGE_MIN_SAMPLES,
+        default: float = HEDGE_DEFAULT_DELAY,
+        min_delay: float = HEDGE_MIN_DELAY,
+        max_delay: float = HEDGE_MAX_DELAY,
+    ):
+        self.window = window
+        self.quantile = quantile
+        self.min_samples = min_samples
+        self.default = default
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self._samples: Dict[str, Deque[float]] = {}
+
+    def observe(self, endpoint: str, seconds: float):
+        samples = self._samples.get(endpoint)
+        if samples is None:
+            samples = self._samples[endpoint] = deque(maxlen=self.window)
+        samples.append(seconds)
+
+    def deadline(self, endpoint: str) -> float:
+        samples = self._samples.get(endpoint)
+        if not samples or len(samples) < self.min_samples:
+            delay = self.default
+        else:
+            ordered = sorted(samples)
+            delay = ordered[min(len(ordered) - 1, int(len(ordered) * self.quantile))]
+        return min(self.max_delay, max(self.min_delay, delay))
+
+    def stats(self) -> Dict[str, dict]:
+        return {
+            endpoint: {"samples": len(samples), "deadline": self.deadline(endpoint)}
+            for endpoint, samples in self._samples.items()
+        }
+
+
+class HedgeBudget:
+    """
+    Доля share запросов за последние window секунд, которые можно
+    подстраховать запасным эндпоинтом.
+    """
+
+    def __init__(
+        self, share: float = HEDGE_BUDGET, window: float = HEDGE_BUDGET_WINDOW
+    ):
+        self.share = share
+        self.window = window
+        self._requests: Deque[float] = deque()
+        self._hedges: Deque[float] = deque()
+
+    def _prune(self, now: float):
+        for stamps in (self._requests, self._hedges):
+            while stamps and now - stamps[0] > self.window:
+                stamps.popleft()
+
+    def request(self):
+        now = time.monotonic()
+        self._requests.append(now)
+        self._prune(now)
+
+    def allows(self) -> bool:
+        self._prune(time.monotonic())
+        return len(self._hedges) + 1 <= self.share * len(self._requests)
+
+    def spend(self):
+        self._hedges.append(time.monotonic())
+
+    def stats(self) -> Dict[str, int]:
+        self._prune(time.monotonic())
+        return {"requests": len(self._requests), "hedges": len(self._hedges)}
+
+
+class _Attempt:
+    """
+    Стрим к одному эндпоинту: открывается в отдельной задаче, которая
+    завершается с первым событием ответа или с концом стрима (answered
+    тогда False). release — освобождение собственного слота StreamLimiter,
+    вызывается при закрытии.
+    """
+
+    def __init__(
+        self,
+        backend: AsyncBackendClient,
+        endpoint: str,
+        payload: Dict[str, object],
+        release: Optional[Callable[[], None]] = None,
+    ):
+        self.endpoint = endpoint
+        self._release = release
+        self.started_at = time.perf_counter()
+        self.stats: Optional[StreamStats] = None
+        self.response: Optional[aiohttp.ClientResponse] = None
+        self.buffered: List[SSEEvent] = []
+        self.answered = False
+        self._events: Optional[AsyncIterator[SSEEvent]] = None
+        self._stack = AsyncExitStack()
+        self.task = asyncio.ensure_future(self._open(backend, payload))
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started_at
+
+    async def _open(self, backend: AsyncBackendClient, payload: Dict[str, object]):
+        self.stats = await self._stack.enter_async_context(StreamStats(self.endpoint))
+        self.response = await self._stack.enter_async_context(
+            backend.stream(self.endpoint, payload)
+        )
+        if self.response.status != 200:
+            raise UpstreamError(f"{self.endpoint}: статус {self.response.status}")
+        self._events = aiter_sse(self.response.content.iter_any())
+        # Служебные события до начала ответа копятся и отдаются потом
+        async for event in self._events:
+            self.buffered.append(event)
+            if event.kind in ANSWER_EVENTS:
+                self.answered = True
+                return
+
+    async def events(self) -> AsyncIterator[SSEEvent]:
+        for event in self.buffered:
+            yield event
+        async for event in self._events:
+            yield event
+
+    async def close(self, abort: bool = False):
+        self.task.cancel()
+        if abort and self.response is not None:
+            # Разрыв соединения: бекенд перестаёт генерировать ответ
+            self.response.close()
+        await asyncio.gather(self.task, return_exceptions=True)
+        try:
+            await self._stack.aclose()
+        finally:
+            release, self._release = self._release, None
+            if release is not None:
+                release()
+
+
+class HedgedStream(NamedTuple):
+    endpoint: str
+    stats: StreamStats
+    events: AsyncIterator[SSEEvent]
+
+
+class StreamHedger:
+    def __init__(
+        self,
+        enabled: bool = HEDGING,
+        tracker: Optional[LatencyTracker] = None,
+        limiter: Optional[StreamLimiter] = None,
+        budget: Optional[HedgeBudget] = None,
+    ):
+        self.enabled = enabled
+        self.tracker = tracker or LatencyTracker()
+        self.limiter = limiter
+        self.budget = budget or HedgeBudget()
+        for endpoint in ALTERNATE_ENDPOINTS:
+            HEDGE_DEADLINE.labels(endpoint).set_function(
+                lambda endpoint=endpoint: self.tracker.deadline(endpoint)
+            )
+
+    def _reserve(self) -> Optional[str]:
+        """
+        Бюджет и слот под запасной стрим; None — можно запускать,
+        иначе причина отказа.
+        """
+        if not self.budget.allows():
+            return "budget"
+        if self.limiter is not None and not self.limiter.try_acquire():
+            return "no_slot"
+        self.budget.spend()
+        return None
+
+    @asynccontextmanager
+    async def stream(
+        self, backend: AsyncBackendClient, endpoint: str, payload: Dict[str, object]
+    ) -> AsyncIterator[HedgedStream]:
+        """
+        Стрим эндпоинта, первым начавшего ответ; endpoint в результате —
+        тот, что отвечает на самом деле. Если ответа нет нигде, отдаётся
+        пустой стрим; UpstreamError — все эндпоинты ответили ошибкой.
+        """
+        alternate = ALTERNATE_ENDPOINTS.get(endpoint) if self.enabled else None
+        if alternate:
+            self.budget.request()
+        primary = _Attempt(backend, endpoint, payload)
+        attempts = [primary]
+        winner: Optional[_Attempt] = None
+        # Стрим, закончившийся без ответа: отдаётся, если ответа нет нигде
+        empty: Optional[_Attempt] = None
+        reason: Optional[str] = None
+        errors: List[str] = []
+        try:
+            timeout = self.tracker.deadline(endpoint) if alternate else None
+            while winner is None:
+                pending = [a for a in attempts if not a.task.done()]
+                if not pending:
+                    if empty is None:
+                        raise UpstreamError("; ".join(errors))
+                    winner = empty
+                    break
+                await asyncio.wait(
+                    [a.task for a in pending],
+                    timeout=timeout,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                timeout = None
+                for attempt in pending:
+                    if not attempt.task.done():
+                        continue
+                    error = attempt.task.exception()
+                    if error is not None:
+                        errors.append(str(error) or type(error).__name__)
+                        logger.warning(f"{attempt.endpoint} не начал ответ: {error}")
+                    elif attempt.answered:
+                        winner = attempt
+                        break
+                    elif empty is None:
+                        logger.warning(
+                            f"{attempt.endpoint}: стрим закончился без ответа"
+                        )
+                        empty = attempt
+                if winner is None and alternate and len(attempts) == 1:
+                    # Дедлайн истёк или основной эндпоинт упал либо ответил
+                    # пустым стримом — запускаем запасной, если есть слот и бюджет
+                    skipped = self._reserve()
+                    if skipped is not None:
+                        HEDGES_SKIPPED.labels(endpoint, skipped).inc()
+                        logger.info(f"Запасной {alternate} для {endpoint}: {skipped}")
+                        alternate = None
+                        continue
+                    reason = "error" if primary.task.done() else "slow"
+                    logger.info(
+                        f"Запасной {alternate} для {endpoint} ({reason}), "
+                        f"прошло {primary.elapsed:.1f} с"
+                    )
+                    release = self.limiter.release if self.limiter else None
+                    attempts.append(_Attempt(backend, alternate, payload, release))
+        except BaseException:
+            if reason is not None:
+                HEDGED_STREAMS.labels(endpoint, reason, "none").inc()
+            for attempt in attempts:
+                await attempt.close(abort=True)
+            raise
+
+        if winner.answered:
+            self.tracker.observe(winner.endpoint, winner.elapsed)
+        for attempt in attempts:
+            if attempt is winner:
+                continue
+            if attempt is primary and not primary.task.done():
+                # Проигравший основной ждал не меньше этого
+                self.tracker.observe(primary.endpoint, primary.elapsed)
+            await attempt.close(abort=True)
+        if reason is not None:
+            if not winner.answered:
+                outcome = "none"
+            elif winner is primary:
+                outcome = "primary"
+            else:
+                outcome = "alternate"
+            HEDGED_STREAMS.labels(endpoint, reason, outcome).inc()
+
+        try:
+            yield HedgedStream(winner.endpoint, winner.stats, winner.events())
+        except BaseException:
+            await winner.close(abort=True)
+            raise
+        else:
+            await winner.close()
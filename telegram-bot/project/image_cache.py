@@ -0,0 +1,375 @@
+"""
+Двухуровневый кеш страниц документации для бота.
+
+1. S3ImageCache — ограниченный по размеру LRU-кеш объектов S3 на диске,
+   ключ — S3-ключ и ETag. Свежая запись отдаётся без обращения к S3, устаревшая
+   перепроверяется условным GET (If-None-Match), который при 304 не тянет тело.
+2. FileIdCache — соответствие S3-ключа и file_id, который Telegram вернул
+   после первой загрузки. Повторная картинка отправляется по file_id
+   без S3 и без повторного аплоада.
+"""
+
+import asyncio
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, NamedTuple, Optional
+
+from botocore.exceptions import ClientError
+
+from common.metrics import SIZE_BUCKETS, Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+S3_DOWNLOAD_SECONDS = Histogram(
+    "s3_download_seconds", "Скачивание объекта из S3 (включая 304)", ["result"]
+)
+S3_DOWNLOAD_BYTES = Histogram(
+    "s3_download_bytes", "Размер скачанных из S3 объектов", buckets=SIZE_BUCKETS
+)
+IMAGE_CACHE_REQUESTS = Counter(
+    "image_cache_requests_total", "Запросы к дисковому кешу картинок", ["result"]
+)
+
+# Через сколько секунд недописанный .tmp считается брошенным: каталог общий
+# для всех воркеров webhook-режима, и свежий .tmp может писать соседний процесс
+STALE_TMP_SECONDS = 600
+
+
+def _etag_suffix(etag: str) -> str:
+    return re.sub(r"[^A-Za-z0-9-]", "", etag) or "noetag"
+
+
+class _DiskEntry(NamedTuple):
+    etag: str
+    path: str
+    size: int
+    checked_at: float
+
+
+class S3ImageCache:
+    """
+    Дисковый LRU-кеш объектов S3. Методы блокирующие и вызываются из пула
+    потоков, поэтому индекс защищён блокировкой.
+    """
+
+    def __init__(
+        self,
+        s3_client,
+        bucket: str,
+        directory: str,
+        max_bytes: int,
+        ttl: float,
+    ):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self._lock = threading.Lock()
+        self._index: "OrderedDict[str, _DiskEntry]" = OrderedDict()
+        self._size = 0
+        # Один поток-писатель: запись на диск не задерживает отправку картинок
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="img-cache")
+        os.makedirs(directory, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        """
+        Восстанавливаем индекс после рестарта: имя файла — <sha1 ключа>.<etag>,
+        порядок LRU — по mtime (он обновляется при каждом попадании).
+        """
+        entries = []
+        now = time.time()
+        for name in os.listdir(self.directory):
+            digest, _, etag = name.partition(".")
+            path = os.path.join(self.directory, name)
+            if name.endswith(".tmp"):
+                self._remove_tmp(name, path, now)
+                continue
+            if len(digest) != 40 or not etag:
+                continue
+            st = os.stat(path)
+            entries.append(
+                (st.st_mtime, digest, _DiskEntry(etag, path, st.st_size, st.st_mtime))
+            )
+        for _, digest, entry in sorted(entries):
+            self._index[digest] = entry
+            self._size += entry.size
+        logger.info(
+            f"Кеш картинок: {len(self._index)} файлов, {self._size / 1024 / 1024:.1f} МБ"
+        )
+
+    @staticmethod
+    def _remove_tmp(name: str, path: str, now: float):
+        """
+        Удаляет недописанный файл, если его оставил процесс с нашим pid
+        (то есть прошлый запуск) или он брошен давно.
+        """
+        pid = name[: -len(".tmp")].rpartition(".")[2]
+        try:
+            if (
+                pid != str(os.getpid())
+                and now - os.stat(path).st_mtime < STALE_TMP_SECONDS
+            ):
+                return
+            os.remove(path)
+        except OSError:
+            # Файл уже дописал или удалил соседний воркер
+            pass
+
+    @staticmethod
+    def _digest(key: str) -> str:
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+    def _touch(self, digest: str, entry: _DiskEntry, checked_at: float) -> bytes:
+        """
+        Читает файл записи и поднимает её в LRU. Если запись успели вытеснить
+        или заменить другой версией файла, — FileNotFoundError, как для
+        удалённого файла: вызывающий считает это промахом.
+        """
+        with self._lock:
+            current = self._index.get(digest)
+            if current is None or current.path != entry.path:
+                raise FileNotFoundError(entry.path)
+            entry = self._index[digest] = current._replace(
+                checked_at=max(current.checked_at, checked_at)
+            )
+            self._index.move_to_end(digest)
+        with open(entry.path, "rb") as f:
+            data = f.read()
+        os.utime(entry.path)
+        return data
+
+    def fetch_bytes(self, key: str) -> Optional[bytes]:
+        """
+        Содержимое объекта или None при ошибке S3. При промахе тело читается
+        из S3 прямо в память, а запись на диск уходит в фоновый поток.
+        """
+        digest = self._digest(key)
+        now = time.time()
+        with self._lock:
+            entry = self._index.get(digest)
+
+        try:
+            if entry is not None and now - entry.checked_at < self.ttl:
+                data = self._touch(digest, entry, entry.checked_at)
+                with self._lock:
+                    self.hits += 1
+                IMAGE_CACHE_REQUESTS.labels("hit").inc()
+                return data
+        except OSError:
+            # Файл удалили мимо кеша или запись вытеснена — скачиваем заново
+            entry = None
+        return self._download(key, digest, entry, now)
+
+    def _download(
+        self, key: str, digest: str, entry: Optional[_DiskEntry], now: float
+    ) -> Optional[bytes]:
+        """
+        Скачивание из S3; с entry — условное, по ETag файла на диске.
+        """
+        kwargs = {"Bucket": self.bucket, "Key": key}
+        if entry is not None:
+            kwargs["IfNoneMatch"] = f'"{entry.etag}"'
+        started_at = time.perf_counter()
+        try:
+            obj = self.s3_client.get_object(**kwargs)
+            body = obj["Body"].read()
+        except ClientError as e:
+            status = e.response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+            S3_DOWNLOAD_SECONDS.labels(str(status or "error")).observe(
+                time.perf_counter() - started_at
+            )
+            if entry is not None and status == 304:
+                try:
+                    data = self._touch(digest, entry, now)
+                except OSError:
+                    # Запись вытеснили, пока шла проверка, — скачиваем целиком
+                    return self._download(key, digest, None, now)
+                else:
+                    with self._lock:
+                        self.hits += 1
+                        self.revalidated += 1
+                    IMAGE_CACHE_REQUESTS.labels("revalidated").inc()
+                    return data
+            logger.error(f"Ошибка скачивания {key}: {e}")
+            return None
+        except Exception as e:
+            S3_DOWNLOAD_SECONDS.labels("error").observe(
+                time.perf_counter() - started_at
+            )
+            logger.error(f"Ошибка скачивания {key}: {e}")
+            return None
+
+        S3_DOWNLOAD_SECONDS.labels("200").observe(time.perf_counter() - started_at)
+        S3_DOWNLOAD_BYTES.observe(len(body))
+        with self._lock:
+            self.misses += 1
+        IMAGE_CACHE_REQUESTS.labels("miss").inc()
+        etag = _etag_suffix(obj.get("ETag", ""))
+        self._writer.submit(self._store, digest, etag, body, now)
+        return body
+
+    def _store(self, digest: str, etag: str, body: bytes, checked_at: float):
+        path = os.path.join(self.directory, f"{digest}.{etag}")
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(body)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Не удалось сохранить {path} в кеш: {e}")
+            return
+
+        entry = _DiskEntry(etag, path, len(body), checked_at)
+        evicted = []
+        with self._lock:
+            previous = self._index.pop(digest, None)
+            if previous is not None:
+                self._size -= previous.size
+                if previous.path != path:
+                    evicted.append(previous.path)
+            self._index[digest] = entry
+            self._size += entry.size
+            while self._size > self.max_bytes and len(self._index) > 1:
+                _, victim = self._index.popitem(last=False)
+                self._size -= victim.size
+                evicted.append(victim.path)
+        for victim_path in evicted:
+            try:
+                os.remove(victim_path)
+            except OSError as e:
+                logger.warning(f"Не удалось удалить файл {victim_path}: {e}")
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "disk_hits": self.hits,
+                "disk_misses": self.misses,
+                "disk_revalidated": self.revalidated,
+                "disk_files": len(self._index),
+                "disk_bytes": self._size,
+            }
+
+
+class FileIdCache:
+    """
+    S3-ключ -> Telegram file_id с TTL, сохраняется в JSON-файл между рестартами.
+    Используется только из event loop, поэтому без блокировок.
+
+    Файл общий для всех воркеров webhook-режима. Запись откладывается на
+    save_delay секунд, чтобы медиагруппа из десяти фото давала одну запись,
+    и идёт в отдельном потоке: под файловой блокировкой содержимое файла
+    сливается с памятью (по более свежей метке), истёкшие file_id
+    выбрасываются.
+    """
+
+    def __init__(self, path: str, ttl: float, save_delay: float):
+        self.path = path
+        self.ttl = ttl
+        self.save_delay = save_delay
+        self.hits = 0
+        self.misses = 0
+        self._ids: Dict[str, list] = self._read()
+        self._save_handle: Optional[asyncio.TimerHandle] = None
+        self._saving: Optional[asyncio.Future] = None
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="file-ids")
+
+    def get(self, key: str) -> Optional[str]:
+        item = self._ids.get(key)
+        if item is not None and time.time() - item[1] < self.ttl:
+            self.hits += 1
+            return item[0]
+        self.misses += 1
+        return None
+
+    def set(self, key: str, file_id: str):
+        self._ids[key] = [file_id, time.time()]
+        if self._save_handle is None:
+            self._save_handle = asyncio.get_event_loop().call_later(
+                self.save_delay, self._start_save
+            )
+
+    def _start_save(self) -> asyncio.Future:
+        self._save_handle = None
+        loop = asyncio.get_event_loop()
+        self._saving = loop.run_in_executor(self._writer, self._save, dict(self._ids))
+        self._saving.add_done_callback(self._on_saved)
+        return self._saving
+
+    def _on_saved(self, future: asyncio.Future):
+        if future.cancelled() or future.exception() is not None:
+            return
+        # file_id от соседних воркеров тоже пригодятся
+        now = time.time()
+        for key, item in future.result().items():
+            current = self._ids.get(key)
+            if current is None or current[1] < item[1]:
+                self._ids[key] = item
+        for key in [k for k, item in self._ids.items() if now - item[1] >= self.ttl]:
+            del self._ids[key]
+
+    def _read(self) -> Dict[str, list]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.warning(f"Не удалось прочитать кеш file_id {self.path}: {e}")
+        return {}
+
+    def _save(self, ids: Dict[str, list]) -> Dict[str, list]:
+        """
+        Выполняется в потоке записи; возвращает то, что записано в файл.
+        """
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(f"{self.path}.lock", "a") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                merged = self._read()
+                for key, item in ids.items():
+                    if key not in merged or merged[key][1] < item[1]:
+                        merged[key] = item
+                now = time.time()
+                merged = {
+                    key: item
+                    for key, item in merged.items()
+                    if now - item[1] < self.ttl
+                }
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(merged, f)
+                os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Не удалось сохранить кеш file_id {self.path}: {e}")
+            return ids
+        return merged
+
+    async def close(self):
+        """
+        Дописывает отложенные изменения при остановке бота.
+        """
+        if self._save_handle is not None:
+            self._save_handle.cancel()
+            await self._start_save()
+        elif self._saving is not None:
+            await asyncio.gather(self._saving, return_exceptions=True)
+        self._writer.shutdown()
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "file_id_hits": self.hits,
+            "file_id_misses": self.misses,
+            "file_ids": len(self._ids),
+        }
@@ -0,0 +1,48 @@
+"""
+Параллельная загрузка страниц документации из S3 в память.
+
+boto3 блокирующий, поэтому каждый ключ уходит в собственный пул потоков
+ограниченного размера — он же задаёт предел параллельных запросов к S3.
+Ответ с 8 страницами стоит примерно одного round-trip вместо восьми.
+"""
+
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, List, Optional, Tuple
+
+from image_cache import S3ImageCache
+
+logger = logging.getLogger(__name__)
+
+
+class ImageFetcher:
+    def __init__(self, cache: S3ImageCache, concurrency: int):
+        self.cache = cache
+        self._executor = ThreadPoolExecutor(
+            max_workers=concurrency, thread_name_prefix="s3-fetch"
+        )
+
+    async def fetch(self, key: str) -> Optional[bytes]:
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self._executor, self.cache.fetch_bytes, key)
+
+    async def fetch_all(self, keys: Iterable[str]) -> List[Tuple[str, bytes]]:
+        """
+        Скачивает все ключи параллельно. Порядок сохраняется, неудачные
+        загрузки пропускаются — остальные картинки всё равно отправляются.
+        """
+        keys = list(keys)
+        results = await asyncio.gather(
+            *(self.fetch(key) for key in keys), return_exceptions=True
+        )
+        images = []
+        for key, result in zip(keys, results):
+            if isinstance(result, BaseException):
+                logger.error(f"Ошибка скачивания {key}: {result}")
+            elif result is not None:
+                images.append((key, result))
+        return images
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,167 @@
+"""
+Уменьшение и пережатие страниц документации перед отправкой в Telegram.
+
+Страницы лежат в S3 полноразмерными PNG без потерь. Пользователю в поле по
+мобильной сети быстрее получить JPEG или WebP с ограниченной длинной
+стороной, а Telegram всё равно пережимает фото. Перекодирование — работа для
+CPU, поэтому оно идёт в пуле процессов и не блокирует event loop; готовые
+варианты держатся в ограниченном LRU в памяти, ключ — хеш исходника и
+параметры; хеш многомегабайтной страницы тоже считается вне event loop. Если пережатый вариант не меньше исходника или картинку не удалось
+разобрать, отправляется исходник.
+"""
+
+import asyncio
+import hashlib
+import io
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple
+
+from PIL import Image
+
+from common.metrics import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+# JPEG или WEBP; ORIGINAL — отправлять как есть
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "JPEG").upper()
+IMAGE_MAX_EDGE = int(os.getenv("IMAGE_MAX_EDGE", "1600"))
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "82"))
+IMAGE_RESIZE_WORKERS = int(os.getenv("IMAGE_RESIZE_WORKERS", "2"))
+IMAGE_VARIANT_CACHE_MB = int(os.getenv("IMAGE_VARIANT_CACHE_MB", "64"))
+
+EXTENSIONS = {"JPEG": ".jpg", "WEBP": ".webp"}
+
+IMAGE_RESIZE_SECONDS = Histogram(
+    "image_resize_seconds", "Уменьшение и пережатие одной страницы"
+)
+IMAGE_BYTES = Counter(
+    "image_bytes_total",
+    "Объём страниц до (source) и после (sent) пережатия",
+    ["stage"],
+)
+
+
+def downscale(data: bytes, fmt: str, max_edge: int, quality: int) -> bytes:
+    """
+    Выполняется в процессе пула: только Pillow, без логов и общего состояния.
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        if image.mode not in ("RGB", "L"):
+            # У JPEG нет альфа-канала: кладём страницу на белый фон
+            background = Image.new("RGB", image.size, "white")
+            rgba = image.convert("RGBA")
+            background.paste(rgba, mask=rgba.getchannel("A"))
+            image = background
+        out = io.BytesIO()
+        image.save(out, fmt, quality=quality, optimize=True)
+        return out.getvalue()
+
+
+class ImageResizer:
+    def __init__(
+        self,
+        fmt: str = IMAGE_FORMAT,
+        max_edge: int = IMAGE_MAX_EDGE,
+        quality: int = IMAGE_QUALITY,
+        workers: int = IMAGE_RESIZE_WORKERS,
+        max_bytes: int = IMAGE_VARIANT_CACHE_MB * 1024 * 1024,
+    ):
+        self.enabled = fmt in EXTENSIONS
+        self.fmt = fmt
+        self.max_edge = max_edge
+        self.quality = quality
+        self.max_bytes = max_bytes
+        self.source_bytes = 0
+        self.sent_bytes = 0
+        self._variants: "OrderedDict[str, bytes]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._executor = ProcessPoolExecutor(max_workers=workers)
+
+    def _variant_key(self, data: bytes) -> str:
+        digest = hashlib.sha1(data).hexdigest()
+        return f"{digest}:{self.fmt}:{self.max_edge}:{self.quality}"
+
+    def _remember(self, variant_key: str, variant: bytes):
+        with self._lock:
+            if variant_key in self._variants:
+                return
+            self._variants[variant_key] = variant
+            self._size += len(variant)
+            while self._size > self.max_bytes and self._variants:
+                _, victim = self._variants.popitem(last=False)
+                self._size -= len(victim)
+
+    async def prepare(self, key: str, data: bytes) -> Tuple[str, bytes]:
+        """
+        Имя файла и содержимое для отправки вместо исходной страницы.
+        """
+        variant = data
+        if self.enabled:
+            # hashlib отпускает GIL на больших буферах — хватает потока
+            loop = asyncio.get_event_loop()
+            variant_key = await loop.run_in_executor(None, self._variant_key, data)
+            with self._lock:
+                cached = self._variants.get(variant_key)
+                if cached is not None:
+                    self._variants.move_to_end(variant_key)
+            if cached is None:
+                cached = await self._downscale(key, data)
+                self._remember(variant_key, cached)
+            # Пустой вариант — пережатие не уменьшило страницу
+            if cached:
+                variant = cached
+
+        self.source_bytes += len(data)
+        self.sent_bytes += len(variant)
+        IMAGE_BYTES.labels("source").inc(len(data))
+        IMAGE_BYTES.labels("sent").inc(len(variant))
+        filename = os.path.basename(key)
+        if variant is not data:
+            filename = os.path.splitext(filename)[0] + EXTENSIONS[self.fmt]
+        return filename, variant
+
+    async def _downscale(self, key: str, data: bytes) -> bytes:
+        loop = asyncio.get_event_loop()
+        started_at = time.perf_counter()
+        try:
+            variant = await loop.run_in_executor(
+                self._executor, downscale, data, self.fmt, self.max_edge, self.quality
+            )
+        except Exception as e:
+            logger.warning(f"Не удалось пережать {key}: {e}")
+            return b""
+        IMAGE_RESIZE_SECONDS.observe(time.perf_counter() - started_at)
+        return variant if len(variant) < len(data) else b""
+
+    async def prepare_all(
+        self, images: List[Tuple[str, bytes]]
+    ) -> List[Tuple[str, str, bytes]]:
+        """
+        Пережимает страницы параллельно, порядок сохраняется:
+        (ключ, имя файла, содержимое).
+        """
+        prepared = await asyncio.gather(
+            *(self.prepare(key, data) for key, data in images)
+        )
+        return [
+            (key, filename, data)
+            for (key, _), (filename, data) in zip(images, prepared)
+        ]
+
+    def stats(self) -> dict:
+        return {
+            "resize_source_bytes": self.source_bytes,
+            "resize_sent_bytes": self.sent_bytes,
+            "resize_saved_bytes": self.source_bytes - self.sent_bytes,
+            "resize_variants": len(self._variants),
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,183 @@
+"""
+Контроль одновременных запросов к LLM-бекенду.
+
+- ChatTurns — не больше одного ответа на чат одновременно. Новое сообщение
+  либо встаёт в очередь за текущим ответом (CHAT_INFLIGHT_POLICY=queue),
+  либо прерывает его (cancel).
+- StreamLimiter — глобальный предел одновременных стримов к бекенду
+  с ограниченной очередью ожидания. Ожидающим сообщается их место в очереди,
+  при переполнении запрос сразу отклоняется (QueueFull).
+"""
+
+import asyncio
+import logging
+import os
+import weakref
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Deque, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+CHAT_INFLIGHT_POLICY = os.getenv("CHAT_INFLIGHT_POLICY", "queue")
+MAX_UPSTREAM_STREAMS = int(os.getenv("MAX_UPSTREAM_STREAMS", "16"))
+MAX_UPSTREAM_QUEUE = int(os.getenv("MAX_UPSTREAM_QUEUE", "100"))
+
+POLICY_QUEUE = "queue"
+POLICY_CANCEL = "cancel"
+
+
+class QueueFull(Exception):
+    pass
+
+
+class Superseded(Exception):
+    """
+    Сообщение вытеснено более новым сообщением того же чата ещё до начала ответа.
+    """
+
+
+class _Waiter:
+    __slots__ = ("future", "on_position")
+
+    def __init__(
+        self, future: asyncio.Future, on_position: Optional[Callable[[int], None]]
+    ):
+        self.future = future
+        self.on_position = on_position
+
+
+class StreamLimiter:
+    """
+    Семафор с FIFO-очередью. Освободившийся слот передаётся первому
+    ожидающему напрямую, поэтому новые запросы не обгоняют очередь.
+    """
+
+    def __init__(
+        self, limit: int = MAX_UPSTREAM_STREAMS, max_queue: int = MAX_UPSTREAM_QUEUE
+    ):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.active = 0
+        self.rejected = 0
+        self._waiters: Deque[_Waiter] = deque()
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._waiters)
+
+    def _notify(self):
+        for position, waiter in enumerate(self._waiters, 1):
+            if waiter.on_position is not None:
+                waiter.on_position(position)
+
+    def try_acquire(self) -> bool:
+        """
+        Занимает слот, только если он свободен прямо сейчас и очереди нет.
+        """
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            return True
+        return False
+
+    async def acquire(self, on_position: Optional[Callable[[int], None]] = None):
+        """
+        Занимает слот. on_position(n) вызывается, когда запрос встал в очередь
+        и каждый раз, когда очередь продвинулась.
+        """
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            return
+        if len(self._waiters) >= self.max_queue:
+            self.rejected += 1
+            raise QueueFull()
+
+        waiter = _Waiter(asyncio.get_event_loop().create_future(), on_position)
+        self._waiters.append(waiter)
+        if on_position is not None:
+            on_position(len(self._waiters))
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # Слот уже был передан нам — отдаём его следующему
+                self.release()
+            else:
+                self._waiters.remove(waiter)
+                self._notify()
+            raise
+
+    def release(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.future.done():
+                waiter.future.set_result(None)
+                self._notify()
+                return
+        self.active -= 1
+
+    @asynccontextmanager
+    async def slot(
+        self, on_position: Optional[Callable[[int], None]] = None
+    ) -> AsyncIterator[None]:
+        await self.acquire(on_position)
+        try:
+            yield
+        finally:
+            self.release()
+
+
+class ChatTurns:
+    """
+    Очерёдность ответов внутри чата. Весь ход — от чтения истории до записи
+    ответа ассистента — выполняется под turn(chat_id), поэтому история
+    всегда чередует вопросы и ответы.
+    """
+
+    def __init__(self, policy: str = CHAT_INFLIGHT_POLICY):
+        if policy not in (POLICY_QUEUE, POLICY_CANCEL):
+            raise ValueError(f"Неизвестная политика CHAT_INFLIGHT_POLICY: {policy}")
+        self.policy = policy
+        self.cancelled = 0
+        self._locks: "weakref.WeakValueDictionary[int, asyncio.Lock]" = (
+            weakref.WeakValueDictionary()
+        )
+        self._running: Dict[int, asyncio.Task] = {}
+        self._latest: Dict[int, asyncio.Task] = {}
+
+    def _lock(self, chat_id: int) -> asyncio.Lock:
+        lock = self._locks.get(chat_id)
+        if lock is None:
+            lock = self._locks[chat_id] = asyncio.Lock()
+        return lock
+
+    @asynccontextmanager
+    async def turn(self, chat_id: int) -> AsyncIterator[None]:
+        """
+        В режиме cancel текущий ответ чата прерывается, а сообщения, которые
+        ждали своей очереди, получают Superseded — отвечаем только на последнее.
+        """
+        task = asyncio.current_task()
+        if self.policy == POLICY_CANCEL:
+            self._latest[chat_id] = task
+            running = self._running.get(chat_id)
+            if running is not None and not running.done():
+                self.cancelled += 1
+                running.cancel()
+
+        lock = self._lock(chat_id)
+        try:
+            async with lock:
+                if (
+                    self.policy == POLICY_CANCEL
+                    and self._latest.get(chat_id) is not task
+                ):
+                    raise Superseded()
+                self._running[chat_id] = task
+                try:
+                    yield
+                finally:
+                    del self._running[chat_id]
+        finally:
+            if self._latest.get(chat_id) is task:
+                del self._latest[chat_id]
@@ -0,0 +1,145 @@
+"""
+Потоковый рендер Markdown ответа ассистента в HTML для Telegram (parse_mode=HTML).
+
+Раньше каждый предпросмотр прогонял пять регулярок по всему накопленному
+ответу — квадратичная сложность по длине ответа. StreamingMarkdownRenderer
+запоминает уже отрендеренные завершённые строки и состояние открытых тегов,
+поэтому каждый вызов рендерит только новый хвост.
+
+Поддерживается то же подмножество, что и раньше: заголовки #, ##, ### (жирным),
+**жирный** и _курсив_. Дополнительно:
+
+- `_` внутри слова не считается разметкой (AMAZONE_UX_5201 остаётся как есть);
+- <, > и & экранируются;
+- незакрытые теги закрываются в конце каждой версии (и на пустой строке —
+  чтобы один лишний ** не сделал жирным весь остаток ответа), поэтому Telegram
+  всегда получает сбалансированный HTML.
+"""
+
+import re
+from typing import List, Optional, Tuple
+
+_HEADING_RE = re.compile(r"#{1,3}[ \t]+(.*)")
+_INLINE_RE = re.compile(r"\*\*|[_<>&]")
+_ESCAPES = {"<": "&lt;", ">": "&gt;", "&": "&amp;"}
+
+# Сколько последних символов уже разобранного текста сверяем, чтобы заметить,
+# что текст изменился не дописыванием в конец
+_CHECK_TAIL = 32
+
+
+def _render_inline(text: str, stack: List[str]) -> str:
+    """
+    Рендерит строку без перевода строки, изменяя стек открытых тегов.
+    """
+    out = []
+    pos = 0
+    for match in _INLINE_RE.finditer(text):
+        start = match.start()
+        out.append(text[pos:start])
+        pos = match.end()
+        token = match.group()
+
+        if token in _ESCAPES:
+            out.append(_ESCAPES[token])
+            continue
+
+        if token == "**":
+            tag = "b"
+        else:
+            prev = text[start - 1] if start else " "
+            following = text[pos] if pos < len(text) else " "
+            if "i" in stack:
+                is_tag = not prev.isspace() and not following.isalnum()
+            else:
+                is_tag = not prev.isalnum() and not following.isspace()
+            if not is_tag:
+                out.append("_")
+                continue
+            tag = "i"
+
+        if tag not in stack:
+            stack.append(tag)
+            out.append(f"<{tag}>")
+            continue
+
+        # Закрываем тег, сохраняя правильную вложенность: всё, что открыто
+        # внутри него, закрываем и открываем заново снаружи
+        inner = stack[stack.index(tag) + 1 :]
+        del stack[stack.index(tag) :]
+        out.extend(f"</{t}>" for t in reversed(inner))
+        out.append(f"</{tag}>")
+        out.extend(f"<{t}>" for t in inner)
+        stack.extend(inner)
+    out.append(text[pos:])
+    return "".join(out)
+
+
+def _close_all(stack: List[str]) -> str:
+    return "".join(f"</{tag}>" for tag in reversed(stack))
+
+
+def _render_line(line: str, stack: List[str]) -> str:
+    """
+    Рендерит одну строку (без завершающего перевода строки).
+    """
+    if not line.strip():
+        # Пустая строка завершает абзац: не переносим разметку дальше
+        closing = _close_all(stack)
+        stack.clear()
+        return closing + line
+
+    heading = _HEADING_RE.match(line)
+    if heading:
+        heading_stack: List[str] = []
+        inner = _render_inline(heading.group(1), heading_stack)
+        return f"<b>{inner}{_close_all(heading_stack)}</b>\n"
+
+    return _render_inline(line, stack)
+
+
+class StreamingMarkdownRenderer:
+    """
+    render(text) принимает весь накопленный ответ целиком и возвращает HTML.
+    Если text — продолжение предыдущего, перерендеривается только новая часть.
+    """
+
+    def __init__(self):
+        self._last: Optional[Tuple[str, str]] = None
+        self._reset()
+
+    def _reset(self):
+        self._consumed = 0
+        self._html = ""
+        self._stack: List[str] = []
+        self._checked_tail = ""
+
+    def render(self, text: str) -> str:
+        if self._last is not None and self._last[0] == text:
+            return self._last[1]
+
+        consumed = self._consumed
+        if (
+            len(text) < consumed
+            or text[max(0, consumed - _CHECK_TAIL) : consumed] != self._checked_tail
+        ):
+            self._reset()
+            consumed = 0
+
+        # Завершённые строки рендерим один раз и запоминаем
+        end = text.rfind("\n") + 1
+        if end > consumed:
+            parts = [self._html]
+            for line in text[consumed:end].split("\n")[:-1]:
+                parts.append(_render_line(line, self._stack))
+                parts.append("\n")
+            self._html = "".join(parts)
+            self._consumed = consumed = end
+            self._checked_tail = text[max(0, end - _CHECK_TAIL) : end]
+
+        # Незавершённую строку рендерим на копии состояния
+        stack = list(self._stack)
+        tail = _render_line(text[consumed:], stack) if consumed < len(text) else ""
+        html = self._html + tail + _close_all(stack)
+        self._last = (text, html)
+        return html
@@ -0,0 +1,427 @@
+"""
+Приём обновлений Telegram через webhook вместо long polling (BOT_MODE=webhook).
+
+Главный процесс — роутер: принимает POST от Telegram и пересылает обновление
+одному из воркеров по chat_id. Все обновления одного чата всегда попадают
+в один и тот же воркер, поэтому блокировки диалога, кеш истории и лимиты
+правок остаются локальными для процесса. Воркеры — отдельные процессы app.py
+со своим event loop, так бот использует все ядра машины.
+
+Несколько реплик за балансировщиком: всем роутерам передаётся одинаковый
+WEBHOOK_WORKER_URLS со списком воркеров всех реплик — тогда чат попадает
+в один и тот же воркер независимо от того, какая реплика приняла запрос.
+
+При остановке (SIGTERM) воркер перестаёт принимать обновления и ждёт
+до WEBHOOK_DRAIN_TIMEOUT секунд, пока дострумятся уже начатые ответы.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import signal
+import subprocess
+import sys
+from typing import Awaitable, Callable, List, Optional
+
+import aiohttp
+from aiogram import Bot, Dispatcher, types
+from aiohttp import web
+
+from common.metrics import CONTENT_TYPE, REGISTRY, Counter, merge_exposition
+
+logger = logging.getLogger(__name__)
+
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+# Публичный адрес бота, например https://bot.example.com. Если не задан,
+# webhook считается настроенным снаружи и setWebhook не вызывается
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_LISTEN_HOST = os.getenv("WEBHOOK_LISTEN_HOST", "0.0.0.0")
+WEBHOOK_LISTEN_PORT = int(os.getenv("WEBHOOK_LISTEN_PORT", "8080"))
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", str(os.cpu_count() or 1)))
+WEBHOOK_WORKER_LISTEN_HOST = os.getenv("WEBHOOK_WORKER_LISTEN_HOST", "127.0.0.1")
+WEBHOOK_WORKER_BASE_PORT = int(os.getenv("WEBHOOK_WORKER_BASE_PORT", "9100"))
+# Воркеры всех реплик через запятую; по умолчанию — только локальные
+WEBHOOK_WORKER_URLS = [
+    url.strip().rstrip("/")
+    for url in os.getenv("WEBHOOK_WORKER_URLS", "").split(",")
+    if url.strip()
+]
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "60"))
+
+# Номер воркера выставляет роутер при запуске дочернего процесса
+WORKER_INDEX_ENV = "BOT_WORKER_INDEX"
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+WEBHOOK_UPDATES = Counter(
+    "webhook_updates_total", "Обновления, принятые роутером", ["result"]
+)
+
+# Поля обновления, внутри которых лежит chat
+_CHAT_FIELDS = (
+    "message",
+    "edited_message",
+    "channel_post",
+    "edited_channel_post",
+    "my_chat_member",
+    "chat_member",
+    "chat_join_request",
+)
+
+
+def update_chat_id(update: dict) -> Optional[int]:
+    """
+    chat_id обновления; для обновлений без чата (inline-запросы и т.п.) —
+    id пользователя, чтобы его обновления тоже шли в один воркер.
+    """
+    for field in _CHAT_FIELDS:
+        obj = update.get(field)
+        if obj and obj.get("chat"):
+            return obj["chat"].get("id")
+    callback = update.get("callback_query")
+    if callback and callback.get("message"):
+        return callback["message"]["chat"].get("id")
+    for obj in update.values():
+        if isinstance(obj, dict):
+            user = obj.get("from") or obj.get("user")
+            if user:
+                return user.get("id")
+    return None
+
+
+def pick_worker(key: int, workers: int) -> int:
+    """
+    Детерминированный выбор воркера: одинаковый во всех процессах и репликах
+    (в отличие от hash() строк, который рандомизируется при запуске).
+    """
+    return key % workers
+
+
+def total_workers() -> int:
+    """
+    Сколько процессов делят между собой лимиты Telegram на бота:
+    в воркере webhook-режима — все воркеры всех реплик, иначе 1.
+    """
+    if os.getenv(WORKER_INDEX_ENV) is None:
+        return 1
+    return len(WEBHOOK_WORKER_URLS) or WEBHOOK_WORKERS
+
+
+def is_router() -> bool:
+    """
+    Главный процесс webhook-режима: роутер, а не воркер.
+    """
+    return BOT_MODE == "webhook" and os.getenv(WORKER_INDEX_ENV) is None
+
+
+def local_worker_urls(workers: int = WEBHOOK_WORKERS) -> List[str]:
+    return [f"http://127.0.0.1:{WEBHOOK_WORKER_BASE_PORT + i}" for i in range(workers)]
+
+
+class UpdateRouter:
+    """
+    Роутер обновлений: проверяет секрет Telegram и пересылает тело запроса
+    воркеру как есть, без разбора в объекты aiogram.
+    """
+
+    def __init__(
+        self,
+        worker_urls: List[str],
+        local_urls: List[str],
+        secret: str = WEBHOOK_SECRET,
+    ):
+        self.worker_urls = worker_urls
+        self.local_urls = local_urls
+        self.secret = secret
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=10)
+            )
+        return self._session
+
+    def worker_for(self, update: dict) -> str:
+        chat_id = update_chat_id(update)
+        key = chat_id if chat_id is not None else update.get("update_id", 0)
+        return self.worker_urls[pick_worker(key, len(self.worker_urls))]
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        if self.secret and request.headers.get(SECRET_HEADER) != self.secret:
+            WEBHOOK_UPDATES.labels("forbidden").inc()
+            return web.Response(status=403)
+        body = await request.read()
+        try:
+            update = json.loads(body)
+        except ValueError:
+            WEBHOOK_UPDATES.labels("invalid").inc()
+            return web.Response(status=400)
+
+        url = self.worker_for(update)
+        try:
+            async with self._get_session().post(
+                f"{url}/update",
+                data=body,
+                headers={"Content-Type": "application/json"},
+            ) as resp:
+                status = resp.status
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.warning(f"Воркер {url} недоступен: {e}")
+            status = 503
+
+        if status != 200:
+            # Не 2xx — Telegram повторит доставку обновления позже
+            WEBHOOK_UPDATES.labels("failed").inc()
+            return web.Response(status=503)
+        WEBHOOK_UPDATES.labels("forwarded").inc()
+        return web.Response()
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        return web.Response(text="ok")
+
+    async def handle_ready(self, request: web.Request) -> web.Response:
+        """
+        Реплика готова, когда готовы все её локальные воркеры.
+        """
+        session = self._get_session()
+        for url in self.local_urls:
+            try:
+                async with session.get(f"{url}/readyz") as resp:
+                    if resp.status != 200:
+                        return web.Response(status=503, text=f"{url} not ready")
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                return web.Response(status=503, text=f"{url} unavailable")
+        return web.Response(text="ok")
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        """
+        Метрики роутера и всех локальных воркеров (с меткой worker).
+        """
+        texts = [REGISTRY.render()]
+        session = self._get_session()
+        for url in self.local_urls:
+            try:
+                async with session.get(f"{url}/metrics") as resp:
+                    texts.append(await resp.text())
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.warning(f"Не удалось получить метрики {url}: {e}")
+        return web.Response(
+            body=merge_exposition(texts).encode("utf-8"),
+            headers={"Content-Type": CONTENT_TYPE},
+        )
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+
+class WorkerProcesses:
+    """
+    Запускает воркеры как дочерние процессы app.py и перезапускает упавшие.
+    """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._processes: List[Optional[subprocess.Popen]] = [None] * workers
+        self._stopping = False
+        self._watch_task: Optional[asyncio.Task] = None
+
+    def _spawn(self, index: int) -> subprocess.Popen:
+        env = dict(os.environ, **{WORKER_INDEX_ENV: str(index)})
+        return subprocess.Popen([sys.executable] + sys.argv, env=env)
+
+    def start(self):
+        for index in range(self.workers):
+            self._processes[index] = self._spawn(index)
+        self._watch_task = asyncio.ensure_future(self._watch())
+
+    async def _watch(self):
+        while not self._stopping:
+            await asyncio.sleep(1)
+            for index, process in enumerate(self._processes):
+                if self._stopping or process.poll() is None:
+                    continue
+                logger.error(
+                    f"Воркер {index} завершился с кодом {process.returncode}, перезапускаем"
+                )
+                self._processes[index] = self._spawn(index)
+
+    async def stop(self, timeout: float):
+        """
+        SIGTERM всем воркерам и ожидание, пока они дострумят ответы. Воркеры
+        ждутся одновременно с общим дедлайном, оставшиеся после него убиваются.
+        """
+        self._stopping = True
+        if self._watch_task is not None:
+            self._watch_task.cancel()
+        for process in self._processes:
+            if process.poll() is None:
+                process.send_signal(signal.SIGTERM)
+        deadline = asyncio.get_event_loop().time() + timeout
+        await asyncio.gather(
+            *(self._wait(process, deadline) for process in self._processes)
+        )
+        for index, process in enumerate(self._processes):
+            if process.poll() is None:
+                logger.warning(f"Воркер {index} не завершился за {timeout} с")
+                process.kill()
+                process.wait()
+
+    @staticmethod
+    async def _wait(process: subprocess.Popen, deadline: float):
+        # Опрос вместо process.wait в пуле потоков: потоков пула может быть
+        # меньше, чем воркеров, и ожидания снова шли бы по очереди
+        loop = asyncio.get_event_loop()
+        while process.poll() is None and loop.time() < deadline:
+            await asyncio.sleep(0.1)
+
+
+class UpdateWorker:
+    """
+    Воркер: принимает обновления от роутера и обрабатывает каждое в отдельной
+    задаче, сразу отвечая роутеру 200. Незавершённые задачи отслеживаются
+    для корректной остановки.
+    """
+
+    def __init__(self, dispatcher: Dispatcher):
+        self.dispatcher = dispatcher
+        self.draining = False
+        self._tasks = set()
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._tasks)
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        if self.draining:
+            return web.Response(status=503)
+        update = types.Update(**(await request.json()))
+        task = asyncio.ensure_future(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.Response()
+
+    async def _process(self, update: types.Update):
+        # Хендлеры aiogram берут бота и диспетчер из контекста
+        Bot.set_current(self.dispatcher.bot)
+        Dispatcher.set_current(self.dispatcher)
+        try:
+            await self.dispatcher.process_update(update)
+        except Exception as e:
+            logger.exception(f"Ошибка обработки обновления {update.update_id}: {e}")
+
+    async def handle_ready(self, request: web.Request) -> web.Response:
+        if self.draining:
+            return web.Response(status=503, text="draining")
+        return web.Response(text="ok")
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        return web.Response(
+            body=REGISTRY.render().encode("utf-8"),
+            headers={"Content-Type": CONTENT_TYPE},
+        )
+
+    async def drain(self, timeout: float):
+        self.draining = True
+        if not self._tasks:
+            return
+        logger.info(f"Ожидаем завершения {len(self._tasks)} обработчиков")
+        _, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            logger.warning(f"Прервано {len(pending)} обработчиков по таймауту")
+
+
+ShutdownCallback = Callable[[Dispatcher], Awaitable[None]]
+
+
+def run_worker(dispatcher: Dispatcher, index: int, on_shutdown: ShutdownCallback):
+    worker = UpdateWorker(dispatcher)
+    REGISTRY.const_labels["worker"] = str(index)
+
+    async def watch_router(app: web.Application):
+        router_pid = os.getppid()
+
+        async def watch():
+            # Роутер убит без SIGTERM — воркер не должен остаться сиротой
+            while os.getppid() == router_pid:
+                await asyncio.sleep(1)
+            logger.error(f"Роутер завершился, останавливаем воркер {index}")
+            os.kill(os.getpid(), signal.SIGTERM)
+
+        app["watch_router"] = asyncio.ensure_future(watch())
+
+    async def drain(app: web.Application):
+        await worker.drain(WEBHOOK_DRAIN_TIMEOUT)
+
+    async def cleanup(app: web.Application):
+        await on_shutdown(dispatcher)
+        await dispatcher.storage.close()
+        await dispatcher.storage.wait_closed()
+        session = await dispatcher.bot.get_session()
+        await session.close()
+
+    app = web.Application()
+    app.router.add_post("/update", worker.handle_update)
+    app.router.add_get("/readyz", worker.handle_ready)
+    app.router.add_get("/metrics", worker.handle_metrics)
+    app.on_startup.append(watch_router)
+    app.on_shutdown.append(drain)
+    app.on_cleanup.append(cleanup)
+    port = WEBHOOK_WORKER_BASE_PORT + index
+    logger.info(f"Воркер {index} слушает {WEBHOOK_WORKER_LISTEN_HOST}:{port}")
+    web.run_app(
+        app,
+        host=WEBHOOK_WORKER_LISTEN_HOST,
+        port=port,
+        print=None,
+        shutdown_timeout=WEBHOOK_DRAIN_TIMEOUT,
+    )
+
+
+def run_router(bot: Bot):
+    local_urls = local_worker_urls()
+    router = UpdateRouter(WEBHOOK_WORKER_URLS or local_urls, local_urls)
+    processes = WorkerProcesses(WEBHOOK_WORKERS)
+
+    async def startup(app: web.Application):
+        processes.start()
+        if WEBHOOK_HOST:
+            # Pending-обновления не сбрасываем: при раскатке реплик по очереди
+            # так терялись бы сообщения
+            await bot.set_webhook(
+                WEBHOOK_HOST.rstrip("/") + WEBHOOK_PATH,
+                secret_token=WEBHOOK_SECRET or None,
+            )
+            logger.info(f"Webhook установлен: {WEBHOOK_HOST}{WEBHOOK_PATH}")
+
+    async def cleanup(app: web.Application):
+        await processes.stop(WEBHOOK_DRAIN_TIMEOUT + 5)
+        await router.close()
+        session = await bot.get_session()
+        await session.close()
+
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, router.handle_update)
+    app.router.add_get("/healthz", router.handle_health)
+    app.router.add_get("/readyz", router.handle_ready)
+    app.router.add_get("/metrics", router.handle_metrics)
+    app.on_startup.append(startup)
+    app.on_cleanup.append(cleanup)
+    logger.info(
+        f"Webhook-роутер слушает {WEBHOOK_LISTEN_HOST}:{WEBHOOK_LISTEN_PORT}, "
+        f"воркеров: {len(router.worker_urls)} (локальных {WEBHOOK_WORKERS})"
+    )
+    web.run_app(app, host=WEBHOOK_LISTEN_HOST, port=WEBHOOK_LISTEN_PORT, print=None)
+
+
+def start_worker(dispatcher: Dispatcher, on_shutdown: ShutdownCallback):
+    """
+    Точка входа воркера webhook-режима (дочерний процесс с BOT_WORKER_INDEX).
+    Роутер запускается раньше, через run_router, до создания состояния бота.
+    """
+    run_worker(dispatcher, int(os.environ[WORKER_INDEX_ENV]), on_shutdown)